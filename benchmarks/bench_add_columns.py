@@ -0,0 +1,102 @@
+"""Benchmarks the vectorized add_columns() against the previous implementation with per-row Python lambdas.
+
+Run with: python benchmarks/bench_add_columns.py --n-days 730
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+
+
+def add_columns_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """The implementation of add_columns() before vectorization."""
+    df["day_of_week"] = df["Day_Hours"].dt.dayofweek
+    df["hour"] = df["Day_Hours"].dt.hour + (
+        (df["Day_Hours"].dt.minute.astype("float") // 30) / 2
+    )
+    df["hour_format"] = df["Day_Hours"].dt.time.astype(str).str[:5]
+    df["Day"] = df["Day_Hours"].dt.date
+    df["trend"] = df["Day"].apply(lambda x: x.toordinal())
+    df["trend"] = df["trend"] - df["trend"].min()
+    df["week"] = df["Day_Hours"].astype("datetime64[ns]").dt.strftime("%Y-%W")
+
+    avg_daily_price = df.groupby("Day")[["price"]].mean().reset_index()
+    avg_daily_price = avg_daily_price.sort_values(by="Day")
+
+    avg_daily_price["avg_daily_price_lag1"] = avg_daily_price["price"].shift(1).bfill()
+    avg_daily_price["avg_daily_price_lag2"] = avg_daily_price["price"].shift(2).bfill()
+    avg_daily_price["avg_daily_price_lag3"] = avg_daily_price["price"].shift(3).bfill()
+    del avg_daily_price["price"]
+
+    df = df.merge(avg_daily_price, on="Day", how="inner")
+    df["is_last"] = np.where(df["Day"] == df["Day"].max(), 1, 0)
+
+    return df
+
+
+def measure(fn, df: pd.DataFrame, repeat: int) -> dict:
+    """Returns the best wall time, the peak traced allocation and the size of the result of fn(df)."""
+    times = []
+    for _ in range(repeat):
+        df_in = df.copy()
+        start = time.perf_counter()
+        fn(df_in)
+        times.append(time.perf_counter() - start)
+
+    df_in = df.copy()
+    tracemalloc.start()
+    result = fn(df_in)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": min(times),
+        "peak_alloc_mb": peak / 2**20,
+        "result_mb": result.memory_usage(deep=True).sum() / 2**20,
+    }
+
+
+def assert_equivalent(legacy: pd.DataFrame, vectorized: pd.DataFrame) -> None:
+    """Checks that both implementations produce the same feature values."""
+    assert list(legacy.columns) == list(vectorized.columns)
+    for column in legacy.columns:
+        expected = legacy[column]
+        actual = vectorized[column]
+        if column == "Day":
+            actual = actual.dt.date
+        elif column in ("hour_format", "week"):
+            actual = actual.astype(str)
+        assert expected.tolist() == actual.tolist(), column
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-days", type=int, default=730)
+    parser.add_argument("--freq", default="30min")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = (
+        make_wide_df(n_stations=1, n_days=args.n_days, freq=args.freq, sortes=["e5"])
+        .rename(columns={"e5_0": "price"})
+        .dropna()
+        .reset_index(drop=True)
+    )
+    assert_equivalent(add_columns_legacy(df.copy()), add_columns(df))
+
+    results = {
+        "rows": len(df),
+        "legacy": measure(add_columns_legacy, df, args.repeat),
+        "vectorized": measure(add_columns, df, args.repeat),
+    }
+    results["speedup"] = results["legacy"]["seconds"] / results["vectorized"]["seconds"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
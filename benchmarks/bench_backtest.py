@@ -0,0 +1,136 @@
+"""Benchmarks the rolling-origin backtest against a loop which loads the window of every cutoff and recomputes its features.
+
+The loop calls load_station_sorte(), add_columns(), filter_n_days_before() and forecast_sklearn() per series and cutoff, as done before models.backtest existed.
+The backtest computes the features once per series and fits on slices of the feature matrix.
+Both are run with the estimator --estimator of --config, the loop only on --loop-cutoffs cutoffs and extrapolated.
+
+Run with: python benchmarks/bench_backtest.py --n-stations 20 --n-days 400 --n-cutoffs 365 --estimator-class numpy --estimator Ridge
+"""
+import argparse
+import datetime
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.data_handler.streaming import iter_feature_frames
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+from tpa_analytics_engine.models.backtest import backtest
+from tpa_analytics_engine.models.backtest import backtest_metrics
+from tpa_analytics_engine.models.models_config import create_forecast_config
+from tpa_analytics_engine.models.models_config import Estimator_Config
+from tpa_analytics_engine.models.models_config import Executor_Config
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.utils import get_config
+
+
+def loop_backtest(source, data_config, forecast_config, pairs, cutoffs) -> int:
+    """Forecasts every cutoff of every pair from a freshly loaded window and returns the number of forecasted rows."""
+    n_rows = 0
+    for station, sorte in pairs:
+        raw_df = load_station_sorte(
+            pandas_connection=source,
+            data_config=data_config,
+            station=station,
+            sorte=sorte,
+            add_pred=False,
+        )
+        for cutoff in cutoffs:
+            df = filter_n_days_before(
+                add_columns(
+                    raw_df[raw_df["Day_Hours"] < cutoff + pd.Timedelta(days=1)]
+                ),
+                n_before=forecast_config.n_before,
+            )
+            n_rows += int(
+                forecast_sklearn(df=df, forecast_config=forecast_config)["pred"]
+                .notna()
+                .sum()
+            )
+    return n_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--n-stations", type=int, default=20)
+    parser.add_argument("--n-days", type=int, default=400)
+    parser.add_argument("--n-cutoffs", type=int, default=365)
+    parser.add_argument("--loop-cutoffs", type=int, default=5)
+    parser.add_argument("--config", default="test/test_config.yaml")
+    parser.add_argument("--estimator-class", default="sklearn")
+    parser.add_argument("--estimator", default="HistGradientBoostingRegressor")
+    parser.add_argument("--backend", default="process")
+    parser.add_argument("--n-jobs", type=int, default=4)
+    args = parser.parse_args()
+
+    config_forecast = create_forecast_config(get_config(args.config))
+    base_estimator = next(iter(config_forecast.estimators["sklearn"].values()))
+    estimator_config = Estimator_Config(
+        estimator_type=args.estimator,
+        estimator_kwargs=base_estimator.estimator_kwargs
+        if args.estimator_class == "sklearn"
+        else {},
+        exogenous_vars=base_estimator.exogenous_vars,
+    )
+    forecast_config = config_forecast.model_copy(
+        update={
+            "use_estimator_class": args.estimator_class,
+            "use_estimator": "benchmark",
+            "estimators": {args.estimator_class: {"benchmark": estimator_config}},
+            "executor": Executor_Config(backend=args.backend, n_jobs=args.n_jobs),
+        }
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_wide_df(
+            n_stations=args.n_stations,
+            n_days=args.n_days,
+            sortes=["e5"],
+            end=datetime.date.today() - datetime.timedelta(days=1),
+        ).to_feather(Path(directory) / "BASE_df_wide.ftr")
+        source = ArrowFileSource(directory)
+        data_config = Data_Config(
+            df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+        )
+        pairs = [(str(i), "e5") for i in range(args.n_stations)]
+
+        start = time.perf_counter()
+        predictions = backtest(
+            frames=iter_feature_frames(
+                pandas_connection=source, data_config=data_config, add_pred=False
+            ),
+            forecast_config=forecast_config,
+            n_cutoffs=args.n_cutoffs,
+        )
+        backtest_seconds = time.perf_counter() - start
+
+        last_day = pd.Timestamp(datetime.date.today() - datetime.timedelta(days=1))
+        loop_cutoffs = [
+            last_day - pd.Timedelta(days=i) for i in range(args.loop_cutoffs)
+        ]
+        start = time.perf_counter()
+        loop_backtest(source, data_config, forecast_config, pairs, loop_cutoffs)
+        loop_seconds = (
+            (time.perf_counter() - start) * args.n_cutoffs / len(loop_cutoffs)
+        )
+
+    print(
+        f"{args.n_stations} series x {args.n_cutoffs} cutoffs, {args.estimator_class}.{args.estimator}, "
+        f"{args.backend} x {args.n_jobs}"
+    )
+    print(f"{'backtest':<28} {backtest_seconds:10.1f} s")
+    print(f"{'loop (extrapolated, serial)':<28} {loop_seconds:10.1f} s")
+    print(backtest_metrics(predictions, by=["horizon"]))
+
+
+if __name__ == "__main__":
+    main()
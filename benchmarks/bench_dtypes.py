@@ -0,0 +1,121 @@
+"""Benchmarks the memory of the working set of one series with the "default" and "compact" dtype policies of add_columns().
+
+For both policies, the deep memory of the feature df and the peak memory traced by tracemalloc while filtering it and while selecting the training and prediction rows are reported.
+The legacy filter_n_days_before() and the legacy selection of forecast_sklearn(), which copied the selected rows twice, are measured as reference.
+
+Run with: python benchmarks/bench_dtypes.py --n-days 730
+"""
+import argparse
+import datetime
+import functools
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+
+EXOGENOUS_VARS = [
+    "avg_daily_price_lag1",
+    "avg_daily_price_lag2",
+    "avg_daily_price_lag3",
+    "trend",
+    "day_of_week",
+    "hour",
+]
+
+
+def filter_n_days_before_legacy(df: pd.DataFrame, n_before: int) -> pd.DataFrame:
+    """The former filter_n_days_before(), which copied the filtered rows a second time."""
+    day = df["Day"]
+    max_Date = day.max()
+    min_Date = max_Date - datetime.timedelta(days=n_before - 1)
+    return df[(day >= min_Date) & (day <= max_Date)].copy()
+
+
+def prepare_legacy(df: pd.DataFrame) -> tuple:
+    """The former selection of the training and prediction rows of forecast_sklearn()."""
+    y_train = df.loc[df.is_last == 0, "price"].reset_index(drop=True)
+    X_train = df.loc[df.is_last == 0, EXOGENOUS_VARS].reset_index(drop=True)
+    X_pred = df.loc[df.is_last == 1, EXOGENOUS_VARS].reset_index(drop=True)
+    return X_train, y_train, X_pred
+
+
+def prepare(df: pd.DataFrame) -> tuple:
+    """The selection of the training and prediction rows of forecast_sklearn()."""
+    is_train = df["is_last"].to_numpy() == 0
+    return (
+        df.loc[is_train, EXOGENOUS_VARS],
+        df.loc[is_train, "price"],
+        df.loc[~is_train, EXOGENOUS_VARS],
+    )
+
+
+def traced_peak(fn: Callable) -> int:
+    """Returns the peak of the memory allocated by fn above the memory allocated before, as traced by tracemalloc."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--n-days", type=int, default=730)
+    parser.add_argument("--n-before", type=int, default=None)
+    parser.add_argument("--freq", default="30min")
+    args = parser.parse_args()
+    n_before = args.n_before or args.n_days
+
+    df = (
+        make_wide_df(n_stations=1, n_days=args.n_days, freq=args.freq, sortes=["e5"])
+        .rename(columns={"e5_0": "price"})
+        .dropna()
+    )
+    print(f"{len(df)} rows, n_before={n_before}")
+    print(
+        f"{'variant':<24} {'df MB':>8} {'filter peak MB':>16} {'prepare peak MB':>16}"
+    )
+
+    variants = [
+        (
+            "legacy copies, default",
+            "default",
+            filter_n_days_before_legacy,
+            prepare_legacy,
+        ),
+        ("default", "default", filter_n_days_before, prepare),
+        ("compact", "compact", filter_n_days_before, prepare),
+    ]
+    for name, dtype_policy, filter_fn, prepare_fn in variants:
+        features_df = add_columns(df, dtype_policy=dtype_policy)
+        frame_bytes = features_df.memory_usage(deep=True).sum()
+        filter_peak = traced_peak(
+            functools.partial(filter_fn, df=features_df, n_before=n_before)
+        )
+        window_df = filter_fn(df=features_df, n_before=n_before)
+        prepare_peak = traced_peak(functools.partial(prepare_fn, window_df))
+        print(
+            f"{name:<24} {frame_bytes / 2**20:8.2f} {filter_peak / 2**20:16.2f} {prepare_peak / 2**20:16.2f}"
+        )
+
+    default_df = add_columns(df)
+    compact_df = add_columns(df, dtype_policy="compact")
+    max_difference = np.abs(
+        default_df[EXOGENOUS_VARS].to_numpy() - compact_df[EXOGENOUS_VARS].to_numpy()
+    ).max()
+    print(f"max absolute difference of the compact features: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
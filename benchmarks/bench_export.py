@@ -0,0 +1,109 @@
+"""Benchmarks serving a fitted HistGradientBoostingRegressor from its pickle with sklearn against serving its export with models.export.
+
+Every variant runs in a fresh process, which loads the model and predicts the rows of one prediction day,
+and reports its import and load time, its resident set size and the best time of a predict.
+
+Run with: python benchmarks/bench_export.py --n-days 365
+"""
+import argparse
+import json
+import pickle
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+from tpa_analytics_engine.models.export import CompiledEnsemble
+from tpa_analytics_engine.models.export import export_estimator
+from tpa_analytics_engine.models.models_config import create_forecast_config
+from tpa_analytics_engine.utils import get_config
+
+# The code run in the fresh process, {load} loads the model as "model" from {path}
+SERVING_CODE = """
+import time
+start = time.perf_counter()
+import json
+import numpy as np
+from tpa_analytics_engine.utils import get_rss_bytes
+{load}
+load_seconds = time.perf_counter() - start
+X = np.load({x_path!r})
+times = []
+for _ in range({repeat}):
+    predict_start = time.perf_counter()
+    model.predict(X)
+    times.append(time.perf_counter() - predict_start)
+print(json.dumps({{"load_seconds": load_seconds, "predict_seconds": min(times), "rss_mb": get_rss_bytes() / 2**20}}))
+"""
+
+LOADERS = {
+    "sklearn pickle": "import pickle\nwith open({path!r}, 'rb') as file:\n    model = pickle.load(file)",
+    "export (mmap)": "from tpa_analytics_engine.models.export import CompiledEnsemble\nmodel = CompiledEnsemble.load({path!r})",
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--n-days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--config", default="test/test_config.yaml")
+    args = parser.parse_args()
+
+    forecast_config = create_forecast_config(get_config(args.config))
+    estimator_config = forecast_config.estimators["sklearn"]["estimator1"]
+    df = add_columns(
+        make_wide_df(
+            n_stations=1, n_days=args.n_days, sortes=["e5"], missing_share=0
+        ).rename(columns={"e5_0": "price"})
+    )
+    X = df[estimator_config.exogenous_vars].to_numpy(dtype=np.float64)
+    is_last = df["is_last"].to_numpy() == 1
+    estimator = HistGradientBoostingRegressor(**estimator_config.estimator_kwargs)
+    estimator.fit(X[~is_last], df["price"].to_numpy()[~is_last])
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {
+            "sklearn pickle": str(Path(directory) / "model.pkl"),
+            "export (mmap)": str(Path(directory) / "model.npz"),
+        }
+        with open(paths["sklearn pickle"], "wb") as file:
+            pickle.dump(estimator, file)
+        export_estimator(estimator=estimator, path=paths["export (mmap)"])
+        x_path = str(Path(directory) / "X.npy")
+        np.save(x_path, X[is_last])
+        assert np.array_equal(
+            CompiledEnsemble.load(paths["export (mmap)"]).predict(X[is_last]),
+            estimator.predict(X[is_last]),
+        )
+
+        print(
+            f"{estimator.n_iter_} trees, {int(is_last.sum())} rows per predict, "
+            f"pickle {Path(paths['sklearn pickle']).stat().st_size / 1024:.0f} KiB, "
+            f"export {Path(paths['export (mmap)']).stat().st_size / 1024:.0f} KiB"
+        )
+        for name, load in LOADERS.items():
+            code = SERVING_CODE.format(
+                load=load.format(path=paths[name]), x_path=x_path, repeat=args.repeat
+            )
+            result = json.loads(
+                subprocess.run(
+                    [sys.executable, "-c", code],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+            )
+            print(
+                f"{name:<16} import+load {result['load_seconds'] * 1e3:8.1f} ms   "
+                f"rss {result['rss_mb']:7.1f} MB   predict {result['predict_seconds'] * 1e3:6.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmarks the cold import of tpa_analytics_engine.api and checks that the heavy optional modules are not imported.
+
+Every import is measured in a fresh interpreter. The median wall time and the slowest modules of python -X importtime are reported.
+The benchmark fails if a forbidden module is imported or the median exceeds --max-seconds.
+
+Run with: python benchmarks/bench_import.py --repeat 5 --max-seconds 2
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import List
+from typing import Tuple
+
+# The modules which must only be imported when an estimator or the OCI backend is used
+FORBIDDEN_MODULES = ["sklearn", "scipy", "cloud_storage_wrapper", "oci"]
+
+MEASURE_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(m.split(".")[0] for m in sys.modules)}}))
+"""
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """Imports module in a fresh interpreter and returns the wall time and the imported top-level modules."""
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE_CODE.format(module=module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["seconds"], result["modules"]
+
+
+def slowest_imports(module: str, n: int = 10) -> List[Tuple[int, str]]:
+    """Returns the n modules with the largest cumulative import time in microseconds, measured with python -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((int(cumulative), name.strip()))
+    return sorted(times, reverse=True)[:n]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--module", default="tpa_analytics_engine.api")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    seconds = []
+    for _ in range(args.repeat):
+        import_seconds, modules = measure_import(args.module)
+        seconds.append(import_seconds)
+    forbidden = sorted(set(FORBIDDEN_MODULES) & set(modules))
+    median = statistics.median(seconds)
+
+    print(f"import {args.module}: median {median:.3f}s over {args.repeat} runs")
+    for cumulative, name in slowest_imports(args.module):
+        print(f"{cumulative / 1e6:9.3f}s  {name}")
+
+    failed = False
+    if forbidden:
+        print(f"FAILED: forbidden modules were imported: {forbidden}")
+        failed = True
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"FAILED: the median exceeds {args.max_seconds:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmarks the serving path predict_last() against filter_n_days_before() and forecast_sklearn() on the df of one series.
+
+Both are measured with a warm model cache, as in the forecast server, where the fit is skipped and the pandas overhead dominates, and without one.
+
+Run with: python benchmarks/bench_serving.py --n-days 365 --estimator-class numpy --estimator Ridge
+"""
+import argparse
+import functools
+import time
+
+import numpy as np
+from tpa_analytics_engine.data_handler.prepare_forecast_format import _add_pred_rows
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+from tpa_analytics_engine.models.model_cache import ModelCache
+from tpa_analytics_engine.models.models_config import create_forecast_config
+from tpa_analytics_engine.models.models_config import Estimator_Config
+from tpa_analytics_engine.models.models_config import Model_Cache_Config
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.models.sklearn import predict_last
+from tpa_analytics_engine.utils import get_config
+
+
+def best_seconds(fn, repeat: int) -> float:
+    """Returns the best wall time of repeat calls of fn()."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--n-days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--config", default="test/test_config.yaml")
+    parser.add_argument("--estimator-class", default="sklearn")
+    parser.add_argument("--estimator", default="HistGradientBoostingRegressor")
+    args = parser.parse_args()
+
+    config_forecast = create_forecast_config(get_config(args.config))
+    base_estimator = next(iter(config_forecast.estimators["sklearn"].values()))
+    forecast_config = config_forecast.model_copy(
+        update={
+            "use_estimator_class": args.estimator_class,
+            "use_estimator": "benchmark",
+            "estimators": {
+                args.estimator_class: {
+                    "benchmark": Estimator_Config(
+                        estimator_type=args.estimator,
+                        estimator_kwargs=base_estimator.estimator_kwargs
+                        if args.estimator_class == "sklearn"
+                        else {},
+                        exogenous_vars=base_estimator.exogenous_vars,
+                    )
+                }
+            },
+        }
+    )
+    wide_df = make_wide_df(
+        n_stations=1, n_days=args.n_days, sortes=["e5"], missing_share=0.0
+    )
+    df = add_columns(
+        _add_pred_rows(wide_df.rename(columns={"e5_0": "price"}), "Day_Hours")
+    )
+    n_before = forecast_config.n_before
+
+    def forecast_loc(model_cache):
+        forecast_df = forecast_sklearn(
+            df=filter_n_days_before(df, n_before=n_before),
+            forecast_config=forecast_config,
+            model_cache=model_cache,
+            series_id="e5_0",
+        )
+        return forecast_df.loc[forecast_df.is_last == 1, "pred"].to_numpy()
+
+    def forecast_arrays(model_cache):
+        return predict_last(
+            df=df,
+            forecast_config=forecast_config,
+            model_cache=model_cache,
+            series_id="e5_0",
+            n_before=n_before,
+        )
+
+    max_difference = np.abs(forecast_loc(None) - forecast_arrays(None)).max()
+    print(
+        f"{args.estimator_class}.{args.estimator}, {args.n_days} days, n_before {n_before}, "
+        f"max difference {max_difference:.2e}"
+    )
+    for name, model_cache, repeat in [
+        ("warm model cache", ModelCache(Model_Cache_Config()), args.repeat),
+        ("without model cache", None, max(args.repeat // 10, 1)),
+    ]:
+        loc_seconds = best_seconds(functools.partial(forecast_loc, model_cache), repeat)
+        array_seconds = best_seconds(
+            functools.partial(forecast_arrays, model_cache), repeat
+        )
+        print(
+            f"{name:<22} forecast_sklearn {loc_seconds * 1e3:8.2f} ms   "
+            f"predict_last {array_seconds * 1e3:8.2f} ms   {loc_seconds / array_seconds:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Benchmarks the load -> features -> fit -> predict pipeline offline on a synthetic wide df.
+
+The synthetic df is shaped like BASE_df_wide.ftr and read through an ArrowFileSource, which stands in for PandasOCI.
+For every stage, the wall time, the peak resident set size and the rows per second are reported and saved as JSON.
+
+Run with: python benchmarks/run_benchmarks.py --n-stations 200 --n-days 365 --output bench.json
+Compare two runs with: python benchmarks/run_benchmarks.py --compare old.json new.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import pandas as pd
+import sklearn
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+from tpa_analytics_engine.explorative.summaries import summarize
+from tpa_analytics_engine.models.models_config import create_forecast_config
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.utils import get_config
+from tpa_analytics_engine.utils import get_rss_bytes
+
+STAGES = [
+    "load_station_sorte",
+    "add_columns",
+    "filter_n_days_before",
+    "forecast_sklearn",
+    "summarize",
+]
+
+
+class PeakRSSSampler:
+    def __init__(self, interval: float = 0.002) -> None:
+        """Samples the resident set size in a background thread and keeps the peak."""
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "PeakRSSSampler":
+        self.peak = get_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss_bytes())
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss_bytes())
+
+
+def run_stage(stage: str, fn: Callable, results: Dict[str, dict]):
+    """Runs fn, adds its wall time, peak RSS and row count to results[stage] and returns its result."""
+    with PeakRSSSampler() as sampler:
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+    results[stage]["seconds"] += seconds
+    results[stage]["rows"] += len(result)
+    results[stage]["peak_rss_mb"] = max(
+        results[stage]["peak_rss_mb"], sampler.peak / 2**20
+    )
+    return result
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    """Runs every stage for args.n_series series of a synthetic wide df and returns the results."""
+    config = get_config(args.config)
+    forecast_config = create_forecast_config(config)
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+    )
+    sortes: List[str] = args.sortes.split(",")
+
+    with tempfile.TemporaryDirectory() as directory:
+        wide_df = make_wide_df(
+            n_stations=args.n_stations,
+            n_days=args.n_days,
+            freq=args.freq,
+            sortes=sortes,
+            seed=args.seed,
+        )
+        wide_df.to_feather(Path(directory) / data_config.df_path)
+        shape = wide_df.shape
+        del wide_df
+        source = ArrowFileSource(directory)
+
+        results: Dict[str, dict] = defaultdict(
+            lambda: {"seconds": 0.0, "rows": 0, "peak_rss_mb": 0.0}
+        )
+        pairs = [
+            (str(station), sorte)
+            for station in range(args.n_stations)
+            for sorte in sortes
+        ][: args.n_series]
+        for station, sorte in pairs:
+            df = run_stage(
+                "load_station_sorte",
+                functools.partial(
+                    load_station_sorte,
+                    pandas_connection=source,
+                    data_config=data_config,
+                    station=station,
+                    sorte=sorte,
+                    add_pred=True,
+                ),
+                results,
+            )
+            df = run_stage("add_columns", functools.partial(add_columns, df), results)
+            df_window = run_stage(
+                "filter_n_days_before",
+                functools.partial(
+                    filter_n_days_before, df=df, n_before=forecast_config.n_before
+                ),
+                results,
+            )
+            run_stage(
+                "forecast_sklearn",
+                functools.partial(
+                    forecast_sklearn, df=df_window, forecast_config=forecast_config
+                ),
+                results,
+            )
+            # Bind df as a default argument, so the timed stage includes the selection of the training rows
+            run_stage(
+                "summarize",
+                lambda df=df: summarize(
+                    df=df[df.is_last == 0], groupCol="hour", aggCol="price"
+                ),
+                results,
+            )
+
+    for stage_results in results.values():
+        stage_results["rows_per_second"] = stage_results["rows"] / max(
+            stage_results["seconds"], 1e-9
+        )
+
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+            "wide_df_shape": list(shape),
+            **{key: value for key, value in vars(args).items() if key != "compare"},
+        },
+        "stages": {stage: results[stage] for stage in STAGES},
+    }
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Prints the relative change of the wall time of every stage and returns the number of regressions beyond threshold."""
+    with open(old_path) as file:
+        old = json.load(file)["stages"]
+    with open(new_path) as file:
+        new = json.load(file)["stages"]
+
+    regressions = 0
+    for stage in STAGES:
+        if stage not in old or stage not in new:
+            continue
+        change = new[stage]["seconds"] / max(old[stage]["seconds"], 1e-9) - 1
+        flag = "REGRESSION" if change > threshold else ""
+        regressions += change > threshold
+        print(
+            f"{stage:<22} {old[stage]['seconds']:9.3f}s -> {new[stage]['seconds']:9.3f}s {change:+7.1%} {flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--n-stations", type=int, default=50)
+    parser.add_argument("--n-days", type=int, default=365)
+    parser.add_argument("--freq", default="30min")
+    parser.add_argument("--sortes", default="diesel,e5,e10")
+    parser.add_argument(
+        "--n-series", type=int, default=10, help="The number of series to run."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--output", default=None, help="The JSON file to write.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        sys.exit(1 if compare(*args.compare, threshold=args.threshold) else 0)
+
+    results = run_benchmarks(args)
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,422 @@
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
 import pandas as pd
-from cloud_storage_wrapper.oci_access.pandas import PandasOCI
+from tpa_analytics_engine.config import load_config
+from tpa_analytics_engine.config import Loaded_Config
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.cache import create_cached_connection
+from tpa_analytics_engine.data_handler.feature_store import FeatureStore
+from tpa_analytics_engine.data_handler.feature_store import source_version
 from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
 from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
 from tpa_analytics_engine.data_handler.prepare_forecast_format import (
     filter_n_days_before,
 )
 from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    load_stations_sortes,
+)
+from tpa_analytics_engine.data_handler.streaming import iter_feature_frames
+from tpa_analytics_engine.data_handler.streaming import list_pairs
+from tpa_analytics_engine.data_handler.streaming import stream_forecasts
 from tpa_analytics_engine.explorative.summaries import mean_centralize
 from tpa_analytics_engine.explorative.summaries import summarize
+from tpa_analytics_engine.explorative.summaries import summarize_many
+from tpa_analytics_engine.instrumentation import instrumented_method
+from tpa_analytics_engine.instrumentation import MetricsSink
+from tpa_analytics_engine.models.backtest import backtest
 from tpa_analytics_engine.models.make_forecast import run
-from tpa_analytics_engine.models.models_config import create_forecast_config
-from tpa_analytics_engine.utils import get_config
+from tpa_analytics_engine.models.make_forecast import run_many
+from tpa_analytics_engine.models.model_cache import ModelCache
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import create_tuning_config
+from tpa_analytics_engine.models.models_config import Tuning_Config
+from tpa_analytics_engine.models.tuning import tune
+from tpa_analytics_engine.models.tuning import Tuning_Result
+
+
+def create_pandas_connection(config_dict: dict, data_config: Data_Config):
+    """Creates the connection from which the dfs are retrieved: an ArrowFileSource if local_dir is configured, otherwise a PandasOCI connection, cached if configured.
+
+    Args:
+        config_dict (dict): The config containing the oci_config.
+        data_config (Data_Config): The data configuration.
+
+    Returns:
+        The connection with a retrieve_df() method.
+    """
+    if data_config.local_dir is not None:
+        return ArrowFileSource(data_config.local_dir)
+    # Import the OCI backend only when it is used
+    from cloud_storage_wrapper.oci_access.pandas import PandasOCI
+
+    return create_cached_connection(
+        pandas_connection=PandasOCI(**config_dict.get("oci_config")),  # type: ignore
+        cache_config=data_config.cache,
+    )
 
 
 class Forecast:
-    def __init__(self, config_path: str) -> None:
+    def __init__(
+        self,
+        config_path: str,
+        metrics_sink: Optional[MetricsSink] = None,
+        config_snapshot_dir: Optional[str] = None,
+    ) -> None:
         """Initializes a Forecast class object, which can be used to create forecasts using the config and functionality of the package.
+        The validated config is shared by all Forecast objects of the same config file in the process, see load_config().
 
         Args:
             config_path (str): The path to the config YAML file.
+            metrics_sink (Optional[MetricsSink], optional): A sink receiving the duration, rows, bytes read and memory of every stage run by the methods, e.g. an InMemoryCollector or a PrometheusExporter.
+                Defaults to None, i.e. no stage is measured.
+            config_snapshot_dir (Optional[str], optional): A directory of JSON snapshots of the validated configs, from which new processes load the config without parsing the YAML.
+                Defaults to None, i.e. no snapshots.
         """
         self.config_path = config_path
-        self.configDict = get_config(config_path=self.config_path)
-        self.data_config = Data_Config(**self.configDict.get("data_config"))  # type: ignore
-        self.pandas_connection = PandasOCI(**self.configDict.get("oci_config"))  # type: ignore
-        self.forecast_config = create_forecast_config(self.configDict)
+        self.metrics_sink = metrics_sink
+        self.config_snapshot_dir = config_snapshot_dir
+        self.loaded_config = load_config(
+            config_path=self.config_path, snapshot_dir=self.config_snapshot_dir
+        )
+        self._apply_config(self.loaded_config)
         self.df: pd.DataFrame = pd.DataFrame()
+        self.series_id = ""
+        self.long_df: pd.DataFrame = pd.DataFrame()
+
+    def reload_config(self) -> bool:
+        """Reloads the config if its file changed since it was loaded (hot reload).
+        The connection and feature store are only recreated if the data configuration or the oci_config changed and the model cache if its configuration changed,
+        since its fitted estimators are keyed by the estimator configuration.
+
+        Returns:
+            bool: True if the validated config changed.
+        """
+        loaded = load_config(
+            config_path=self.config_path, snapshot_dir=self.config_snapshot_dir
+        )
+        if loaded is self.loaded_config:
+            return False
+        previous, self.loaded_config = self.loaded_config, loaded
+        if loaded == previous:
+            return False
+        self._apply_config(loaded, previous=previous)
+        return True
 
-    def load_df(self, station: str, sorte: str) -> None:
+    def _apply_config(
+        self, loaded: Loaded_Config, previous: Optional[Loaded_Config] = None
+    ) -> None:
+        """Sets the configurations of loaded and creates the connection, model cache and feature store which changed compared to previous."""
+        self.configDict = loaded.config_dict
+        self.data_config = loaded.data_config
+        self.forecast_config = loaded.forecast_config
+        if (
+            previous is None
+            or loaded.data_config != previous.data_config
+            or loaded.config_dict.get("oci_config")
+            != previous.config_dict.get("oci_config")
+        ):
+            self.pandas_connection = create_pandas_connection(
+                config_dict=self.configDict, data_config=self.data_config
+            )
+            self.feature_store = (
+                None
+                if self.data_config.feature_store is None
+                else FeatureStore(self.data_config.feature_store)
+            )
+        if (
+            previous is None
+            or loaded.forecast_config.model_cache
+            != previous.forecast_config.model_cache
+        ):
+            self.model_cache = (
+                None
+                if self.forecast_config.model_cache is None
+                else ModelCache(self.forecast_config.model_cache)
+            )
+
+    @instrumented_method("Forecast.load_df")
+    def load_df(
+        self, station: str, sorte: str, only_forecast_window: bool = False
+    ) -> None:
         """Loads the df for passed station and sorte
 
         Args:
             station (str): The short id of the station to load.
             sorte (str): The type of gas for which to load the price
+            only_forecast_window (bool, optional): If True and the df is read from local_dir or the feature store, only the n_before days needed by create_forecast() are read.
+                The summaries then only cover these days. Defaults to False.
         """
+        self.series_id = f"{sorte}_{station}"
+        if self.feature_store is not None:
+            self.df = self.read_features(
+                station=station,
+                sorte=sorte,
+                n_before=self.forecast_config.n_before
+                if only_forecast_window
+                else None,
+            )
+            return
         self.df = add_columns(
-            load_station_sorte(
+            df=load_station_sorte(
                 pandas_connection=self.pandas_connection,
                 data_config=self.data_config,
                 station=station,
                 sorte=sorte,
                 add_pred=True,
+                n_before=self.forecast_config.n_before
+                if only_forecast_window
+                else None,
+            ),
+            dtype_policy=self.data_config.dtype_policy,
+            horizon_days=self.data_config.horizon_days,
+        )
+
+    def read_features(
+        self, station: str, sorte: str, n_before: Optional[int] = None
+    ) -> pd.DataFrame:
+        """Reads the feature df of station and sorte from the feature store, rebuilding it first if new raw data landed since it was stored.
+        A forecast of stored features is a read-only lookup plus predict.
+
+        Args:
+            station (str): The short id of the station.
+            sorte (str): The type of gas.
+            n_before (Optional[int], optional): The number of days to read before the last day. Defaults to None, i.e. all days.
+
+        Raises:
+            ValueError: If no feature store is configured.
+
+        Returns:
+            pd.DataFrame: The df with the columns of add_columns().
+        """
+        if self.feature_store is None:
+            raise ValueError("No feature store is configured.")
+        version = source_version(
+            pandas_connection=self.pandas_connection, data_config=self.data_config
+        )
+        if not self.feature_store.is_current(station, sorte, version):
+            self.feature_store.write(
+                station=station,
+                sorte=sorte,
+                df=add_columns(
+                    df=load_station_sorte(
+                        pandas_connection=self.pandas_connection,
+                        data_config=self.data_config,
+                        station=station,
+                        sorte=sorte,
+                        add_pred=True,
+                    ),
+                    dtype_policy=self.data_config.dtype_policy,
+                    horizon_days=self.data_config.horizon_days,
+                ),
+                version=version,
             )
+        return self.feature_store.read(station=station, sorte=sorte, n_before=n_before)
+
+    @instrumented_method("Forecast.load_dfs")
+    def load_dfs(self, pairs: List[Tuple[str, str]]) -> None:
+        """Loads the dfs for all passed (station, sorte) pairs with a single read and stores them as one long df.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The (station, sorte) pairs to load.
+        """
+        long_df = load_stations_sortes(
+            pandas_connection=self.pandas_connection,
+            data_config=self.data_config,
+            pairs=pairs,
+            add_pred=True,
+        )
+        self.long_df = pd.concat(
+            [
+                add_columns(
+                    df=series_df,
+                    dtype_policy=self.data_config.dtype_policy,
+                    horizon_days=self.data_config.horizon_days,
+                )
+                for _, series_df in long_df.groupby(["station", "sorte"], sort=False)
+            ],
+            ignore_index=True,
         )
 
+    @instrumented_method("Forecast.create_forecast")
     def create_forecast(self) -> pd.DataFrame:
         """Creates a forecast for the previously loaded df.
 
         Raises:
-            ValueError: If self.df is empty, i.e. no df was loaded.
+            ValueError: If the forecast configuration is in the "global" mode or self.df is empty, i.e. no df was loaded.
 
         Returns:
             pd.DataFrame: The data frame with the forecast.
         """
+        check_local_mode(self.forecast_config, "Forecast.create_forecast()")
         if len(self.df) == 0:
             raise ValueError("No df is loaded in the object.")
         else:
             currentDF = filter_n_days_before(
                 df=self.df, n_before=self.forecast_config.n_before
             )
-        return run(df=currentDF, forecast_config=self.forecast_config)
+        return run(
+            df=currentDF,
+            forecast_config=self.forecast_config,
+            model_cache=self.model_cache,
+            series_id=self.series_id,
+        )
+
+    @instrumented_method("Forecast.create_forecasts")
+    def create_forecasts(
+        self, pairs: Optional[List[Tuple[str, str]]] = None
+    ) -> pd.DataFrame:
+        """Creates the forecasts for several stations and sortes and combines them in one df.
 
+        Args:
+            pairs (Optional[List[Tuple[str, str]]], optional): The (station, sorte) pairs to forecast. If passed, they are loaded first with load_dfs(), otherwise the previously loaded long df is used. Defaults to None.
+                The series are fitted as configured in the executor of the forecast configuration, or with one estimator in the "global" mode.
+
+        Raises:
+            ValueError: If no pairs are passed and self.long_df is empty.
+
+        Returns:
+            pd.DataFrame: The long df with the forecasts of all pairs, identified by the columns station and sorte.
+        """
+        if pairs is not None:
+            self.load_dfs(pairs=pairs)
+        if len(self.long_df) == 0:
+            raise ValueError("No long df is loaded in the object.")
+
+        dfs = []
+        series_ids = []
+        for (station, sorte), series_df in self.long_df.groupby(
+            ["station", "sorte"], sort=False
+        ):
+            dfs.append(
+                filter_n_days_before(
+                    df=series_df, n_before=self.forecast_config.n_before
+                )
+            )
+            series_ids.append(f"{sorte}_{station}")
+        if self.forecast_config.mode == "global":
+            return run(
+                df=pd.concat(dfs, ignore_index=True),
+                forecast_config=self.forecast_config,
+            )
+        return pd.concat(
+            run_many(
+                dfs=dfs,
+                forecast_config=self.forecast_config,
+                model_cache=self.model_cache,
+                series_ids=series_ids,
+            ),
+            ignore_index=True,
+        )
+
+    @instrumented_method("Forecast.backtest")
+    def backtest(
+        self,
+        pairs: Optional[List[Tuple[str, str]]] = None,
+        n_cutoffs: int = 30,
+        horizon_days: int = 1,
+        step_days: int = 1,
+        batch_size: int = 32,
+    ) -> pd.DataFrame:
+        """Runs a rolling-origin backtest of the forecast configuration over the last n_cutoffs days of several stations and sortes, see models.backtest.backtest().
+        The features of every series are computed once from its whole history, which is streamed batch_size series at a time.
+
+        Args:
+            pairs (Optional[List[Tuple[str, str]]], optional): The (station, sorte) pairs to backtest. Defaults to None, i.e. all series of the wide df in local_dir.
+            n_cutoffs (int, optional): The number of cutoffs per series. Defaults to 30.
+            horizon_days (int, optional): The number of days forecasted from every cutoff on. Defaults to 1.
+            step_days (int, optional): The number of days between the cutoffs. Defaults to 1.
+            batch_size (int, optional): The number of series read at once. Defaults to 32.
+
+        Returns:
+            pd.DataFrame: The forecasts of all test rows, see backtest_metrics() for their errors per station and horizon.
+        """
+        return backtest(
+            frames=iter_feature_frames(
+                pandas_connection=self.pandas_connection,
+                data_config=self.data_config,
+                pairs=pairs,
+                batch_size=batch_size,
+                add_pred=False,
+            ),
+            forecast_config=self.forecast_config,
+            n_cutoffs=n_cutoffs,
+            horizon_days=horizon_days,
+            step_days=step_days,
+        )
+
+    @instrumented_method("Forecast.tune")
+    def tune(
+        self,
+        tuning_config: Optional[Tuning_Config] = None,
+        pairs: Optional[List[Tuple[str, str]]] = None,
+        batch_size: int = 32,
+    ) -> Tuning_Result:
+        """Searches the hyperparameters of the estimators of the forecast configuration on a sample of n_stations series, see models.tuning.tune().
+        Use models.tuning.tuned_config_block() to turn the best trial into a forecast_config block of the config YAML.
+
+        Args:
+            tuning_config (Optional[Tuning_Config], optional): The search space. Defaults to None, i.e. the tuning_config of the config.
+            pairs (Optional[List[Tuple[str, str]]], optional): The (station, sorte) pairs to sample from. Defaults to None, i.e. all series of the wide df in local_dir.
+            batch_size (int, optional): The number of series read at once. Defaults to 32.
+
+        Returns:
+            Tuning_Result: The best trial and all trials with their backtest errors.
+        """
+        if tuning_config is None:
+            tuning_config = create_tuning_config(self.configDict)
+        if pairs is None and isinstance(self.pandas_connection, ArrowFileSource):
+            pairs = list_pairs(
+                source=self.pandas_connection, data_config=self.data_config
+            )
+        if pairs is not None and len(pairs) > tuning_config.n_stations:
+            rng = np.random.default_rng(tuning_config.random_state)
+            pairs = [
+                pairs[i]
+                for i in np.sort(
+                    rng.choice(len(pairs), tuning_config.n_stations, replace=False)
+                )
+            ]
+        return tune(
+            frames=iter_feature_frames(
+                pandas_connection=self.pandas_connection,
+                data_config=self.data_config,
+                pairs=pairs,
+                batch_size=batch_size,
+                add_pred=False,
+            ),
+            forecast_config=self.forecast_config,
+            tuning_config=tuning_config,
+        )
+
+    def stream_forecasts(
+        self, pairs: Optional[List[Tuple[str, str]]] = None, batch_size: int = 32
+    ) -> Iterator[pd.DataFrame]:
+        """Streams the forecasts of several stations and sortes, reading batch_size series at a time, see data_handler.streaming.stream_forecasts().
+        The peak memory is bounded by batch_size instead of the size of the wide df.
+
+        Args:
+            pairs (Optional[List[Tuple[str, str]]], optional): The (station, sorte) pairs to forecast. Defaults to None, i.e. all series of the wide df in local_dir.
+            batch_size (int, optional): The number of series read at once. Defaults to 32.
+
+        Yields:
+            pd.DataFrame: The df with the forecast of one series, identified by the columns station and sorte.
+        """
+        yield from stream_forecasts(
+            pandas_connection=self.pandas_connection,
+            data_config=self.data_config,
+            forecast_config=self.forecast_config,
+            pairs=pairs,
+            batch_size=batch_size,
+        )
+
+    @instrumented_method("Forecast.create_summaries")
     def create_summaries(self, groupCol: str, centralize_mean: bool) -> pd.Series:
         """Summarises the "price" column by groupCol.
 
@@ -76,17 +432,52 @@ class Forecast:
         """
         if len(self.df) == 0:
             raise ValueError("No df is loaded in the object.")
-        elif len(self.df.query("is_last==0")) == 0:
+        is_history = self.df["is_last"].to_numpy() == 0
+        if not is_history.any():
             raise ValueError("df contains no dates before today.")
         elif groupCol not in self.df:
             raise ValueError(f"groupCol {groupCol} is not in the df.")
 
         # Create the summary
         summary_df = summarize(
-            df=self.df.query("is_last==0"), groupCol=groupCol, aggCol="price"
+            df=self.df[is_history], groupCol=groupCol, aggCol="price"
         )
         # Mean-centralize the summary if necessary
         if centralize_mean:
             return mean_centralize(summary_df)
         else:
             return summary_df
+
+    @instrumented_method("Forecast.create_batch_summaries")
+    def create_batch_summaries(
+        self,
+        groupCols: List[str],
+        aggregations: Sequence[str] = ("mean",),
+        quantiles: Sequence[float] = (),
+        centralize_mean: bool = False,
+    ) -> Dict[str, pd.DataFrame]:
+        """Summarises the "price" column of all series of the long df by several groupCols at once, see summarize_many().
+
+        Args:
+            groupCols (List[str]): The time columns by which to group by, e.g. ["day_of_week", "hour", "trend"].
+            aggregations (Sequence[str], optional): The aggregations out of "mean", "median" and "count". Defaults to ("mean",).
+            quantiles (Sequence[float], optional): The quantiles to compute. Defaults to ().
+            centralize_mean (bool, optional): If True, centralizes the summaries of every series by the mean of its mean summary. Defaults to False.
+
+        Raises:
+            ValueError: If self.long_df is empty, i.e. no dfs were loaded.
+
+        Returns:
+            Dict[str, pd.DataFrame]: The summary by groupCol with a (station, sorte, groupCol) index and one column per aggregation.
+        """
+        if len(self.long_df) == 0:
+            raise ValueError("No long df is loaded in the object.")
+
+        return summarize_many(
+            df=self.long_df[self.long_df["is_last"].to_numpy() == 0],
+            groupCols=groupCols,
+            aggCol="price",
+            aggregations=aggregations,
+            quantiles=quantiles,
+            centralize_mean=centralize_mean,
+        )
@@ -0,0 +1,253 @@
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from typing import Callable
+from typing import Deque
+from typing import List
+from typing import Literal
+from typing import Optional
+from typing import Tuple
+
+import pandas as pd
+from tpa_analytics_engine.api import create_pandas_connection
+from tpa_analytics_engine.config import load_config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+
+
+class ConnectionPool:
+    def __init__(self, connection_factory: Callable, size: int) -> None:
+        """A pool of at most size connections, which are created lazily by connection_factory.
+        Every connection is used by one download at a time, so the pool bounds the concurrent downloads.
+
+        Args:
+            connection_factory (Callable): A function without arguments returning a connection with a retrieve_df() method.
+            size (int): The maximum number of connections.
+
+        Raises:
+            ValueError: If size is smaller than 1.
+        """
+        if size < 1:
+            raise ValueError(f"The size of the pool must be at least 1, got {size}.")
+        self.connection_factory = connection_factory
+        self.size = size
+        self.n_created = 0
+        self._idle: "asyncio.Queue" = asyncio.Queue()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator:
+        """Yields an idle connection, creating one if less than size exist, and returns it to the pool afterwards."""
+        if self._idle.empty() and self.n_created < self.size:
+            self.n_created += 1
+            connection = self.connection_factory()
+        else:
+            connection = await self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put_nowait(connection)
+
+
+class AsyncForecast:
+    def __init__(
+        self,
+        config_path: str,
+        max_connections: int = 4,
+        prefetch: Optional[int] = None,
+        connection_factory: Optional[Callable] = None,
+    ) -> None:
+        """Initializes an AsyncForecast class object, which overlaps the downloads of series with the fitting of already downloaded series.
+        The downloads run in a thread pool with at most max_connections pooled connections.
+        The features and forecasts are computed in the executor configured in the forecast configuration (a thread pool for "serial").
+
+        Args:
+            config_path (str): The path to the config YAML file.
+            max_connections (int, optional): The maximum number of concurrent downloads. Defaults to 4.
+            prefetch (Optional[int], optional): The maximum number of series which are downloaded or fitted at the same time.
+                Bounds the memory of downloaded series waiting for the fit. Defaults to None, i.e. 2 * max_connections.
+            connection_factory (Optional[Callable], optional): A function without arguments returning a connection with a retrieve_df() method.
+                Defaults to None, i.e. the connection configured in the config.
+
+        Raises:
+            ValueError: If the forecast configuration is in the "global" mode or prefetch is smaller than 1.
+        """
+        self.config_path = config_path
+        loaded_config = load_config(config_path=self.config_path)
+        self.configDict = loaded_config.config_dict
+        self.data_config = loaded_config.data_config
+        self.forecast_config = loaded_config.forecast_config
+        check_local_mode(self.forecast_config, "AsyncForecast")
+        self.max_connections = max_connections
+        self.prefetch = 2 * max_connections if prefetch is None else prefetch
+        if self.prefetch < 1:
+            raise ValueError(f"prefetch must be at least 1, got {self.prefetch}.")
+        self.connection_factory = connection_factory or functools.partial(
+            create_pandas_connection,
+            config_dict=self.configDict,
+            data_config=self.data_config,
+        )
+        self.io_executor = ThreadPoolExecutor(max_workers=max_connections)
+        self.cpu_executor = create_cpu_executor(self.forecast_config)
+        self._pool: Optional[ConnectionPool] = None
+
+    async def __aenter__(self) -> "AsyncForecast":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shuts down the executors."""
+        self.io_executor.shutdown(wait=True)
+        self.cpu_executor.shutdown(wait=True)
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """The connection pool, created in the running event loop on first use."""
+        if self._pool is None:
+            self._pool = ConnectionPool(
+                connection_factory=self.connection_factory, size=self.max_connections
+            )
+        return self._pool
+
+    async def load_df(self, station: str, sorte: str) -> pd.DataFrame:
+        """Downloads the df for passed station and sorte with a pooled connection, see load_station_sorte().
+
+        Args:
+            station (str): The short id of the station to load.
+            sorte (str): The type of gas for which to load the price
+
+        Returns:
+            pd.DataFrame: The df with the prediction rows, but without the date features.
+        """
+        loop = asyncio.get_running_loop()
+        async with self.pool.connection() as connection:
+            return await loop.run_in_executor(
+                self.io_executor,
+                functools.partial(
+                    load_station_sorte,
+                    pandas_connection=connection,
+                    data_config=self.data_config,
+                    station=station,
+                    sorte=sorte,
+                    add_pred=True,
+                ),
+            )
+
+    async def create_forecast(self, station: str, sorte: str) -> pd.DataFrame:
+        """Downloads the df for passed station and sorte and creates its forecast in the cpu executor.
+
+        Args:
+            station (str): The short id of the station to forecast.
+            sorte (str): The type of gas for which to forecast the price
+
+        Returns:
+            pd.DataFrame: The data frame with the forecast, identified by the columns station and sorte.
+        """
+        df = await self.load_df(station=station, sorte=sorte)
+        forecast_df = await asyncio.get_running_loop().run_in_executor(
+            self.cpu_executor,
+            functools.partial(
+                forecast_df_features,
+                df=df,
+                forecast_config=self.forecast_config,
+                series_id=f"{sorte}_{station}",
+                dtype_policy=self.data_config.dtype_policy,
+                horizon_days=self.data_config.horizon_days,
+            ),
+        )
+        forecast_df.insert(0, "station", station)
+        forecast_df.insert(1, "sorte", sorte)
+        return forecast_df
+
+    async def create_forecasts(self, pairs: List[Tuple[str, str]]) -> pd.DataFrame:
+        """Creates the forecasts for several stations and sortes, while at most prefetch series are downloaded or fitted at the same time.
+        Further series are downloaded while the earlier ones are fitted, so the run time approaches the larger of the download and fit times instead of their sum.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The (station, sorte) pairs to forecast.
+
+        Raises:
+            ValueError: If pairs is empty.
+
+        Returns:
+            pd.DataFrame: The long df with the forecasts of all pairs in the order of pairs, identified by the columns station and sorte.
+        """
+        if len(pairs) == 0:
+            raise ValueError("At least one (station, sorte) pair must be passed.")
+
+        pending: Deque[asyncio.Task] = deque()
+        forecast_dfs = []
+        try:
+            for station, sorte in pairs:
+                if len(pending) == self.prefetch:
+                    forecast_dfs.append(await pending.popleft())
+                pending.append(
+                    asyncio.ensure_future(
+                        self.create_forecast(station=station, sorte=sorte)
+                    )
+                )
+            while pending:
+                forecast_dfs.append(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return pd.concat(forecast_dfs, ignore_index=True)
+
+
+def create_cpu_executor(forecast_config: Forecast_Config) -> Executor:
+    """Creates the executor for the features and fits as configured in the executor of the forecast configuration.
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration.
+
+    Returns:
+        Executor: A ProcessPoolExecutor for the "process" backend, otherwise a ThreadPoolExecutor (with one worker for "serial").
+    """
+    executor_config = forecast_config.executor
+    if executor_config.backend == "process":
+        return ProcessPoolExecutor(max_workers=executor_config.n_jobs)
+    if executor_config.backend == "thread":
+        return ThreadPoolExecutor(max_workers=executor_config.n_jobs)
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def forecast_df_features(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    dtype_policy: Literal["default", "compact"] = "default",
+    horizon_days: int = 1,
+    series_id: str = "",
+) -> pd.DataFrame:
+    """Adds the date features to a loaded df, filters it to the forecast window and forecasts it.
+
+    Args:
+        df (pd.DataFrame): A data frame as produced by load_station_sorte().
+        forecast_config (Forecast_Config): The forecast configuration.
+        dtype_policy (Literal["default", "compact"], optional): The dtype policy of add_columns(). Defaults to "default".
+        horizon_days (int, optional): The number of prediction days of add_columns(). Defaults to 1.
+        series_id (str, optional): The id of the series in df, which names its exported model. Defaults to "", i.e. the model is not exported.
+
+    Returns:
+        pd.DataFrame: The data frame with the forecast.
+    """
+    return forecast_sklearn(
+        df=filter_n_days_before(
+            df=add_columns(df=df, dtype_policy=dtype_policy, horizon_days=horizon_days),
+            n_before=forecast_config.n_before,
+        ),
+        forecast_config=forecast_config,
+        series_id=series_id,
+    )
@@ -0,0 +1,174 @@
+"""Loads and validates the config YAML once per version of the file and process.
+
+load_config() caches the validated config of a path keyed by the modification time and size of the file, so further calls only stat() the file
+and return the same Loaded_Config until the file changes, which is then reloaded (hot reload, see Forecast.reload_config()).
+Parsing the YAML costs milliseconds, while the validation is cheap. With a snapshot_dir, the validated config is additionally written as a JSON snapshot,
+from which a new process validates the config without parsing the YAML, as long as the content of the YAML is unchanged.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import yaml  # type: ignore
+from pydantic import BaseModel
+from pydantic import ValidationError
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.models.models_config import create_forecast_config
+from tpa_analytics_engine.models.models_config import Forecast_Config
+
+# The version of the snapshot files, snapshots of another version are ignored
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class Loaded_Config(BaseModel):
+    """A pydantic class holding a validated config: the config_dict of the YAML and its data and forecast configuration.
+    The instances returned by load_config() are shared by all callers loading the same version of the file and must not be mutated,
+    a changed configuration is created with model_copy(update=...).
+    """
+
+    config_dict: dict
+    data_config: Data_Config
+    forecast_config: Forecast_Config
+
+
+class Config_Snapshot(BaseModel):
+    """A pydantic class of the JSON snapshot of a Loaded_Config and the sha256 of the YAML it was validated from."""
+
+    version: int = SNAPSHOT_FORMAT_VERSION
+    source_sha256: str
+    config: Loaded_Config
+
+
+_cache: Dict[str, Tuple[Tuple[int, int], Loaded_Config]] = {}
+_lock = threading.Lock()
+
+
+def validate_config(config_dict: dict) -> Loaded_Config:
+    """Validates the data and forecast configuration of a config dict.
+
+    Args:
+        config_dict (dict): A dictionary containing the config with the keys 'data_config' and 'forecast_config'.
+
+    Returns:
+        Loaded_Config: The validated config.
+    """
+    return Loaded_Config(
+        config_dict=config_dict,
+        data_config=Data_Config(**config_dict.get("data_config")),  # type: ignore
+        forecast_config=create_forecast_config(config_dict),
+    )
+
+
+def load_config(config_path: str, snapshot_dir: Optional[str] = None) -> Loaded_Config:
+    """Returns the validated config of the config YAML, which is cached until the modification time or size of the file changes.
+
+    Args:
+        config_path (str): The path to the config YAML file.
+        snapshot_dir (Optional[str], optional): A directory of JSON snapshots of the validated configs, which are read instead of the YAML if its content is unchanged
+            and written after the YAML is parsed. Defaults to None, i.e. the YAML is parsed once per process and version of the file.
+
+    Returns:
+        Loaded_Config: The validated config, the same instance as long as the file is unchanged.
+    """
+    path = os.path.abspath(config_path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(path, "rb") as file:
+            content = file.read()
+        source_sha256 = hashlib.sha256(content).hexdigest()
+        loaded = None
+        if snapshot_dir is not None:
+            loaded = read_snapshot(get_snapshot_path(path, snapshot_dir), source_sha256)
+        if loaded is None:
+            loaded = validate_config(yaml.safe_load(content))
+            if snapshot_dir is not None:
+                write_snapshot(
+                    loaded, get_snapshot_path(path, snapshot_dir), source_sha256
+                )
+        _cache[path] = (stamp, loaded)
+    return loaded
+
+
+def clear_config_cache() -> None:
+    """Clears the cached configs of load_config(), so every config is loaded again on its next call."""
+    with _lock:
+        _cache.clear()
+
+
+def get_snapshot_path(config_path: str, snapshot_dir: str) -> Path:
+    """Returns the path of the snapshot of a config YAML in snapshot_dir, named after the file and a hash of its absolute path.
+
+    Args:
+        config_path (str): The path to the config YAML file.
+        snapshot_dir (str): The directory of the snapshots.
+
+    Returns:
+        Path: The path of the snapshot.
+    """
+    path = os.path.abspath(config_path)
+    path_hash = hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]
+    return Path(snapshot_dir) / f"{Path(path).stem}-{path_hash}.json"
+
+
+def read_snapshot(snapshot_file: Path, source_sha256: str) -> Optional[Loaded_Config]:
+    """Reads the validated config of a snapshot if it was written from the YAML content with the sha256 source_sha256.
+
+    Args:
+        snapshot_file (Path): The path of the snapshot.
+        source_sha256 (str): The sha256 hex digest of the current content of the YAML.
+
+    Returns:
+        Optional[Loaded_Config]: The validated config or None if the snapshot is missing, stale, of another version or no longer valid.
+    """
+    try:
+        snapshot = Config_Snapshot.model_validate_json(snapshot_file.read_bytes())
+    except (OSError, ValidationError):
+        return None
+    if (
+        snapshot.version != SNAPSHOT_FORMAT_VERSION
+        or snapshot.source_sha256 != source_sha256
+    ):
+        return None
+    return snapshot.config
+
+
+def write_snapshot(
+    loaded: Loaded_Config, snapshot_file: Path, source_sha256: str
+) -> bool:
+    """Writes the snapshot of a validated config atomically.
+    Configs which do not survive the JSON round trip unchanged, e.g. with dates in the YAML, are not written.
+
+    Args:
+        loaded (Loaded_Config): The validated config.
+        snapshot_file (Path): The path of the snapshot.
+        source_sha256 (str): The sha256 hex digest of the content of the YAML the config was validated from.
+
+    Returns:
+        bool: True if the snapshot was written.
+    """
+    content = Config_Snapshot(
+        source_sha256=source_sha256, config=loaded
+    ).model_dump_json()
+    try:
+        if Config_Snapshot.model_validate_json(content).config != loaded:
+            return False
+    except ValidationError:
+        return False
+    snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = snapshot_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "w") as file:
+        file.write(content)
+    os.replace(tmp_file, snapshot_file)
+    return True
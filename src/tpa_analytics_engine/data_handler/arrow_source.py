@@ -0,0 +1,165 @@
+import datetime
+from pathlib import Path
+from typing import List
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+class ArrowFileSource:
+    def __init__(self, directory: str) -> None:
+        """A local source of dfs, which can be used instead of PandasOCI.
+        Feather (Arrow IPC) files are memory-mapped, so only the buffers of the requested columns are read, uncompressed files without copying.
+
+        Args:
+            directory (str): The local directory containing the dfs.
+        """
+        self.directory = Path(directory)
+
+    def retrieve_df(
+        self,
+        path: str,
+        df_format: str,
+        columns: Optional[List[str]] = None,
+        date_column: Optional[str] = None,
+        date_from: Optional[datetime.datetime] = None,
+    ) -> pd.DataFrame:
+        """Reads the requested columns of the df at path, optionally only the rows from date_from on.
+
+        Args:
+            path (str): The path of the df relative to the directory.
+            df_format (str): The format of the df, "ftr" or "parquet".
+            columns (Optional[List[str]], optional): The columns to read. Defaults to None, i.e. all columns.
+            date_column (Optional[str], optional): The column by which the rows are filtered. Defaults to None.
+            date_from (Optional[datetime.datetime], optional): The first date to read, record batches before it are skipped. Defaults to None, i.e. all rows.
+
+        Returns:
+            pd.DataFrame: The df with the requested columns and rows.
+        """
+        return self.read_table(
+            path=path,
+            df_format=df_format,
+            columns=columns,
+            date_column=date_column,
+            date_from=date_from,
+        ).to_pandas()
+
+    def read_table(
+        self,
+        path: str,
+        df_format: str,
+        columns: Optional[List[str]] = None,
+        date_column: Optional[str] = None,
+        date_from: Optional[datetime.datetime] = None,
+    ) -> pa.Table:
+        """Reads the requested columns and rows of the df at path as an Arrow table, see retrieve_df().
+
+        Raises:
+            ValueError: If df_format is not supported.
+            ValueError: If date_from is passed without date_column.
+            KeyError: If a column or date_column is not in the df.
+
+        Returns:
+            pa.Table: The table with the requested columns and rows.
+        """
+        if date_from is not None and date_column is None:
+            raise ValueError("date_column must be passed together with date_from.")
+
+        file_path = self.directory / path
+        if df_format == "parquet":
+            if columns is not None:
+                _check_columns(
+                    columns=columns,
+                    names=pq.read_schema(file_path).names,
+                    path=path,
+                )
+            return pq.read_table(
+                file_path,
+                columns=columns,
+                filters=None
+                if date_from is None
+                else [(date_column, ">=", pd.Timestamp(date_from))],
+                memory_map=True,
+            )
+        elif df_format != "ftr":
+            raise ValueError(f"df_format {df_format} is not supported.")
+
+        with pa.memory_map(str(file_path)) as source:
+            schema = pa.ipc.open_file(source).schema
+            included_fields = None
+            if columns is not None:
+                read_columns = list(columns)
+                if date_from is not None and date_column not in read_columns:
+                    read_columns.append(date_column)
+                _check_columns(columns=read_columns, names=schema.names, path=path)
+                included_fields = [
+                    schema.get_field_index(column) for column in read_columns
+                ]
+            reader = pa.ipc.open_file(
+                source, options=pa.ipc.IpcReadOptions(included_fields=included_fields)
+            )
+            batches = []
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if date_from is not None:
+                    # Skip the batches before date_from and filter the others
+                    dates = batch.column(date_column)
+                    date_from_scalar = pa.scalar(pd.Timestamp(date_from), dates.type)
+                    last_batch_date = pc.max(dates)
+                    if (
+                        not last_batch_date.is_valid
+                        or pc.less(last_batch_date, date_from_scalar).as_py()
+                    ):
+                        continue
+                    batch = batch.filter(pc.greater_equal(dates, date_from_scalar))
+                batches.append(batch)
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+
+        if columns is not None:
+            table = table.select(columns)
+        return table
+
+    def last_date(self, path: str, df_format: str, date_column: str) -> pd.Timestamp:
+        """Returns the last date in date_column of the df at path, only the date column is read.
+
+        Args:
+            path (str): The path of the df relative to the directory.
+            df_format (str): The format of the df, "ftr" or "parquet".
+            date_column (str): The column containing the dates.
+
+        Returns:
+            pd.Timestamp: The last date.
+        """
+        dates = self.read_table(path=path, df_format=df_format, columns=[date_column])
+        return pd.Timestamp(pc.max(dates.column(date_column)).as_py())
+
+    def column_names(self, path: str, df_format: str) -> List[str]:
+        """Returns the column names of the df at path, only the schema is read.
+
+        Args:
+            path (str): The path of the df relative to the directory.
+            df_format (str): The format of the df, "ftr" or "parquet".
+
+        Raises:
+            ValueError: If df_format is not supported.
+
+        Returns:
+            List[str]: The column names.
+        """
+        file_path = self.directory / path
+        if df_format == "parquet":
+            return pq.read_schema(file_path).names
+        elif df_format != "ftr":
+            raise ValueError(f"df_format {df_format} is not supported.")
+        with pa.memory_map(str(file_path)) as source:
+            return pa.ipc.open_file(source).schema.names
+
+
+def _check_columns(columns: List[str], names: List[str], path: str) -> None:
+    """Raises a KeyError naming the columns which are not in names, the columns of the df at path."""
+    missing = [column for column in columns if column not in set(names)]
+    if missing:
+        raise KeyError(f"The columns {missing} are not in the df {path}.")
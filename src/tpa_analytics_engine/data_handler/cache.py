@@ -0,0 +1,150 @@
+import datetime
+import functools
+import hashlib
+import importlib
+import json
+import os
+from pathlib import Path
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import pandas as pd
+from pydantic import BaseModel
+from pydantic import field_validator
+
+
+# Pydantic Base Class for the Cache
+class Cache_Config(BaseModel):
+    """A pydantic class to specify the local cache of retrieved dfs.
+    The configuration specifies:
+        - directory: The local directory where the retrieved columns are stored as Feather files.
+        - max_bytes: The maximum size of the cache, the least recently used files are evicted beyond it.
+        - version: A fixed version stamp of the remote df.
+        - version_stamp: The import path "module:function" of a function (pandas_connection, path) -> str returning the version stamp of the remote df at path,
+          e.g. built from its etag or last-modified time and size, which is called once per retrieve and takes precedence over version.
+          If neither is set, the current date is used, i.e. the remote df is retrieved once a day and changes during the day are only seen on the next day.
+    """
+
+    directory: str
+    max_bytes: int = 2**30
+    version: Optional[str] = None
+    version_stamp: Optional[str] = None
+
+    @field_validator("version_stamp")
+    def validate_version_stamp(cls, value):
+        if value is not None and len(value.split(":")) != 2:
+            raise ValueError(
+                f'version_stamp must be an import path "module:function", got {value}.'
+            )
+        return value
+
+
+class CachedPandasConnection:
+    def __init__(
+        self,
+        pandas_connection,
+        cache_config: Cache_Config,
+        version_stamp: Optional[Callable[[str], str]] = None,
+    ) -> None:
+        """Wraps a connection with a retrieve_df() method (e.g. PandasOCI) into a content-addressed, size-bounded LRU cache on disk.
+        Every retrieved df is stored as a Feather file keyed by the path, the columns and the version stamp of the remote df.
+
+        Args:
+            pandas_connection: The wrapped connection, which is only used on cache misses.
+            cache_config (Cache_Config): The configuration of the cache.
+            version_stamp (Optional[Callable[[str], str]], optional): A function returning the version stamp of the remote df at the passed path, see create_cached_connection(). Defaults to None, i.e. cache_config.version or the current date.
+        """
+        self.pandas_connection = pandas_connection
+        self.cache_config = cache_config
+        self.version_stamp = version_stamp
+        self.directory = Path(cache_config.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def retrieve_df(
+        self, path: str, df_format: str, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Retrieves the df from the cache or, on a cache miss, from the wrapped connection and stores it in the cache.
+
+        Args:
+            path (str): The path of the remote df.
+            df_format (str): The format of the remote df.
+            columns (Optional[List[str]], optional): The columns to retrieve. Defaults to None, i.e. all columns.
+
+        Returns:
+            pd.DataFrame: The retrieved df.
+        """
+        cache_file = self.directory / f"{self.get_key(path=path, columns=columns)}.ftr"
+        if cache_file.exists():
+            # Mark the file as recently used
+            os.utime(cache_file)
+            return pd.read_feather(cache_file)
+
+        df = self.pandas_connection.retrieve_df(
+            path=path, df_format=df_format, columns=columns
+        )
+
+        # Write to a temporary file first so that concurrent readers never see partial files
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        df.reset_index(drop=True).to_feather(tmp_file)
+        os.replace(tmp_file, cache_file)
+        self.evict()
+
+        return df
+
+    def get_key(self, path: str, columns: Optional[List[str]] = None) -> str:
+        """Returns the content address of the df at path with columns in its current remote version.
+
+        Args:
+            path (str): The path of the remote df.
+            columns (Optional[List[str]], optional): The columns to retrieve. Defaults to None.
+
+        Returns:
+            str: The sha256 hex digest of path, columns and version stamp.
+        """
+        if self.version_stamp is not None:
+            version = self.version_stamp(path)
+        else:
+            version = self.cache_config.version or datetime.date.today().isoformat()
+        return hashlib.sha256(
+            json.dumps([path, columns, version]).encode("utf-8")
+        ).hexdigest()
+
+    def evict(self) -> None:
+        """Deletes the least recently used files until the cache is within max_bytes."""
+        cache_files = [
+            (file.stat().st_mtime_ns, file.stat().st_size, file)
+            for file in self.directory.glob("*.ftr")
+        ]
+        total_bytes = sum(size for _, size, _ in cache_files)
+        for _, size, file in sorted(cache_files):
+            if total_bytes <= self.cache_config.max_bytes:
+                break
+            file.unlink(missing_ok=True)
+            total_bytes -= size
+
+
+def create_cached_connection(pandas_connection, cache_config: Optional[Cache_Config]):
+    """Wraps pandas_connection into a CachedPandasConnection if a cache is configured, with the version_stamp function of cache_config.
+
+    Args:
+        pandas_connection: The connection with a retrieve_df() method (e.g. PandasOCI).
+        cache_config (Optional[Cache_Config]): The configuration of the cache, e.g. Data_Config.cache.
+
+    Returns:
+        The cached connection or pandas_connection itself if cache_config is None.
+    """
+    if cache_config is None:
+        return pandas_connection
+    version_stamp = None
+    if cache_config.version_stamp is not None:
+        module_name, function_name = cache_config.version_stamp.split(":")
+        version_stamp = functools.partial(
+            getattr(importlib.import_module(module_name), function_name),
+            pandas_connection,
+        )
+    return CachedPandasConnection(
+        pandas_connection=pandas_connection,
+        cache_config=cache_config,
+        version_stamp=version_stamp,
+    )
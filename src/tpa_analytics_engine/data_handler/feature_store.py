@@ -0,0 +1,197 @@
+import datetime
+import json
+import os
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from pydantic import BaseModel
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.cache import CachedPandasConnection
+
+if TYPE_CHECKING:
+    from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+
+
+# Pydantic Base Class for the Feature Store
+class Feature_Store_Config(BaseModel):
+    """A pydantic class to specify the local store of precomputed feature dfs.
+    The configuration specifies:
+        - directory: The local directory where the feature dfs are stored as Feather files partitioned by sorte ({sorte}/{station}.ftr) with an index.json.
+        - chunk_rows: The number of rows of every record batch, window reads skip the batches before the window.
+    """
+
+    directory: str
+    chunk_rows: int = 4096
+
+
+class FeatureStore:
+    def __init__(self, feature_store_config: Feature_Store_Config) -> None:
+        """A persistent store of the feature dfs of add_columns(), partitioned by sorte and sorted by date.
+        The index.json records the version of the raw data every feature df was built from, a df with another version is stale and must be rewritten.
+
+        Args:
+            feature_store_config (Feature_Store_Config): The configuration of the feature store.
+        """
+        self.feature_store_config = feature_store_config
+        self.directory = Path(feature_store_config.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.source = ArrowFileSource(str(self.directory))
+
+    @staticmethod
+    def get_path(station: str, sorte: str) -> str:
+        """Returns the path of the feature df of station and sorte relative to the directory."""
+        return f"{sorte}/{station}.ftr"
+
+    def read_index(self) -> Dict[str, dict]:
+        """Returns the index entries by path, each with the version, the first and last day and the number of rows."""
+        index_file = self.directory / "index.json"
+        if not index_file.exists():
+            return {}
+        with open(index_file) as file:
+            return json.load(file)
+
+    def is_current(self, station: str, sorte: str, version: str) -> bool:
+        """Returns True if the feature df of station and sorte was built from the raw data with version."""
+        entry = self.read_index().get(self.get_path(station, sorte))
+        return (
+            entry is not None
+            and entry["version"] == version
+            and (self.directory / self.get_path(station, sorte)).exists()
+        )
+
+    def write(self, station: str, sorte: str, df: pd.DataFrame, version: str) -> None:
+        """Stores the feature df of station and sorte, sorted by date, and records it in the index.
+
+        Args:
+            station (str): The short id of the station.
+            sorte (str): The type of gas.
+            df (pd.DataFrame): The df as produced by add_columns().
+            version (str): The version of the raw data the df was built from, see source_version().
+        """
+        path = self.get_path(station, sorte)
+        file = self.directory / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        df = df.sort_values("Day_Hours", kind="stable", ignore_index=True)
+
+        # Write to a temporary file first so that concurrent readers never see partial files
+        tmp_file = file.with_suffix(f".{os.getpid()}.tmp")
+        feather.write_feather(
+            pa.Table.from_pandas(df, preserve_index=False),
+            str(tmp_file),
+            chunksize=self.feature_store_config.chunk_rows,
+        )
+        os.replace(tmp_file, file)
+
+        self._update_index(
+            {
+                path: {
+                    "version": version,
+                    "first_day": str(df["Day"].min().date()) if len(df) else None,
+                    "last_day": str(df["Day"].max().date()) if len(df) else None,
+                    "rows": len(df),
+                }
+            }
+        )
+
+    def read(
+        self,
+        station: str,
+        sorte: str,
+        columns: Optional[List[str]] = None,
+        n_before: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Reads the stored feature df of station and sorte, optionally only some columns and the last n_before days.
+        The window equals filter_n_days_before() with n_before, the record batches before it are not read.
+
+        Args:
+            station (str): The short id of the station.
+            sorte (str): The type of gas.
+            columns (Optional[List[str]], optional): The columns to read. Defaults to None, i.e. all columns.
+            n_before (Optional[int], optional): The number of days to read before the last day. Defaults to None, i.e. all days.
+
+        Raises:
+            KeyError: If no feature df of station and sorte is stored.
+
+        Returns:
+            pd.DataFrame: The feature df.
+        """
+        path = self.get_path(station, sorte)
+        entry = self.read_index().get(path)
+        if entry is None:
+            raise KeyError(f"No features of {sorte}_{station} are stored.")
+
+        date_from = None
+        if n_before is not None and entry["last_day"] is not None:
+            date_from = pd.Timestamp(entry["last_day"]) - pd.Timedelta(
+                days=n_before - 1
+            )
+        return self.source.retrieve_df(
+            path=path,
+            df_format="ftr",
+            columns=columns,
+            date_column="Day" if date_from is not None else None,
+            date_from=date_from,
+        )
+
+    def invalidate(self, pairs: Optional[List[Tuple[str, str]]] = None) -> None:
+        """Removes the feature dfs of the (station, sorte) pairs from the store, all if pairs is None."""
+        index = self.read_index()
+        paths = (
+            list(index)
+            if pairs is None
+            else [self.get_path(station, sorte) for station, sorte in pairs]
+        )
+        for path in paths:
+            (self.directory / path).unlink(missing_ok=True)
+        self._update_index({path: None for path in paths})
+
+    def _update_index(self, entries: Dict[str, Optional[dict]]) -> None:
+        """Updates the entries of the index atomically, an entry of None is removed."""
+        index = self.read_index()
+        for path, entry in entries.items():
+            if entry is None:
+                index.pop(path, None)
+            else:
+                index[path] = entry
+        tmp_file = self.directory / f"index.json.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(index, file, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.directory / "index.json")
+
+
+def source_version(pandas_connection, data_config: "Data_Config") -> str:
+    """Returns the version of the raw data of data_config, which changes when new raw data lands.
+    The version contains the current date, since the prediction rows of the feature dfs depend on it, and the dtype policy and prediction rows of data_config.
+
+    Args:
+        pandas_connection: The connection with a retrieve_df() method from which the raw data is retrieved.
+        data_config (Data_Config): The data configuration.
+
+    Returns:
+        str: For an ArrowFileSource the modification time and size of the raw file, for a CachedPandasConnection its version stamp, each with the current date.
+            Other connections have no version, so the feature dfs are rebuilt once a day.
+    """
+    # The feature dfs also depend on the configured dtype policy and prediction rows
+    stamp = "|".join(
+        [
+            datetime.date.today().isoformat(),
+            data_config.dtype_policy,
+            str(data_config.horizon_days),
+            str(data_config.pred_freq),
+        ]
+    )
+    if isinstance(pandas_connection, ArrowFileSource):
+        stat = (pandas_connection.directory / data_config.df_path).stat()
+        return f"{stat.st_mtime_ns}-{stat.st_size}|{stamp}"
+    if isinstance(pandas_connection, CachedPandasConnection):
+        if pandas_connection.version_stamp is not None:
+            return f"{pandas_connection.version_stamp(data_config.df_path)}|{stamp}"
+        return f"{pandas_connection.cache_config.version or ''}|{stamp}"
+    return stamp
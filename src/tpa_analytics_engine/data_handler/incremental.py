@@ -0,0 +1,263 @@
+from typing import Dict
+from typing import List
+from typing import Literal
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.data_handler.prepare_forecast_format import _date_features
+from tpa_analytics_engine.data_handler.prepare_forecast_format import COMPACT_DTYPES
+from tpa_analytics_engine.data_handler.prepare_forecast_format import N_LAG_DAYS
+
+# The feature columns of add_columns() in their order and default dtypes, the categoricals are stored as the minute of the day and the week code
+FEATURE_DTYPES = {
+    "day_of_week": np.int32,
+    "hour": np.float64,
+    "hour_format": np.int64,
+    "Day": "datetime64[ns]",
+    "trend": np.int64,
+    "week": np.int64,
+    **{f"avg_daily_price_lag{lag}": np.float64 for lag in range(1, N_LAG_DAYS + 1)},
+    "is_last": np.int64,
+}
+
+
+class IncrementalFeatureBuilder:
+    def __init__(
+        self,
+        dtype_policy: Literal["default", "compact"] = "default",
+        horizon_days: int = 1,
+    ) -> None:
+        """A stateful builder of the add_columns() features of one series, which only processes newly arriving rows.
+        The rows and their features are kept in column arrays with spare capacity, to which update() appends the new rows.
+        Of the rows passed before, only the lags and is_last of the days which can change are recomputed: the days from the first day with is_last==1 on,
+        and all days while the first days still change the back-filled lags. The number of these rows is n_computed_rows.
+        Rows must arrive in time order, to_frame() equals add_columns() with the same dtype_policy and horizon_days on all rows.
+
+        Args:
+            dtype_policy (Literal["default", "compact"], optional): The dtype policy of add_columns(). Defaults to "default".
+            horizon_days (int, optional): The number of prediction days at the end of the rows, see add_columns(). Defaults to 1.
+        """
+        self.dtype_policy = dtype_policy
+        self.horizon_days = horizon_days
+        self.trend_origin: Optional[int] = None
+        # The sorted days, the index of their first row and their average price
+        self.day_numbers: List[int] = []
+        self.day_starts: List[int] = []
+        self.avg_daily_price = np.empty(0)
+        # The categories of hour_format as minutes of the day and of week as year * 100 + week
+        self.minute_keys = np.empty(0, dtype=np.int64)
+        self.week_keys = np.empty(0, dtype=np.int64)
+        # The number of rows whose lags and is_last were computed by the last update()
+        self.n_computed_rows = 0
+        self._n_rows = 0
+        self._input_dtypes: Dict[str, object] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._frame: Optional[pd.DataFrame] = None
+        # The dtypes of the categoricals and the lookup of the hour_format codes, which are rebuilt only when new categories arrive
+        self._categories: Dict[str, pd.CategoricalDtype] = {}
+        self._minute_codes = np.zeros(24 * 60, dtype=np.int64)
+
+    def update(self, df_new: pd.DataFrame) -> pd.DataFrame:
+        """Adds the features to the new rows and appends them to the state.
+
+        Args:
+            df_new (pd.DataFrame): The new rows with the columns Day_Hours and price, not earlier than the rows passed before.
+
+        Raises:
+            ValueError: If df_new contains days before the last day passed before or other columns than the rows passed before.
+
+        Returns:
+            pd.DataFrame: The new rows with the added features, indexed by their position in to_frame().
+                Their lags and is_last can still change with later rows, to_frame() is always final.
+        """
+        if self._input_dtypes and list(df_new.columns) != list(self._input_dtypes):
+            raise ValueError(
+                f"The rows must have the columns {list(self._input_dtypes)}, got {list(df_new.columns)}."
+            )
+        features = _date_features(df_new["Day_Hours"], trend_origin=self.trend_origin)
+        day_number = features.pop("day_number")
+        if len(day_number) == 0:
+            return self._build_frame(start=self._n_rows) if self._n_rows else df_new
+        if np.any(np.diff(day_number) < 0) or (
+            self.day_numbers and day_number[0] < self.day_numbers[-1]
+        ):
+            raise ValueError("The rows must not contain days before the last day.")
+        if self.trend_origin is None:
+            self.trend_origin = int(day_number[0])
+
+        n_old = self._n_rows
+        first_pred_code = self._first_pred_code()
+
+        # Add the new days, the first changed day is the last day passed before if it got new rows
+        new_days, new_starts = np.unique(day_number, return_index=True)
+        if self.day_numbers and new_days[0] == self.day_numbers[-1]:
+            first_changed_code = len(self.day_numbers) - 1
+            new_days, new_starts = new_days[1:], new_starts[1:]
+        else:
+            first_changed_code = len(self.day_numbers)
+        self.day_numbers.extend(int(day) for day in new_days)
+        self.day_starts.extend(int(start) + n_old for start in new_starts)
+        features["_day_code"] = np.searchsorted(self.day_numbers, day_number)
+        self._append(df_new, features)
+
+        # Recompute the average price of the changed days like the daily mean in add_columns()
+        start = self.day_starts[first_changed_code]
+        prices = pd.Series(self._columns["price"][start : self._n_rows])
+        self.avg_daily_price = np.concatenate(
+            [
+                self.avg_daily_price[:first_changed_code],
+                prices.groupby(self._columns["_day_code"][start : self._n_rows])
+                .mean()
+                .to_numpy(dtype=np.float64),
+            ]
+        )
+
+        # The lags of a day only use the finished days before it, except the back-filled lags of the first days.
+        # The prediction days move forward, so is_last and their lags change from the previous first prediction day on.
+        recompute_code = first_pred_code if first_pred_code > N_LAG_DAYS else 0
+        self._compute_lags_is_last(start=self.day_starts[recompute_code])
+        self._frame = None
+        return self._build_frame(start=n_old)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Combines all rows passed so far into the frame add_columns() would produce.
+
+        Returns:
+            pd.DataFrame: The frame with the features of all rows.
+        """
+        if self._n_rows == 0:
+            return pd.DataFrame()
+        if self._frame is None:
+            self._frame = self._build_frame(start=0)
+        return self._frame
+
+    def _first_pred_code(self) -> int:
+        """Returns the code of the first of the last horizon_days days, i.e. of the first day with is_last==1."""
+        if not self.day_numbers:
+            return 0
+        return int(
+            np.searchsorted(
+                self.day_numbers, self.day_numbers[-1] - self.horizon_days + 1
+            )
+        )
+
+    def _append(self, df_new: pd.DataFrame, features: dict) -> None:
+        """Appends the input columns and the date features of the new rows to the column arrays, doubling their capacity when full."""
+        if not self._input_dtypes:
+            self._input_dtypes = dict(df_new.dtypes)
+            for column, dtype in self._input_dtypes.items():
+                # Timezone-aware columns are stored as UTC times
+                self._columns[column] = np.empty(
+                    0,
+                    dtype="datetime64[ns]"
+                    if isinstance(dtype, pd.DatetimeTZDtype)
+                    else df_new[column].to_numpy().dtype,
+                )
+            for column, dtype in FEATURE_DTYPES.items():
+                if self.dtype_policy == "compact" and column in COMPACT_DTYPES:
+                    dtype = COMPACT_DTYPES[column]
+                self._columns[column] = np.empty(0, dtype=dtype)
+            self._columns["_day_code"] = np.empty(0, dtype=np.int64)
+
+        n_new = len(df_new)
+        capacity = len(self._columns["_day_code"])
+        if self._n_rows + n_new > capacity:
+            capacity = max(2 * capacity, self._n_rows + n_new, 1024)
+            for column, values in self._columns.items():
+                grown = np.empty(capacity, dtype=values.dtype)
+                grown[: self._n_rows] = values[: self._n_rows]
+                self._columns[column] = grown
+
+        # The categories only grow at the end of week, since the rows arrive in time order
+        hour_format = features.pop("hour_format")
+        minute_keys = np.array(
+            [int(key[:2]) * 60 + int(key[3:]) for key in hour_format.categories],
+            dtype=np.int64,
+        )
+        if not np.isin(minute_keys, self.minute_keys).all():
+            self.minute_keys = np.union1d(self.minute_keys, minute_keys)
+            self._categories.pop("hour_format", None)
+        features["hour_format"] = minute_keys[hour_format.codes]
+        week = features.pop("week")
+        week_keys = np.array(
+            [int(key[:-3]) * 100 + int(key[-2:]) for key in week.categories],
+            dtype=np.int64,
+        )
+        if not np.isin(week_keys, self.week_keys).all():
+            self.week_keys = np.union1d(self.week_keys, week_keys)
+            self._categories.pop("week", None)
+        features["week"] = np.searchsorted(self.week_keys, week_keys[week.codes])
+
+        rows = slice(self._n_rows, self._n_rows + n_new)
+        for column, dtype in self._input_dtypes.items():
+            values = df_new[column]
+            if isinstance(dtype, pd.DatetimeTZDtype):
+                values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+            self._columns[column][rows] = values.to_numpy()
+        for column, values in features.items():
+            self._columns[column][rows] = values
+        self._n_rows += n_new
+
+    def _compute_lags_is_last(self, start: int) -> None:
+        """Computes the lags and is_last of the rows from start on like add_columns()."""
+        avg_daily_price = self.avg_daily_price.copy()
+        first_pred_code = self._first_pred_code()
+        if self.horizon_days > 1:
+            # The zero prices of the prediction days must not become lags of later prediction days
+            avg_daily_price[first_pred_code:] = (
+                avg_daily_price[first_pred_code - 1] if first_pred_code > 0 else np.nan
+            )
+        rows = slice(start, self._n_rows)
+        day_codes = self._columns["_day_code"][rows]
+        for lag in range(1, N_LAG_DAYS + 1):
+            column = self._columns[f"avg_daily_price_lag{lag}"]
+            if len(avg_daily_price) <= lag:
+                column[rows] = np.nan
+            else:
+                column[rows] = avg_daily_price[np.maximum(day_codes - lag, 0)]
+        self._columns["is_last"][rows] = day_codes >= first_pred_code
+        self.n_computed_rows = self._n_rows - start
+
+    def _build_frame(self, start: int) -> pd.DataFrame:
+        """Builds the frame of add_columns() of the rows from start on from copies of the column arrays."""
+        rows = slice(start, self._n_rows)
+        columns = {}
+        for column, dtype in self._input_dtypes.items():
+            values = self._columns[column][rows]
+            if isinstance(dtype, pd.DatetimeTZDtype):
+                columns[column] = (
+                    pd.DatetimeIndex(values).tz_localize("UTC").tz_convert(dtype.tz)  # type: ignore
+                )
+            elif self.dtype_policy == "compact" and column in COMPACT_DTYPES:
+                columns[column] = values.astype(COMPACT_DTYPES[column])
+            elif isinstance(dtype, np.dtype):
+                columns[column] = values.copy()
+            else:
+                columns[column] = pd.array(values, dtype=dtype)
+        for column in FEATURE_DTYPES:
+            values = self._columns[column][rows]
+            if column in ["hour_format", "week"]:
+                dtype = self._categorical_dtype(column)
+                codes = (
+                    self._minute_codes[values]
+                    if column == "hour_format"
+                    else values.copy()
+                )
+                columns[column] = pd.Categorical.from_codes(codes, dtype=dtype)
+            else:
+                columns[column] = values.copy()
+        return pd.DataFrame(
+            columns, index=pd.RangeIndex(start, self._n_rows), copy=False
+        )
+
+    def _categorical_dtype(self, column: str) -> pd.CategoricalDtype:
+        """Returns the dtype of the categorical hour_format or week with the categories of all rows, as in _date_features()."""
+        if column not in self._categories:
+            if column == "hour_format":
+                self._minute_codes[self.minute_keys] = np.arange(len(self.minute_keys))
+                categories = [f"{m // 60:02d}:{m % 60:02d}" for m in self.minute_keys]
+            else:
+                categories = [f"{k // 100}-{k % 100:02d}" for k in self.week_keys]
+            self._categories[column] = pd.CategoricalDtype(categories)
+        return self._categories[column]
@@ -1,29 +1,73 @@
 import datetime
+from typing import List
 from typing import Literal
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
-from cloud_storage_wrapper.oci_access.pandas import PandasOCI
 from pydantic import BaseModel
+from pydantic import field_validator
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.cache import Cache_Config
+from tpa_analytics_engine.data_handler.feature_store import Feature_Store_Config
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.instrumentation import stage
+
+if TYPE_CHECKING:
+    from cloud_storage_wrapper.oci_access.pandas import PandasOCI
+
+# The number of days before a day used by the avg_daily_price lag features
+N_LAG_DAYS = 3
+
+# The dtypes of the numeric columns of add_columns() with the "compact" dtype policy, the other columns keep their dtypes
+COMPACT_DTYPES = {
+    "price": np.float32,
+    "day_of_week": np.int8,
+    "hour": np.float32,
+    "trend": np.int32,
+    **{f"avg_daily_price_lag{lag}": np.float32 for lag in range(1, N_LAG_DAYS + 1)},
+    "is_last": np.int8,
+}
 
 
 # Pydantic Base Class for Data
 class Data_Config(BaseModel):
     """A pydantic class to specify the data configuration.
     The configuration specifies the path to the df, the used format and the date column containing dates and times.
+    Optionally, a local cache of the retrieved columns can be configured (Cache_Config).
+    If local_dir is set, the df is read from this local directory with an ArrowFileSource instead of the cloud storage.
+    The dtype_policy of the features of add_columns() is "default" (float64 and int64) or "compact" (float32 and small integers, see COMPACT_DTYPES).
+    Optionally, a local store of the feature dfs can be configured (Feature_Store_Config), which is rebuilt only when new raw data lands.
+    The prediction rows cover horizon_days days from today on, at the times of the same weekday last week or, if pred_freq is set, at a regular pd.date_range frequency (e.g. "30min").
     """
 
     df_path: str
     df_format: Literal["ftr", "parquet"]
     date_column: str
+    cache: Optional[Cache_Config] = None
+    local_dir: Optional[str] = None
+    dtype_policy: Literal["default", "compact"] = "default"
+    feature_store: Optional[Feature_Store_Config] = None
+    horizon_days: int = 1
+    pred_freq: Optional[str] = None
 
+    @field_validator("horizon_days")
+    def validate_horizon_days(cls, value):
+        if value < 1:
+            raise ValueError("horizon_days must be at least 1.")
+        return value
 
+
+@instrumented("load_station_sorte")
 def load_station_sorte(
-    pandas_connection: PandasOCI,
+    pandas_connection: "PandasOCI",
     data_config: Data_Config,
     station: str,
     sorte: str,
     add_pred: bool = True,
+    n_before: Optional[int] = None,
 ) -> pd.DataFrame:
     """This function loads
 
@@ -32,83 +76,339 @@ def load_station_sorte(
         station (str): The short id of the station to load.
         sorte (str): The type of gas for which to load the price
         add_pred (bool, optional): A flag whether to add a prediction time frame to the df. Defaults to True.
+        n_before (Optional[int], optional): If passed and pandas_connection is an ArrowFileSource, only the days needed for filter_n_days_before() with n_before and for the lag features are read.
+            The trend of add_columns() then starts at the first read day. Defaults to None, i.e. the whole history.
 
     Returns:
         pd.DataFrame: The df for the required station and gas_type.
     """
+    # Push the date window down into the read if the connection supports it
+    retrieve_kwargs = _window_kwargs(
+        pandas_connection=pandas_connection,
+        data_config=data_config,
+        add_pred=add_pred,
+        n_before=n_before,
+    )
+
     # Download the df based on data_config:
-    df = (
-        pandas_connection.retrieve_df(
+    with stage("retrieve_df", bytes_read=True) as current_stage:
+        df = pandas_connection.retrieve_df(
             path=data_config.df_path,
             df_format=data_config.df_format,
             columns=[data_config.date_column, f"{sorte}_{station}"],
+            **retrieve_kwargs,
         )
-        .rename(columns={f"{sorte}_{station}": "price"})
-        .dropna()
-    )
+        current_stage.set_result(df)
+    df = df.rename(columns={f"{sorte}_{station}": "price"}).dropna()
 
-    # If add_pred is true, then add the times of the same day last week with a price of 0 --> this price will be predicted later
+    # If add_pred is true, then add the times of the next horizon_days days with a price of 0 --> this price will be predicted later
     if add_pred:
-        current_date = datetime.date.today()
-        date_7_days_ago = current_date - datetime.timedelta(days=7)
-        filtered_df = df[df[data_config.date_column].dt.date == date_7_days_ago].copy()
-        filtered_df[data_config.date_column] = filtered_df[
-            data_config.date_column
-        ].apply(
-            lambda x: x.replace(
-                year=current_date.year, month=current_date.month, day=current_date.day
-            )
+        df = _add_pred_rows(
+            df=df,
+            date_column=data_config.date_column,
+            horizon_days=data_config.horizon_days,
+            pred_freq=data_config.pred_freq,
         )
-        filtered_df["price"] = 0
-        df = pd.concat([df, filtered_df], ignore_index=True)
 
     return df
 
 
-def add_columns(df: pd.DataFrame) -> pd.DataFrame:
+@instrumented("load_stations_sortes")
+def load_stations_sortes(
+    pandas_connection: "PandasOCI",
+    data_config: Data_Config,
+    pairs: List[Tuple[str, str]],
+    add_pred: bool = True,
+    n_before: Optional[int] = None,
+) -> pd.DataFrame:
+    """This function loads several station/sorte series with a single columnar read of the wide df.
+    The wide columns are melted into a long df with the columns station, sorte, the date column and price.
+
+    Args:
+        pandas_connection (PandasOCI): The connection used to retrieve the df.
+        data_config (Data_Config): The data configuration specifying the relevant information on which data to use.
+        pairs (List[Tuple[str, str]]): The (station, sorte) pairs to load.
+        add_pred (bool, optional): A flag whether to add a prediction time frame to each series. Defaults to True.
+        n_before (Optional[int], optional): If passed and pandas_connection is an ArrowFileSource, only the days needed for filter_n_days_before() with n_before are read, see load_station_sorte().
+            Defaults to None, i.e. the whole history.
+
+    Raises:
+        ValueError: If pairs is empty.
+
+    Returns:
+        pd.DataFrame: The long df with one block of rows per station and sorte.
+    """
+    if len(pairs) == 0:
+        raise ValueError("At least one (station, sorte) pair must be passed.")
+
+    # Map every wide column to its pair, dropping duplicated pairs while keeping the order
+    series_dict = {f"{sorte}_{station}": (station, sorte) for station, sorte in pairs}
+    series_codes = {series: i for i, series in enumerate(series_dict)}
+
+    # Download all needed columns in one read:
+    with stage("retrieve_df", bytes_read=True) as current_stage:
+        wide_df = pandas_connection.retrieve_df(
+            path=data_config.df_path,
+            df_format=data_config.df_format,
+            columns=[data_config.date_column, *series_dict],
+            **_window_kwargs(
+                pandas_connection=pandas_connection,
+                data_config=data_config,
+                add_pred=add_pred,
+                n_before=n_before,
+            ),
+        )
+        current_stage.set_result(wide_df)
+
+    # Melt the wide df into a long df and drop the missing prices of each series
+    df = wide_df.melt(
+        id_vars=data_config.date_column,
+        value_vars=list(series_dict),
+        var_name="series",
+        value_name="price",
+    ).dropna()
+
+    # Append the prediction rows and keep the rows of every series next to each other
+    if add_pred:
+        df = _add_pred_rows(
+            df=df,
+            date_column=data_config.date_column,
+            horizon_days=data_config.horizon_days,
+            pred_freq=data_config.pred_freq,
+        )
+        df = df.sort_values(
+            by="series", kind="stable", key=lambda x: x.map(series_codes)
+        )
+
+    df.insert(0, "station", df["series"].map({k: v[0] for k, v in series_dict.items()}))
+    df.insert(1, "sorte", df["series"].map({k: v[1] for k, v in series_dict.items()}))
+
+    return df.drop(columns="series").reset_index(drop=True)
+
+
+def _window_kwargs(
+    pandas_connection: "PandasOCI",
+    data_config: Data_Config,
+    add_pred: bool,
+    n_before: Optional[int],
+) -> dict:
+    """Returns the keyword arguments of retrieve_df() which read only the days needed for filter_n_days_before() with n_before and for the lag features.
+    The arguments are empty if n_before is None or the connection is no ArrowFileSource.
+    """
+    if n_before is None or not isinstance(pandas_connection, ArrowFileSource):
+        return {}
+    if add_pred:
+        last_day = pd.Timestamp(datetime.date.today())
+    else:
+        last_day = pandas_connection.last_date(
+            path=data_config.df_path,
+            df_format=data_config.df_format,
+            date_column=data_config.date_column,
+        ).normalize()
+    return {
+        "date_column": data_config.date_column,
+        "date_from": last_day
+        - pd.Timedelta(days=max(n_before - 1 + N_LAG_DAYS, 7 if add_pred else 0)),
+    }
+
+
+def _add_pred_rows(
+    df: pd.DataFrame,
+    date_column: str,
+    horizon_days: int = 1,
+    pred_freq: Optional[str] = None,
+) -> pd.DataFrame:
+    """Adds the times of the next horizon_days days from today on with a price of 0 to df --> this price will be predicted later.
+    Without pred_freq, every future day gets the times of the same weekday in the last week, which are shifted by whole weeks.
+    Timezone-aware times keep their wall-clock time across a DST change: times which do not exist on the future day are dropped and ambiguous ones get the first (DST) occurrence.
+    Additional columns (e.g. station and sorte of a long df) are copied from these rows, or with pred_freq from every distinct combination in df.
+
+    Args:
+        df (pd.DataFrame): A data frame as produced by load_station_sorte() without prediction rows.
+        date_column (str): The column containing the dates and times.
+        horizon_days (int, optional): The number of days to predict. Defaults to 1, i.e. today.
+        pred_freq (Optional[str], optional): The pd.date_range frequency of the prediction times. Defaults to None, i.e. the times of last week.
+
+    Returns:
+        pd.DataFrame: The df with the appended prediction rows.
+    """
+    today = pd.Timestamp(datetime.date.today())
+    day_hours = df[date_column]
+    tz = getattr(day_hours.dt, "tz", None)
+
+    if pred_freq is None:
+        # Select the rows of the last 7 days on the day numbers of the wall times, without creating date objects
+        wall_times = day_hours.dt.tz_localize(None) if tz is not None else day_hours
+        day_number = wall_times.to_numpy(dtype="datetime64[D]").astype(np.int64)
+        today_number = today.to_datetime64().astype("datetime64[D]").astype(np.int64)
+        last_week = np.flatnonzero(
+            (day_number >= today_number - 7) & (day_number < today_number)
+        )
+
+        # Repeat them week by week until the horizon is covered
+        positions, weeks = [], []
+        for week in range(1, (horizon_days - 1) // 7 + 2):
+            in_horizon = last_week[
+                day_number[last_week] + 7 * week < today_number + horizon_days
+            ]
+            positions.append(in_horizon)
+            weeks.append(np.full(len(in_horizon), week))
+        positions = np.concatenate(positions)
+        pred_df = df.take(positions)
+        shift = pd.to_timedelta(np.concatenate(weeks) * 7, unit="D").to_numpy()
+        if tz is None:
+            pred_df[date_column] = pred_df[date_column] + shift
+        else:
+            # Shift the wall times and localize them again, adding weeks to tz-aware times would move their hour across a DST change
+            pred_df[date_column] = (wall_times.take(positions) + shift).dt.tz_localize(
+                tz,
+                ambiguous=np.ones(len(pred_df), dtype=bool),
+                nonexistent="NaT",
+            )
+            pred_df = pred_df[pred_df[date_column].notna()]
+    else:
+        pred_times = pd.date_range(
+            start=today,
+            end=today + pd.Timedelta(days=horizon_days),
+            freq=pred_freq,
+            inclusive="left",
+            tz=tz,
+        )
+        key_columns = list(df.columns.drop([date_column, "price"]))
+        pred_df = pd.DataFrame({date_column: pred_times})
+        if key_columns:
+            pred_df = df[key_columns].drop_duplicates().merge(pred_df, how="cross")
+        pred_df = pred_df.reindex(columns=df.columns)
+
+    pred_df["price"] = 0.0
+    return pd.concat([df, pred_df], ignore_index=True)
+
+
+@instrumented("add_columns")
+def add_columns(
+    df: pd.DataFrame,
+    dtype_policy: Literal["default", "compact"] = "default",
+    horizon_days: int = 1,
+) -> pd.DataFrame:
     """This function adds date features to the df:
         - day_of_week
         - hour
+        - hour_format (categorical "HH:MM")
+        - Day (datetime64 at midnight)
         - trend
+        - week (categorical "%Y-%W")
         - avg_daily_price for the last 1,2,3 days
-        - is_last ( a flag flagging the last date in the df)
+        - is_last ( a flag flagging the last date in the df, or the last horizon_days days)
+    All features are computed with datetime64/integer arithmetic on the day numbers, the passed df is not modified.
 
     Args:
         df (pd.DataFrame): A data frame as produced by load_station_sorte().
+        dtype_policy (Literal["default", "compact"], optional): With "compact", the price and the numeric features are stored as float32 and small integers (see COMPACT_DTYPES),
+            which about halves the memory of the df. Defaults to "default".
+        horizon_days (int, optional): The number of prediction days at the end of the df, see Data_Config. The lags of a prediction day carry the average price of the last day before them forward.
+            Defaults to 1.
 
     Returns:
         pd.DataFrame: The data frame with the added features.
     """
+    features = _date_features(df["Day_Hours"])
+    day_number = features.pop("day_number")
+
+    # Calculate the average prices of the 3 days before on the codes of the sorted unique days
+    unique_days, day_codes = np.unique(day_number, return_inverse=True)
+    avg_daily_price = df["price"].groupby(day_codes).mean().to_numpy(dtype=np.float64)
+    if horizon_days > 1:
+        # The zero prices of the prediction days must not become lags of later prediction days
+        first_pred_day = np.searchsorted(
+            unique_days, unique_days[-1] - horizon_days + 1
+        )
+        avg_daily_price[first_pred_day:] = (
+            avg_daily_price[first_pred_day - 1] if first_pred_day > 0 else np.nan
+        )
+    for lag in range(1, N_LAG_DAYS + 1):
+        features[f"avg_daily_price_lag{lag}"] = _daily_lag(
+            avg_daily_price=avg_daily_price, day_codes=day_codes, lag=lag
+        )
+
+    # Determine the last horizon_days days and flag them as column "is_last"
+    features["is_last"] = np.where(day_number > unique_days[-1] - horizon_days, 1, 0)
+
+    if dtype_policy == "compact":
+        features["price"] = df["price"].to_numpy()
+        for column, dtype in COMPACT_DTYPES.items():
+            features[column] = features[column].astype(dtype)
+
+    # assign() copies df once, so the index is replaced instead of copying it again with reset_index()
+    df = df.assign(**features)
+    df.index = pd.RangeIndex(len(df))
+    return df
+
+
+def _date_features(day_hours: pd.Series, trend_origin: Optional[int] = None) -> dict:
+    """Computes the date features of add_columns() from a datetime64 column.
+
+    Args:
+        day_hours (pd.Series): The datetime64 column with the dates and times.
+        trend_origin (Optional[int], optional): The day number (days since 1970-01-01) where the trend starts. Defaults to None, i.e. the first day in day_hours.
+
+    Returns:
+        dict: A dict with the feature columns and the int64 array day_number.
+    """
+    # Use the wall times of timezone-aware columns
+    if getattr(day_hours.dt, "tz", None) is not None:
+        day_hours = day_hours.dt.tz_localize(None)
+    timestamps = day_hours.to_numpy(dtype="datetime64[ns]")
+    days = timestamps.astype("datetime64[D]")
+    day_number = days.astype(np.int64)
+    minute_of_day = (timestamps - days).astype("timedelta64[m]").astype(np.int64)
+
+    # 1970-01-01 was a Thursday, i.e. day_of_week 3
+    day_of_week = ((day_number + 3) % 7).astype(np.int32)
+    if trend_origin is None:
+        trend_origin = day_number.min() if len(day_number) > 0 else 0
 
-    # Create day and trend columns
-    df["day_of_week"] = df["Day_Hours"].dt.dayofweek
-    df["hour"] = df["Day_Hours"].dt.hour + (
-        (df["Day_Hours"].dt.minute.astype("float") // 30) / 2
+    # %W counts the weeks starting on Monday, days before the first Monday are in week 00
+    day = pd.DatetimeIndex(days.astype("datetime64[ns]"))
+    week_number = (day.dayofyear.to_numpy() - 1 + 7 - day_of_week) // 7
+    week_key, week_codes = np.unique(
+        day.year.to_numpy() * 100 + week_number, return_inverse=True
     )
-    df["hour_format"] = df["Day_Hours"].dt.time.astype(str).str[:5]
-    df["Day"] = df["Day_Hours"].dt.date
-    df["trend"] = df["Day"].apply(lambda x: x.toordinal())
-    df["trend"] = df["trend"] - df["trend"].min()
-    df["week"] = df["Day_Hours"].astype("datetime64[ns]").dt.strftime("%Y-%W")
+    hour_key, hour_codes = np.unique(minute_of_day, return_inverse=True)
 
-    # Calculate the average prices of the 3 days before
-    avg_daily_price = df.groupby("Day")[["price"]].mean().reset_index()
-    avg_daily_price = avg_daily_price.sort_values(by="Day")
+    return {
+        "day_of_week": day_of_week,
+        "hour": minute_of_day // 60 + (minute_of_day % 60 // 30) / 2,
+        "hour_format": pd.Categorical.from_codes(
+            hour_codes, [f"{m // 60:02d}:{m % 60:02d}" for m in hour_key]
+        ),
+        "Day": day.to_numpy(),
+        "trend": day_number - trend_origin,
+        "week": pd.Categorical.from_codes(
+            week_codes, [f"{k // 100}-{k % 100:02d}" for k in week_key]
+        ),
+        "day_number": day_number,
+    }
 
-    avg_daily_price["avg_daily_price_lag1"] = avg_daily_price["price"].shift(1).bfill()
-    avg_daily_price["avg_daily_price_lag2"] = avg_daily_price["price"].shift(2).bfill()
-    avg_daily_price["avg_daily_price_lag3"] = avg_daily_price["price"].shift(3).bfill()
-    del avg_daily_price["price"]
 
-    # Merge the calculated averages to df
-    df = df.merge(avg_daily_price, on="Day", how="inner")
+def _daily_lag(
+    avg_daily_price: np.ndarray, day_codes: np.ndarray, lag: int
+) -> np.ndarray:
+    """Shifts the daily average prices by lag days and back-fills the first days, i.e. shift(lag).bfill() on the daily means.
 
-    # Determine the last day and flag it as column "is_last"
-    df["is_last"] = np.where(df["Day"] == df["Day"].max(), 1, 0)
+    Args:
+        avg_daily_price (np.ndarray): The average price of each sorted unique day.
+        day_codes (np.ndarray): The code of the day of each row.
+        lag (int): The number of days to shift.
 
-    return df
+    Returns:
+        np.ndarray: The lagged average daily price of each row.
+    """
+    if len(avg_daily_price) <= lag:
+        return np.full(len(day_codes), np.nan)
+    return avg_daily_price[np.maximum(day_codes - lag, 0)]
 
 
+@instrumented("filter_n_days_before")
 def filter_n_days_before(df: pd.DataFrame, n_before: int) -> pd.DataFrame:
     """A function filtering the input df to n days before the last date.
     This is needed to reduce the training dates, since more training dates don't produce better results but increase serving time.
@@ -120,13 +420,13 @@ def filter_n_days_before(df: pd.DataFrame, n_before: int) -> pd.DataFrame:
     Returns:
         pd.DataFrame: The filtered input df.
     """
-    # Create 'Day' column if not existant
-    if "Day" not in df:
-        df["Day"] = df["Day_Hours"].dt.date
+    # Use the 'Day' column if existant
+    if "Day" in df:
+        day = df["Day"]
+    else:
+        day = df["Day_Hours"].dt.normalize()
 
-    # Reduce by n_before days before max_Date
-    max_Date = df["Day"].max()
+    # Reduce by n_before days before max_Date, take() copies the rows once and returns an independent df
+    max_Date = day.max()
     min_Date = max_Date - datetime.timedelta(days=n_before - 1)
-    df = df[(df["Day"] >= min_Date) & (df["Day"] <= max_Date)].copy()
-
-    return df
+    return df.take(np.flatnonzero(((day >= min_Date) & (day <= max_Date)).to_numpy()))
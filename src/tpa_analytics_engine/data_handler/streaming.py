@@ -0,0 +1,134 @@
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pandas as pd
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    load_stations_sortes,
+)
+from tpa_analytics_engine.models.make_forecast import run
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import Forecast_Config
+
+
+def list_pairs(
+    source: ArrowFileSource, data_config: Data_Config
+) -> List[Tuple[str, str]]:
+    """Returns the (station, sorte) pairs of all "{sorte}_{station}" columns of the wide df, only its schema is read.
+
+    Args:
+        source (ArrowFileSource): The source of the wide df.
+        data_config (Data_Config): The data configuration.
+
+    Returns:
+        List[Tuple[str, str]]: The pairs in the order of the columns.
+    """
+    pairs = []
+    for column in source.column_names(
+        path=data_config.df_path, df_format=data_config.df_format
+    ):
+        if column != data_config.date_column and "_" in column:
+            sorte, station = column.split("_", 1)
+            pairs.append((station, sorte))
+    return pairs
+
+
+def iter_feature_frames(
+    pandas_connection: ArrowFileSource,
+    data_config: Data_Config,
+    pairs: Optional[List[Tuple[str, str]]] = None,
+    batch_size: int = 32,
+    n_before: Optional[int] = None,
+    add_pred: bool = True,
+) -> Iterator[Tuple[Tuple[str, str], pd.DataFrame]]:
+    """Streams the feature frames of the series of the wide df, reading batch_size series columns at a time.
+    Only one batch of series is in memory at once, so the peak memory is bounded by batch_size instead of the size of the wide df.
+
+    Args:
+        pandas_connection (ArrowFileSource): The connection from which the column batches are read.
+            Other connections with a retrieve_df() method work if pairs is passed, but may download the whole df per batch.
+        data_config (Data_Config): The data configuration.
+        pairs (Optional[List[Tuple[str, str]]], optional): The (station, sorte) pairs to stream. Defaults to None, i.e. all series of the wide df.
+        batch_size (int, optional): The number of series read at once. Defaults to 32.
+        n_before (Optional[int], optional): If passed, only the days needed for filter_n_days_before() with n_before are read, see load_station_sorte(). Defaults to None.
+        add_pred (bool, optional): A flag whether to add a prediction time frame to each series. Defaults to True.
+
+    Raises:
+        ValueError: If batch_size is smaller than 1.
+        ValueError: If pairs is None and pandas_connection is no ArrowFileSource.
+
+    Yields:
+        Tuple[Tuple[str, str], pd.DataFrame]: The (station, sorte) pair and its df with the columns of add_columns().
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}.")
+    if pairs is None:
+        if not isinstance(pandas_connection, ArrowFileSource):
+            raise ValueError("pairs must be passed for a connection without a schema.")
+        pairs = list_pairs(source=pandas_connection, data_config=data_config)
+
+    for start in range(0, len(pairs), batch_size):
+        long_df = load_stations_sortes(
+            pandas_connection=pandas_connection,
+            data_config=data_config,
+            pairs=pairs[start : start + batch_size],
+            add_pred=add_pred,
+            n_before=n_before,
+        )
+        for (station, sorte), series_df in long_df.groupby(
+            ["station", "sorte"], sort=False
+        ):
+            yield (station, sorte), add_columns(
+                df=series_df.drop(columns=["station", "sorte"]),
+                dtype_policy=data_config.dtype_policy,
+                horizon_days=data_config.horizon_days if add_pred else 1,
+            )
+        del long_df
+
+
+def stream_forecasts(
+    pandas_connection: ArrowFileSource,
+    data_config: Data_Config,
+    forecast_config: Forecast_Config,
+    pairs: Optional[List[Tuple[str, str]]] = None,
+    batch_size: int = 32,
+) -> Iterator[pd.DataFrame]:
+    """Streams the forecasts of the series of the wide df, see iter_feature_frames().
+    Only the days needed for the forecast window are read, so the trend of add_columns() starts at the first read day.
+
+    Args:
+        pandas_connection (ArrowFileSource): The connection from which the column batches are read.
+        data_config (Data_Config): The data configuration.
+        forecast_config (Forecast_Config): The forecast configuration.
+        pairs (Optional[List[Tuple[str, str]]], optional): The (station, sorte) pairs to forecast. Defaults to None, i.e. all series of the wide df.
+        batch_size (int, optional): The number of series read at once. Defaults to 32.
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode.
+
+    Yields:
+        pd.DataFrame: The df with the forecast of one series, identified by the columns station and sorte.
+    """
+    check_local_mode(forecast_config, "stream_forecasts()")
+    for (station, sorte), df in iter_feature_frames(
+        pandas_connection=pandas_connection,
+        data_config=data_config,
+        pairs=pairs,
+        batch_size=batch_size,
+        n_before=forecast_config.n_before,
+    ):
+        forecast_df = run(
+            df=filter_n_days_before(df=df, n_before=forecast_config.n_before),
+            forecast_config=forecast_config,
+            series_id=f"{sorte}_{station}",
+        )
+        forecast_df.insert(0, "station", station)
+        forecast_df.insert(1, "sorte", sorte)
+        yield forecast_df
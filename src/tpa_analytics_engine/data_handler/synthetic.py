@@ -0,0 +1,55 @@
+import datetime
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def make_wide_df(
+    n_stations: int = 10,
+    n_days: int = 30,
+    freq: str = "30min",
+    sortes: Sequence[str] = ("diesel", "e5", "e10"),
+    end: Optional[datetime.date] = None,
+    missing_share: float = 0.01,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Creates a synthetic wide df shaped like BASE_df_wide.ftr, i.e. a Day_Hours column and one price column per {sorte}_{station}.
+    The prices follow a station level, a daily and weekly profile and a random walk, a share of the prices is missing.
+
+    Args:
+        n_stations (int, optional): The number of stations, named "0", "1", .... Defaults to 10.
+        n_days (int, optional): The number of days of history. Defaults to 30.
+        freq (str, optional): The frequency of the Day_Hours column. Defaults to "30min".
+        sortes (Sequence[str], optional): The gas types of every station. Defaults to ("diesel", "e5", "e10").
+        end (Optional[datetime.date], optional): The day after the last day of history. Defaults to None, i.e. today.
+        missing_share (float, optional): The share of missing prices. Defaults to 0.01.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The synthetic wide df.
+    """
+    rng = np.random.default_rng(seed)
+    end_timestamp = pd.Timestamp(end or datetime.date.today())
+    day_hours = pd.date_range(
+        start=end_timestamp - pd.Timedelta(days=n_days),
+        end=end_timestamp,
+        freq=freq,
+        inclusive="left",
+    )
+    hours = (day_hours.hour + day_hours.minute / 60).to_numpy()
+    profile = 0.04 * np.cos(hours / 24 * 2 * np.pi) + 0.01 * (
+        day_hours.dayofweek.to_numpy() >= 5
+    )
+
+    columns = {"Day_Hours": day_hours}
+    for sorte_number, sorte in enumerate(sortes):
+        levels = 1.6 + 0.1 * sorte_number + rng.normal(0, 0.03, n_stations)
+        walks = np.cumsum(rng.normal(0, 0.002, (len(day_hours), n_stations)), axis=0)
+        prices = np.round(levels + profile[:, None] + walks, 3)
+        prices[rng.random(prices.shape) < missing_share] = np.nan
+        for station in range(n_stations):
+            columns[f"{sorte}_{station}"] = prices[:, station]
+
+    return pd.DataFrame(columns)
@@ -1,6 +1,13 @@
+from typing import Dict
+from typing import List
+from typing import Sequence
+
+import numpy as np
 import pandas as pd
+from tpa_analytics_engine.instrumentation import instrumented
 
 
+@instrumented("summarize")
 def summarize(df: pd.DataFrame, groupCol: str, aggCol: str) -> pd.Series:
     """Groups a df by a groupby column: groupCol for an aggregation column: aggCol.
 
@@ -21,7 +28,7 @@ def summarize(df: pd.DataFrame, groupCol: str, aggCol: str) -> pd.Series:
     if aggCol not in df:
         raise ValueError(f"The aggregation column: {aggCol} is not in the df.")
 
-    return df.groupby(groupCol)[aggCol].mean()
+    return df.groupby(groupCol, observed=True)[aggCol].mean()
 
 
 def mean_centralize(series: pd.Series) -> pd.Series:
@@ -34,3 +41,142 @@ def mean_centralize(series: pd.Series) -> pd.Series:
         pd.Series: The centralized series.
     """
     return series - series.mean()
+
+
+# The aggregations supported by summarize_many besides the quantiles
+AGGREGATIONS = ["mean", "median", "count"]
+
+
+def summarize_many(
+    df: pd.DataFrame,
+    groupCols: List[str],
+    aggCol: str = "price",
+    aggregations: Sequence[str] = ("mean",),
+    quantiles: Sequence[float] = (),
+    series_columns: Sequence[str] = ("station", "sorte"),
+    centralize_mean: bool = False,
+) -> Dict[str, pd.DataFrame]:
+    """Groups a long df of several series by every column of groupCols and aggregates aggCol per series and group without Python loops over the series.
+    The sums and counts are computed with np.bincount, the medians and quantiles (linearly interpolated like pd.Series.quantile) from one sort per groupCol.
+    Rows with a missing aggCol or groupCol are ignored.
+
+    Args:
+        df (pd.DataFrame): The long df to group, e.g. the is_last==0 rows of Forecast.long_df.
+        groupCols (List[str]): The groupby columns, every one gives a separate summary.
+        aggCol (str, optional): The aggregation column, these values will be aggregated. Defaults to "price".
+        aggregations (Sequence[str], optional): The aggregations out of "mean", "median" and "count". Defaults to ("mean",).
+        quantiles (Sequence[float], optional): The quantiles to compute, given as columns "q{quantile}". Defaults to ().
+        series_columns (Sequence[str], optional): The columns identifying a series. Defaults to ("station", "sorte"), pass () for a df of one series.
+        centralize_mean (bool, optional): If True, the mean of the mean summary of every series is subtracted from its mean, median and quantiles, see mean_centralize(). Defaults to False.
+
+    Raises:
+        ValueError: If a column of groupCols, aggCol or series_columns is not in the df.
+        ValueError: If an aggregation is not supported or a quantile is not in [0, 1].
+
+    Returns:
+        Dict[str, pd.DataFrame]: The summary by groupCol with a (series_columns..., groupCol) index and one column per aggregation.
+    """
+    for column in [*groupCols, aggCol, *series_columns]:
+        if column not in df:
+            raise ValueError(f"The column: {column} is not in the df.")
+    for aggregation in aggregations:
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(
+                f"Invalid aggregation: {aggregation}. Allowed values are {AGGREGATIONS}"
+            )
+    for quantile in quantiles:
+        if not 0 <= quantile <= 1:
+            raise ValueError(f"The quantile: {quantile} is not in [0, 1].")
+
+    values = df[aggCol].to_numpy(dtype=np.float64)
+    # The positions of the rows with a value and all groupCols, None if all rows have them
+    is_missing = np.isnan(values) | df[groupCols].isna().any(axis=1).to_numpy()
+    valid_positions = np.flatnonzero(~is_missing) if is_missing.any() else None
+    if valid_positions is not None:
+        values = values[valid_positions]
+    if len(series_columns) > 0:
+        series_codes = (
+            df.groupby(list(series_columns), sort=False, observed=True, dropna=False)
+            .ngroup()
+            .to_numpy()
+        )
+        first_positions = np.unique(series_codes, return_index=True)[1]
+        if valid_positions is not None:
+            series_codes = series_codes[valid_positions]
+        series_keys = df[list(series_columns)].iloc[first_positions]
+    else:
+        series_codes = np.zeros(len(values), dtype=np.int64)
+        series_keys = pd.DataFrame(index=[0])
+
+    # Sort the values once, the cells of every groupCol are then sorted stably by their codes
+    needs_sort = "median" in aggregations or len(quantiles) > 0
+    value_order = np.argsort(values, kind="stable") if needs_sort else None
+    n_series = int(series_codes.max()) + 1 if len(series_codes) > 0 else 0
+
+    summaries = {}
+    for groupCol in groupCols:
+        group_codes, group_values = pd.factorize(df[groupCol], sort=True)
+        if valid_positions is not None:
+            group_codes = group_codes[valid_positions]
+        # The dense code of every non-empty (series, group) cell
+        cell_ids = series_codes * len(group_values) + group_codes
+        is_cell = np.bincount(cell_ids, minlength=n_series * len(group_values)) > 0
+        cells = np.flatnonzero(is_cell)
+        cell_codes = (np.cumsum(is_cell) - 1)[cell_ids]
+        cell_series = cells // len(group_values)
+
+        counts = np.bincount(cell_codes, minlength=len(cells))
+        means = np.bincount(cell_codes, weights=values, minlength=len(cells)) / counts
+        columns = {"mean": means, "count": counts}
+        if needs_sort:
+            # Small integer codes are sorted with a radix sort
+            sorted_codes = cell_codes[value_order].astype(
+                np.min_scalar_type(max(len(cells) - 1, 0))
+            )
+            sorted_values = values[value_order][np.argsort(sorted_codes, kind="stable")]
+            starts = np.cumsum(counts) - counts
+            columns["median"] = _sorted_quantile(sorted_values, starts, counts, 0.5)
+            for quantile in quantiles:
+                columns[f"q{quantile}"] = _sorted_quantile(
+                    sorted_values, starts, counts, quantile
+                )
+
+        if centralize_mean:
+            # The mean of the mean summary of every series, subtracted from every location aggregation
+            series_means = np.bincount(cell_series, weights=means) / np.bincount(
+                cell_series
+            )
+            for column in columns:
+                if column != "count":
+                    columns[column] = columns[column] - series_means[cell_series]
+
+        index_columns = {
+            column: series_keys[column].to_numpy()[cell_series]
+            for column in series_columns
+        }
+        index_columns[groupCol] = np.asarray(group_values)[cells % len(group_values)]
+        summaries[groupCol] = pd.DataFrame(
+            {
+                **{column: columns[column] for column in aggregations},
+                **{f"q{quantile}": columns[f"q{quantile}"] for quantile in quantiles},
+            },
+            index=pd.MultiIndex.from_arrays(
+                list(index_columns.values()), names=list(index_columns)
+            )
+            if len(index_columns) > 1
+            else pd.Index(index_columns[groupCol], name=groupCol),
+        )
+
+    return summaries
+
+
+def _sorted_quantile(
+    sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray, quantile: float
+) -> np.ndarray:
+    """Returns the linearly interpolated quantile of every cell of sorted_values, where a cell consists of counts values from starts on."""
+    position = starts + quantile * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        position - lower
+    )
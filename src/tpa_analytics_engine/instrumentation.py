@@ -0,0 +1,276 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Protocol
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from tpa_analytics_engine.utils import get_rss_bytes
+
+
+# Pydantic Base Class for the Metrics of a Stage
+class Stage_Metrics(BaseModel):
+    """A pydantic class holding the metrics of one run of an instrumented stage.
+    The metrics are the duration, the number of rows of the result, the bytes of the loaded df (for loading stages) and the change of the resident set size.
+    """
+
+    stage: str
+    seconds: float
+    rows: Optional[int] = None
+    bytes_read: Optional[int] = None
+    memory_bytes: Optional[int] = None
+
+
+class MetricsSink(Protocol):
+    """The interface of a metrics sink, which receives the Stage_Metrics of every instrumented stage."""
+
+    def record(self, metrics: Stage_Metrics) -> None:
+        ...
+
+
+# The sinks of the current context, stages are only measured if this tuple is not empty
+_SINKS: ContextVar[Tuple[MetricsSink, ...]] = ContextVar("metrics_sinks", default=())
+
+
+@contextmanager
+def use_sink(sink: Optional[MetricsSink]) -> Iterator[None]:
+    """Sends the metrics of all stages run inside the context to sink in addition to the already active sinks.
+
+    Args:
+        sink (Optional[MetricsSink]): The sink to activate. If None, nothing is changed.
+    """
+    if sink is None or sink in _SINKS.get():
+        yield
+        return
+    token = _SINKS.set(_SINKS.get() + (sink,))
+    try:
+        yield
+    finally:
+        _SINKS.reset(token)
+
+
+class _Stage:
+    __slots__ = ("rows", "bytes_read", "track_bytes")
+
+    def __init__(self, track_bytes: bool = False) -> None:
+        """The mutable metrics of a running stage, which can be set inside a stage() context."""
+        self.rows: Optional[int] = None
+        self.bytes_read: Optional[int] = None
+        self.track_bytes = track_bytes
+
+    def set_result(self, result: Any) -> None:
+        """Sets the rows from the length of result (summed for a list) and, if bytes are tracked, bytes_read from the memory usage of a resulting df or array."""
+        if isinstance(result, list):
+            self.rows = sum(len(item) for item in result if hasattr(item, "__len__"))
+        elif hasattr(result, "__len__"):
+            self.rows = len(result)
+        if self.track_bytes and isinstance(result, pd.DataFrame):
+            self.bytes_read = int(result.memory_usage(index=False).sum())
+        elif self.track_bytes and isinstance(result, np.ndarray):
+            self.bytes_read = result.nbytes
+
+
+class _NullStage(_Stage):
+    __slots__ = ()
+
+    def set_result(self, result: Any) -> None:
+        pass
+
+
+# The stage yielded when no sink is active
+_NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def _measure(
+    name: str, sinks: Tuple[MetricsSink, ...], track_bytes: bool
+) -> Iterator[_Stage]:
+    """Measures the duration and memory of the context and records the metrics to sinks."""
+    current_stage = _Stage(track_bytes=track_bytes)
+    rss_before = get_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield current_stage
+    finally:
+        metrics = Stage_Metrics(
+            stage=name,
+            seconds=time.perf_counter() - start,
+            rows=current_stage.rows,
+            bytes_read=current_stage.bytes_read,
+            memory_bytes=get_rss_bytes() - rss_before,
+        )
+        for sink in sinks:
+            sink.record(metrics)
+
+
+@contextmanager
+def stage(name: str, bytes_read: bool = False) -> Iterator[_Stage]:
+    """Measures a block of code as a stage if a sink is active. The result of the block can be passed to set_result() of the yielded stage.
+
+    Args:
+        name (str): The name of the stage.
+        bytes_read (bool, optional): If True, the memory usage of the df passed to set_result() is recorded as bytes_read. Defaults to False.
+    """
+    sinks = _SINKS.get()
+    if not sinks:
+        yield _NULL_STAGE
+        return
+    with _measure(name, sinks, bytes_read) as current_stage:
+        yield current_stage
+
+
+def instrumented(name: str, bytes_read: bool = False) -> Callable:
+    """A decorator measuring every call of the decorated function as a stage if a sink is active.
+    The rows are taken from the length of the result.
+
+    Args:
+        name (str): The name of the stage.
+        bytes_read (bool, optional): If True, the memory usage of the resulting df is recorded as bytes_read. Defaults to False.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            sinks = _SINKS.get()
+            if not sinks:
+                return fn(*args, **kwargs)
+            with _measure(name, sinks, bytes_read) as current_stage:
+                result = fn(*args, **kwargs)
+                current_stage.set_result(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def instrumented_method(name: str) -> Callable:
+    """A decorator for methods of objects with a metrics_sink attribute (e.g. Forecast).
+    The sink of the object is active during the call, which is measured as a stage.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        instrumented_fn = instrumented(name)(fn)
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics_sink is None:
+                return instrumented_fn(self, *args, **kwargs)
+            with use_sink(self.metrics_sink):
+                return instrumented_fn(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class InMemoryCollector:
+    def __init__(self) -> None:
+        """A metrics sink collecting all Stage_Metrics in memory."""
+        self.records: List[Stage_Metrics] = []
+        self._lock = threading.Lock()
+
+    def record(self, metrics: Stage_Metrics) -> None:
+        with self._lock:
+            self.records.append(metrics)
+
+    def to_df(self) -> pd.DataFrame:
+        """Returns the collected metrics as a df with one row per stage run."""
+        with self._lock:
+            return pd.DataFrame(
+                [metrics.model_dump() for metrics in self.records],
+                columns=list(Stage_Metrics.model_fields),
+            )
+
+    def summary(self) -> pd.DataFrame:
+        """Returns the number of calls and the totals of the collected metrics per stage."""
+        return (
+            self.to_df()
+            .groupby("stage", sort=False)
+            .agg(
+                calls=("seconds", "size"),
+                seconds=("seconds", "sum"),
+                rows=("rows", "sum"),
+                bytes_read=("bytes_read", "sum"),
+                max_memory_bytes=("memory_bytes", "max"),
+            )
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records = []
+
+
+class PrometheusExporter:
+    def __init__(self, prefix: str = "tpa_analytics_engine") -> None:
+        """A metrics sink aggregating the Stage_Metrics per stage and rendering them in the Prometheus text format.
+
+        Args:
+            prefix (str, optional): The prefix of the metric names. Defaults to "tpa_analytics_engine".
+        """
+        self.prefix = prefix
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, metrics: Stage_Metrics) -> None:
+        with self._lock:
+            totals = self.totals.setdefault(
+                metrics.stage,
+                {
+                    "calls": 0,
+                    "seconds": 0.0,
+                    "rows": 0,
+                    "bytes_read": 0,
+                    "max_memory_bytes": 0,
+                },
+            )
+            totals["calls"] += 1
+            totals["seconds"] += metrics.seconds
+            totals["rows"] += metrics.rows or 0
+            totals["bytes_read"] += metrics.bytes_read or 0
+            totals["max_memory_bytes"] = max(
+                totals["max_memory_bytes"], metrics.memory_bytes or 0
+            )
+
+    def render(self) -> str:
+        """Returns the aggregated metrics in the Prometheus text exposition format."""
+        descriptions = [
+            ("calls", "counter", "The number of runs of the stage."),
+            ("seconds", "counter", "The total duration of the stage in seconds."),
+            ("rows", "counter", "The total number of rows produced by the stage."),
+            ("bytes_read", "counter", "The total bytes loaded by the stage."),
+            (
+                "max_memory_bytes",
+                "gauge",
+                "The maximum change of the resident set size during the stage.",
+            ),
+        ]
+        lines = []
+        with self._lock:
+            for key, metric_type, description in descriptions:
+                suffix = "_total" if metric_type == "counter" else ""
+                metric = f"{self.prefix}_stage_{key}{suffix}"
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} {metric_type}")
+                for stage_name, totals in self.totals.items():
+                    lines.append(f'{metric}{{stage="{stage_name}"}} {totals[key]}')
+        return "\n".join(lines) + "\n"
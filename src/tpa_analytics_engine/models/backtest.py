@@ -0,0 +1,354 @@
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import Executor_Config
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.multi_horizon import LAG_PATTERN
+from tpa_analytics_engine.models.sklearn import create_estimator
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+# The predictions of a chunk of cutoffs: the row positions, the cutoff day numbers and the predictions of the test rows
+Chunk_Result = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+@instrumented("backtest")
+def backtest(
+    frames: Iterable[Tuple[Tuple[str, str], pd.DataFrame]],
+    forecast_config: Forecast_Config,
+    n_cutoffs: int = 30,
+    horizon_days: int = 1,
+    step_days: int = 1,
+    cutoff_chunk_size: int = 16,
+    forecast_col_name: str = "price",
+) -> pd.DataFrame:
+    """Runs a rolling-origin backtest: for every cutoff day, the estimator is fitted on the days before it and forecasts the horizon_days days from it on.
+    The features of every series are computed once, the training windows of the cutoffs are slices of its feature matrix instead of copies.
+    Like a forecast of load_df(), a cutoff is trained on the n_before - horizon_days days before it, and the lags of later horizon days carry the last known daily average forward.
+    The chunks of cutoff_chunk_size cutoffs of all series run on the executor of forecast_config, the fitted estimators are not exported.
+
+    Args:
+        frames (Iterable[Tuple[Tuple[str, str], pd.DataFrame]]): The (station, sorte) pairs and their dfs of add_columns() without prediction rows,
+            e.g. iter_feature_frames() with add_pred=False.
+        forecast_config (Forecast_Config): The forecast configuration. With a selection or a horizon_mode other than "single", every cutoff is forecasted by forecast_sklearn() on a copy of its window.
+        n_cutoffs (int, optional): The number of cutoffs per series. Defaults to 30.
+        horizon_days (int, optional): The number of days forecasted from every cutoff on. Defaults to 1.
+        step_days (int, optional): The number of days between the cutoffs. Defaults to 1.
+        cutoff_chunk_size (int, optional): The number of cutoffs of a series submitted to a worker at once. Defaults to 16.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode or n_cutoffs, horizon_days, step_days or cutoff_chunk_size is smaller than 1.
+
+    Returns:
+        pd.DataFrame: The forecasts of all test rows with the columns station, sorte, cutoff, horizon (0 is the cutoff day), Day_Hours, the forecast_col_name and pred.
+    """
+    check_local_mode(forecast_config, "backtest()")
+    if min(n_cutoffs, horizon_days, step_days, cutoff_chunk_size) < 1:
+        raise ValueError(
+            "n_cutoffs, horizon_days, step_days and cutoff_chunk_size must be at least 1."
+        )
+
+    # The estimators of the cutoffs are never exported, they would overwrite the exports of the served estimators
+    forecast_config = forecast_config.model_copy(update={"export": None})
+    executor = create_executor(forecast_config.executor)
+    n_train_days = max(forecast_config.n_before - horizon_days, 1)
+    fast_path = (
+        forecast_config.selection is None and forecast_config.horizon_mode == "single"
+    )
+    series = []
+    try:
+        for (station, sorte), df in frames:
+            df = df.sort_values("Day_Hours", kind="stable", ignore_index=True)
+            day_number = df["Day"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+            if len(day_number) == 0:
+                continue
+            cutoffs = select_cutoffs(
+                day_number=day_number,
+                n_cutoffs=n_cutoffs,
+                horizon_days=horizon_days,
+                step_days=step_days,
+            )
+            exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+            X, y, day_codes, avg_daily_price = prepare_series(
+                df=df,
+                exogenous_vars=exogenous_vars,
+                forecast_col_name=forecast_col_name,
+            )
+            results: List = []
+            for start in range(0, len(cutoffs), cutoff_chunk_size):
+                chunk = cutoffs[start : start + cutoff_chunk_size]
+                # Only the rows of the windows of the chunk are passed to the worker
+                lo, hi = np.searchsorted(
+                    day_number, [chunk[0] - n_train_days, chunk[-1] + horizon_days]
+                )
+                chunk_args = (
+                    None if fast_path else df.iloc[lo:hi],
+                    X[lo:hi],
+                    y[lo:hi],
+                    day_number[lo:hi],
+                    day_codes[lo:hi],
+                    avg_daily_price,
+                    lag_columns(exogenous_vars),
+                    lo,
+                    chunk,
+                    forecast_config,
+                    n_train_days,
+                    horizon_days,
+                    forecast_col_name,
+                )
+                results.append(
+                    backtest_chunk(*chunk_args)
+                    if executor is None
+                    else executor.submit(backtest_chunk, *chunk_args)
+                )
+            series.append((station, sorte, df, day_number, results))
+
+        # Combine the test rows of all cutoffs of every series
+        prediction_dfs = []
+        for station, sorte, df, day_number, results in series:
+            chunks = [
+                result.result() if isinstance(result, Future) else result
+                for result in results
+            ]
+            if not chunks:
+                continue
+            positions = np.concatenate([chunk[0] for chunk in chunks])
+            cutoff_days = np.concatenate([chunk[1] for chunk in chunks])
+            prediction_dfs.append(
+                pd.DataFrame(
+                    {
+                        "station": station,
+                        "sorte": sorte,
+                        "cutoff": cutoff_days.astype("datetime64[D]").astype(
+                            "datetime64[ns]"
+                        ),
+                        "horizon": day_number[positions] - cutoff_days,
+                        "Day_Hours": df["Day_Hours"].to_numpy()[positions],
+                        forecast_col_name: df[forecast_col_name].to_numpy()[positions],
+                        "pred": np.concatenate([chunk[2] for chunk in chunks]),
+                    }
+                )
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if not prediction_dfs:
+        return pd.DataFrame(
+            columns=[
+                "station",
+                "sorte",
+                "cutoff",
+                "horizon",
+                "Day_Hours",
+                forecast_col_name,
+                "pred",
+            ]
+        )
+    return pd.concat(prediction_dfs, ignore_index=True)
+
+
+def backtest_metrics(
+    predictions: pd.DataFrame,
+    by: Sequence[str] = ("station", "sorte", "horizon"),
+    forecast_col_name: str = "price",
+) -> pd.DataFrame:
+    """Computes the error metrics of the predictions of backtest() per group.
+
+    Args:
+        predictions (pd.DataFrame): The df of backtest().
+        by (Sequence[str], optional): The columns to group by, e.g. ("horizon",) for the metrics of all series per horizon. Defaults to ("station", "sorte", "horizon").
+        forecast_col_name (str, optional): The name of the forecasted column. Defaults to "price".
+
+    Returns:
+        pd.DataFrame: The mean absolute error (mae), root mean squared error (rmse), mean absolute percentage error (mape), mean error (bias) and number of rows (n) per group.
+    """
+    error = predictions["pred"] - predictions[forecast_col_name]
+    errors = pd.DataFrame(
+        {
+            "absolute": error.abs(),
+            "squared": error**2,
+            "percentage": (error / predictions[forecast_col_name]).abs(),
+            "error": error,
+        }
+    )
+    grouped = errors.groupby([predictions[column] for column in by], sort=True)
+    means = grouped.mean()
+    return pd.DataFrame(
+        {
+            "mae": means["absolute"],
+            "rmse": np.sqrt(means["squared"]),
+            "mape": means["percentage"],
+            "bias": means["error"],
+            "n": grouped.size(),
+        }
+    )
+
+
+def create_executor(
+    executor_config: Executor_Config, initializer=None, initargs: tuple = ()
+) -> Optional[Executor]:
+    """Returns the pool of the executor configuration, None if its fits run in the calling process.
+
+    Args:
+        executor_config (Executor_Config): The executor configuration.
+        initializer (optional): A function called with initargs in every worker before its first task. Defaults to None.
+        initargs (tuple, optional): The arguments of the initializer. Defaults to ().
+
+    Returns:
+        Optional[Executor]: The pool, which the caller must shut down, or None for the "serial" backend and a single job.
+    """
+    if executor_config.backend == "serial" or executor_config.n_jobs == 1:
+        return None
+    pool_class = (
+        ProcessPoolExecutor
+        if executor_config.backend == "process"
+        else ThreadPoolExecutor
+    )
+    return pool_class(
+        max_workers=executor_config.n_jobs, initializer=initializer, initargs=initargs
+    )
+
+
+def select_cutoffs(
+    day_number: np.ndarray, n_cutoffs: int, horizon_days: int, step_days: int
+) -> np.ndarray:
+    """Returns the day numbers of the last n_cutoffs cutoffs of a series in ascending order, whose horizon_days days are all in the series and which have a day before them."""
+    last_cutoff = day_number[-1] - horizon_days + 1
+    cutoffs = last_cutoff - step_days * np.arange(n_cutoffs)[::-1]
+    return cutoffs[cutoffs > day_number[0]]
+
+
+def prepare_series(
+    df: pd.DataFrame, exogenous_vars: List[str], forecast_col_name: str = "price"
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the arrays of a series sorted by Day_Hours shared by all its cutoffs.
+
+    Args:
+        df (pd.DataFrame): The df of add_columns() of one series, sorted by Day_Hours.
+        exogenous_vars (List[str]): The columns of the feature matrix.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The float64 feature matrix, the target, the code of the day of every row and the average of every day.
+    """
+    day_number = df["Day"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    _, day_codes = np.unique(day_number, return_inverse=True)
+    avg_daily_price = (
+        df[forecast_col_name].groupby(day_codes).mean().to_numpy(dtype=np.float64)
+    )
+    return (
+        df[exogenous_vars].to_numpy(dtype=np.float64),
+        df[forecast_col_name].to_numpy(dtype=np.float64),
+        day_codes,
+        avg_daily_price,
+    )
+
+
+def lag_columns(exogenous_vars: List[str]) -> List[Tuple[int, int]]:
+    """Returns the positions in exogenous_vars and the lags of the daily lag features of add_columns()."""
+    return [
+        (i, int(match.group(1)))
+        for i, column in enumerate(exogenous_vars)
+        if (match := LAG_PATTERN.match(column))
+    ]
+
+
+def backtest_chunk(
+    df: Optional[pd.DataFrame],
+    X: np.ndarray,
+    y: np.ndarray,
+    day_number: np.ndarray,
+    day_codes: np.ndarray,
+    avg_daily_price: np.ndarray,
+    lags: List[Tuple[int, int]],
+    offset: int,
+    cutoffs: np.ndarray,
+    forecast_config: Forecast_Config,
+    n_train_days: int,
+    horizon_days: int,
+    forecast_col_name: str,
+) -> Chunk_Result:
+    """Fits and forecasts the cutoffs of one series on the rows from offset on, see backtest(). Also evaluates the trials of tuning.tune().
+    Without df, the estimator is fitted on slices of X, otherwise forecast_sklearn() runs on a copy of the window of df.
+
+    Args:
+        df (Optional[pd.DataFrame]): The rows of the series as df, None for the fast path on X.
+        X (np.ndarray): The feature matrix of the rows, see prepare_series().
+        y (np.ndarray): The target of the rows.
+        day_number (np.ndarray): The day numbers of the rows.
+        day_codes (np.ndarray): The codes of the days of the rows in avg_daily_price.
+        avg_daily_price (np.ndarray): The average price of every day of the series.
+        lags (List[Tuple[int, int]]): The columns of X with the lagged daily averages and their lags, see lag_columns().
+        offset (int): The position of the first row in the series, added to the returned positions.
+        cutoffs (np.ndarray): The sorted day numbers of the cutoffs.
+        forecast_config (Forecast_Config): The forecast configuration.
+        n_train_days (int): The number of days before a cutoff the estimator is fitted on.
+        horizon_days (int): The number of days forecasted from every cutoff on.
+        forecast_col_name (str): The name of the column to forecast.
+
+    Returns:
+        Chunk_Result: The positions of the test rows in the series, their cutoff day numbers and their predictions.
+    """
+    exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+
+    positions, cutoff_days, preds = [], [], []
+    for cutoff in cutoffs:
+        start, split, stop = np.searchsorted(
+            day_number, [cutoff - n_train_days, cutoff, cutoff + horizon_days]
+        )
+        if split == start or stop == split:
+            continue
+
+        # The lags of later horizon days only know the daily average of the last training day
+        X_test = X[split:stop].copy()
+        last_code = day_codes[split - 1]
+        for column, lag in lags:
+            X_test[:, column] = avg_daily_price[
+                np.maximum(np.minimum(day_codes[split:stop] - lag, last_code), 0)
+            ]
+
+        if df is None:
+            estimator = create_estimator(forecast_config)
+            estimator.fit(
+                X=pd.DataFrame(X[start:split], columns=exogenous_vars, copy=False),
+                y=y[start:split],
+            )
+            pred = estimator.predict(
+                X=pd.DataFrame(X_test, columns=exogenous_vars, copy=False)
+            )
+        else:
+            window_df = df.iloc[start:stop].copy()
+            window_df.loc[window_df.index[split - start :], exogenous_vars] = X_test
+            window_df["is_last"] = np.where(
+                np.arange(stop - start) >= split - start, 1, 0
+            )
+            pred = forecast_sklearn(
+                df=window_df,
+                forecast_config=forecast_config,
+                forecast_col_name=forecast_col_name,
+            )["pred"].to_numpy()[split - start :]
+
+        positions.append(np.arange(offset + split, offset + stop))
+        cutoff_days.append(np.full(stop - split, cutoff))
+        preds.append(np.asarray(pred, dtype=np.float64))
+
+    if not positions:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float64),
+        )
+    return np.concatenate(positions), np.concatenate(cutoff_days), np.concatenate(preds)
@@ -0,0 +1,311 @@
+"""Exports fitted HistGradientBoostingRegressors into flat node arrays and predicts with them in NumPy, without importing sklearn.
+
+An exported model is an uncompressed .npz file, whose arrays are memory-mapped by load_exported(), so serving processes share its pages
+and only need NumPy. The predictions are identical to those of the estimator.
+"""
+import functools
+import os
+import struct
+import weakref
+import zipfile
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+
+# The version of the array layout written by export_estimator()
+EXPORT_FORMAT_VERSION = 1
+
+# The inverse links of the sklearn losses, by the class name of the link
+_INVERSE_LINKS = {"IdentityLink": "identity", "LogLink": "exp"}
+
+# The path every estimator was last exported to by export_fitted(), so estimators of a model cache are not exported again on every request
+_exported: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+
+
+class CompiledEnsemble:
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        """A tree ensemble exported by export_estimator(), which predicts a batch of rows with NumPy by descending all trees at once, one level per step.
+        The leaves are their own children, so a (row, tree) pair stops descending once its node stays the same.
+
+        Args:
+            arrays (Dict[str, np.ndarray]): The arrays of the exported .npz file, see export_estimator().
+
+        Raises:
+            ValueError: If the arrays were exported in another format version.
+        """
+        if int(arrays["format_version"]) != EXPORT_FORMAT_VERSION:
+            raise ValueError(
+                f"The exported model has the format version {int(arrays['format_version'])}, expected {EXPORT_FORMAT_VERSION}."
+            )
+        # The memory-mapped arrays are viewed as plain arrays, whose fancy indexing skips the memmap subclass
+        self.feature = np.asarray(arrays["feature"]).view(np.ndarray)
+        self.threshold = np.asarray(arrays["threshold"]).view(np.ndarray)
+        self.missing_go_to_left = np.asarray(arrays["missing_go_to_left"]).view(
+            np.ndarray
+        )
+        self.children = np.asarray(arrays["children"]).view(np.ndarray).ravel()
+        self.value = np.asarray(arrays["value"]).view(np.ndarray)
+        self.roots = np.asarray(arrays["roots"]).view(np.ndarray)
+        self.baseline = float(arrays["baseline"])
+        self.link = str(arrays["link"])
+        self.max_depth = int(arrays["max_depth"])
+        self.feature_names = [str(name) for name in arrays["feature_names"]]
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CompiledEnsemble":
+        """Loads an ensemble exported by export_estimator().
+
+        Args:
+            path (str): The path of the .npz file.
+            mmap (bool, optional): If True, the node arrays are memory-mapped read-only instead of read into memory. Defaults to True.
+
+        Returns:
+            CompiledEnsemble: The ensemble.
+        """
+        if mmap:
+            return cls(_memmap_npz(path))
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def predict(self, X: Any) -> np.ndarray:
+        """Predicts the rows of X like the predict() of the exported estimator.
+
+        Args:
+            X (Any): A 2d array of the features in the order of feature_names, or a df containing the feature_names as columns.
+
+        Returns:
+            np.ndarray: The float64 predictions of the rows.
+        """
+        if hasattr(X, "columns") and self.feature_names:
+            X = X[self.feature_names]
+        # sklearn predicts on float64, to which float32 values convert exactly
+        X = np.asarray(X, dtype=np.float64)
+        n_rows = X.shape[0]
+        if n_rows == 0:
+            return np.empty(0)
+
+        # The (row, tree) pairs which did not reach a leaf yet descend one level per step
+        nodes = np.tile(self.roots, n_rows)
+        active = np.arange(nodes.size)
+        X_flat = X.ravel()
+        row_offsets = (active // len(self.roots)) * X.shape[1]
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            x = X_flat[row_offsets[active] + self.feature[current]]
+            # NaN values compare False, so they go left only if missing_go_to_left
+            go_right = ~(
+                (x <= self.threshold[current])
+                | (np.isnan(x) & self.missing_go_to_left[current])
+            )
+            following = self.children[2 * current + go_right]
+            nodes[active] = following
+            active = active[following != current]
+            if len(active) == 0:
+                break
+        nodes = nodes.reshape(n_rows, len(self.roots))
+
+        # sklearn adds the trees one after the other to the baseline, which the cumulative sum repeats in the same order
+        values = np.empty((n_rows, len(self.roots) + 1))
+        values[:, 0] = self.baseline
+        values[:, 1:] = self.value[nodes]
+        return self._inverse_link(np.cumsum(values, axis=1)[:, -1])
+
+    def _inverse_link(self, raw: np.ndarray) -> np.ndarray:
+        return np.exp(raw) if self.link == "exp" else raw
+
+
+def export_estimator(
+    estimator: Any, path: str, feature_names: Optional[Sequence[str]] = None
+) -> None:
+    """Exports the trees of a fitted HistGradientBoostingRegressor into an uncompressed .npz file, which is replaced atomically.
+    The nodes of all trees are concatenated into flat arrays: feature, threshold, missing_go_to_left, children (left and right) and value, the roots are the first node of every tree.
+
+    Args:
+        estimator (Any): The fitted HistGradientBoostingRegressor.
+        path (str): The path of the .npz file.
+        feature_names (Optional[Sequence[str]], optional): The names of the features in the order of the columns the estimator was fitted on,
+            by which a df passed to CompiledEnsemble.predict() is ordered. Defaults to None, i.e. the feature_names_in_ of the estimator if fitted on a df.
+
+    Raises:
+        TypeError: If the estimator is no fitted gradient boosting estimator with one tree per iteration.
+        ValueError: If the estimator has categorical splits or a loss without an exportable link.
+    """
+    predictors = getattr(estimator, "_predictors", None)
+    if not predictors or getattr(estimator, "n_trees_per_iteration_", 1) != 1:
+        raise TypeError(
+            f"{type(estimator).__name__} is no fitted HistGradientBoostingRegressor."
+        )
+    link = _INVERSE_LINKS.get(type(estimator._loss.link).__name__)
+    if link is None or getattr(estimator, "_preprocessor", None) is not None:
+        raise ValueError(
+            "Only estimators without categorical features and with an identity or log link can be exported."
+        )
+
+    trees = [predictors_of_iteration[0].nodes for predictors_of_iteration in predictors]
+    if any(tree["is_categorical"].any() for tree in trees):
+        raise ValueError("Estimators with categorical splits cannot be exported.")
+    sizes = np.array([len(tree) for tree in trees], dtype=np.int64)
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    nodes = np.concatenate(trees)
+    # The children are offset by the root of their tree, the leaves point to themselves
+    offsets = np.repeat(roots, sizes)
+    own_index = np.arange(len(nodes), dtype=np.int64)
+    is_leaf = nodes["is_leaf"].astype(bool)
+    index_dtype = np.int32 if len(nodes) < 2**31 else np.int64
+    arrays = {
+        "format_version": np.array(EXPORT_FORMAT_VERSION),
+        "feature": np.where(is_leaf, 0, nodes["feature_idx"]).astype(np.int32),
+        "threshold": nodes["num_threshold"].astype(np.float64),
+        "missing_go_to_left": nodes["missing_go_to_left"].astype(bool),
+        "children": np.stack(
+            [
+                np.where(is_leaf, own_index, nodes["left"] + offsets),
+                np.where(is_leaf, own_index, nodes["right"] + offsets),
+            ],
+            axis=1,
+        ).astype(index_dtype),
+        "value": nodes["value"].astype(np.float64),
+        "roots": roots.astype(index_dtype),
+        "baseline": np.array(float(np.ravel(estimator._baseline_prediction)[0])),
+        "link": np.array(link),
+        "max_depth": np.array(max(int(tree["depth"].max()) for tree in trees)),
+        "feature_names": np.array(
+            list(
+                feature_names
+                if feature_names is not None
+                else getattr(estimator, "feature_names_in_", [])
+            ),
+            dtype=str,
+        ),
+    }
+
+    path_obj = Path(path)
+    path_obj.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path_obj.with_name(f"{path_obj.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_path, path_obj)
+
+
+def export_path(directory: str, series_id: str) -> str:
+    """Returns the path of the exported model of the series in directory, raises a ValueError for an empty series_id."""
+    if not series_id:
+        raise ValueError(
+            'An exported model needs a series_id, e.g. "{sorte}_{station}".'
+        )
+    return str(Path(directory) / f"{series_id}.npz")
+
+
+def export_fitted(
+    estimator: Any,
+    directory: str,
+    series_id: str,
+    feature_names: Optional[Sequence[str]] = None,
+) -> Optional[str]:
+    """Exports a fitted estimator of forecast_sklearn() to export_path(), unless the same estimator object was already exported there.
+    Estimators other than HistGradientBoostingRegressors and estimators of a series without series_id are not exported,
+    so forecasts of anonymous dfs never overwrite each other's exports.
+
+    Args:
+        estimator (Any): The fitted estimator.
+        directory (str): The directory of the exported models.
+        series_id (str): The id of the series, which names the file.
+        feature_names (Optional[Sequence[str]], optional): The names of the features, see export_estimator(). Defaults to None.
+
+    Returns:
+        Optional[str]: The path of the exported model or None if the estimator or series cannot be exported.
+    """
+    if not series_id:
+        return None
+    path = export_path(directory=directory, series_id=series_id)
+    if _exported.get(estimator) == path:
+        return path
+    try:
+        export_estimator(estimator=estimator, path=path, feature_names=feature_names)
+    except (TypeError, ValueError):
+        return None
+    _exported[estimator] = path
+    return path
+
+
+def load_exported(directory: str, series_id: str) -> CompiledEnsemble:
+    """Returns the memory-mapped exported model of the series, which is loaded again only after the file was replaced.
+
+    Args:
+        directory (str): The directory of the exported models.
+        series_id (str): The id of the series.
+
+    Raises:
+        ValueError: If series_id is empty.
+        FileNotFoundError: If the series has no exported model.
+
+    Returns:
+        CompiledEnsemble: The ensemble.
+    """
+    path = export_path(directory=directory, series_id=series_id)
+    return _load_cached(path, os.stat(path).st_mtime_ns)
+
+
+def predict_exported(df: Any, directory: str, series_id: str) -> np.ndarray:
+    """Forecasts the rows with is_last==1 of df with the exported model of the series, without fitting and without sklearn.
+
+    Args:
+        df (Any): The df on which to forecast, with the is_last column and the feature_names of the exported model.
+        directory (str): The directory of the exported models.
+        series_id (str): The id of the series.
+
+    Returns:
+        np.ndarray: The forecasts of the rows with is_last==1 in the order of df.
+    """
+    ensemble = load_exported(directory=directory, series_id=series_id)
+    is_last = np.flatnonzero(df["is_last"].to_numpy() == 1)
+    X = np.empty((len(is_last), len(ensemble.feature_names)))
+    for i, column in enumerate(ensemble.feature_names):
+        X[:, i] = df[column].to_numpy()[is_last]
+    return ensemble.predict(X)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_cached(path: str, mtime_ns: int) -> CompiledEnsemble:
+    """Loads the ensemble of path, cached by its modification time."""
+    return CompiledEnsemble.load(path)
+
+
+def _memmap_npz(path: str) -> Dict[str, np.ndarray]:
+    """Memory-maps the arrays of an uncompressed .npz file, which np.load() only reads into memory.
+    Every member of the zip archive is a .npy file, whose data starts after its local file header and its .npy header.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed and cannot be memory-mapped.")
+            file.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<HH", file.read(30)[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[: -len(".npy")]
+            if len(shape) == 0 or np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+                if len(shape) == 0:
+                    arrays[name] = np.frombuffer(
+                        file.read(dtype.itemsize), dtype=dtype
+                    ).reshape(())
+                continue
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=file.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
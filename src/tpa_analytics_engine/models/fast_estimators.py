@@ -0,0 +1,199 @@
+import inspect
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class FastEstimator:
+    """The base class of the NumPy-only estimators, which fit in milliseconds and follow the fit(X, y)/predict(X) interface of the sklearn estimators.
+    X is a df of the exogenous variables, whose rows are in time order.
+    """
+
+    def get_params(self, deep: bool = True) -> dict:
+        """Returns the keyword arguments of the estimator, like sklearn's get_params()."""
+        return {
+            name: getattr(self, name)
+            for name in inspect.signature(type(self).__init__).parameters
+            if name != "self"
+        }
+
+    def set_params(self, **params) -> "FastEstimator":
+        """Sets the keyword arguments of the estimator, like sklearn's set_params()."""
+        for name, value in params.items():
+            if name not in self.get_params():
+                raise ValueError(f"Invalid parameter {name} for {type(self).__name__}.")
+            setattr(self, name, value)
+        return self
+
+    def _fit_cells(self, X: pd.DataFrame) -> np.ndarray:
+        """Stores the categories of the season_columns and returns the code of the season cell of every row."""
+        self.categories_ = [
+            np.unique(X[column].to_numpy(dtype=np.float64))
+            for column in self.season_columns
+        ]
+        self.n_cells_ = int(np.prod([len(c) for c in self.categories_]))
+        return self._cells(X)
+
+    def _cells(self, X: pd.DataFrame) -> np.ndarray:
+        """Returns the code of the season cell of every row, -1 for values not seen in fit()."""
+        cells = np.zeros(len(X), dtype=np.int64)
+        for column, categories in zip(self.season_columns, self.categories_):
+            codes = _encode(X[column].to_numpy(dtype=np.float64), categories)
+            cells = np.where(
+                (cells < 0) | (codes < 0), -1, cells * len(categories) + codes
+            )
+        return cells
+
+
+class SeasonalNaive(FastEstimator):
+    def __init__(self, season_columns: Sequence[str] = ("day_of_week", "hour")):
+        """Predicts the last observed value of the same season cell, e.g. the same hour of the same weekday last week.
+        Cells without training rows get the last observed value.
+
+        Args:
+            season_columns (Sequence[str], optional): The columns defining the season cells. Defaults to ("day_of_week", "hour").
+        """
+        self.season_columns = season_columns
+
+    def fit(self, X: pd.DataFrame, y) -> "SeasonalNaive":
+        cells = self._fit_cells(X)
+        y = np.asarray(y, dtype=np.float64)
+        # The last row of every cell is its first row in reversed order
+        unique_cells, first_reversed = np.unique(cells[::-1], return_index=True)
+        self.values_ = np.full(self.n_cells_, y[-1] if len(y) else np.nan)
+        self.values_[unique_cells] = y[len(y) - 1 - first_reversed]
+        self.fallback_ = y[-1] if len(y) else np.nan
+        return self
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        cells = self._cells(X)
+        return np.where(cells >= 0, self.values_[np.maximum(cells, 0)], self.fallback_)
+
+
+class WeightedProfile(FastEstimator):
+    def __init__(
+        self,
+        season_columns: Sequence[str] = ("day_of_week", "hour"),
+        level_column: Optional[str] = "avg_daily_price_lag1",
+        time_column: Optional[str] = "trend",
+        halflife_days: float = 7.0,
+    ):
+        """Predicts the level plus the exponentially weighted mean deviation from the level of the season cell.
+
+        Args:
+            season_columns (Sequence[str], optional): The columns defining the season cells. Defaults to ("day_of_week", "hour").
+            level_column (Optional[str], optional): The column with the level of every row, e.g. the average price of the day before. Defaults to "avg_daily_price_lag1".
+                If None or not in X, the profile of the values themselves is predicted.
+            time_column (Optional[str], optional): The column with the day of every row, whose weight halves every halflife_days days. Defaults to "trend".
+                If None or not in X, all rows have the same weight.
+            halflife_days (float, optional): The number of days after which the weight of a row halves. Defaults to 7.0.
+        """
+        self.season_columns = season_columns
+        self.level_column = level_column
+        self.time_column = time_column
+        self.halflife_days = halflife_days
+
+    def fit(self, X: pd.DataFrame, y) -> "WeightedProfile":
+        cells = self._fit_cells(X)
+        deviation = np.asarray(y, dtype=np.float64) - self._level(X)
+        if self.time_column is not None and self.time_column in X:
+            time = X[self.time_column].to_numpy(dtype=np.float64)
+            weights = 0.5 ** ((time.max() - time) / self.halflife_days)
+        else:
+            weights = np.ones(len(X))
+        weights = np.where(np.isnan(deviation), 0.0, weights)
+        deviation = np.nan_to_num(deviation)
+
+        weight_sums = np.bincount(cells, weights=weights, minlength=self.n_cells_)
+        self.fallback_ = (weights * deviation).sum() / max(weights.sum(), 1e-12)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.profile_ = np.where(
+                weight_sums > 0,
+                np.bincount(cells, weights=weights * deviation, minlength=self.n_cells_)
+                / weight_sums,
+                self.fallback_,
+            )
+        return self
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        cells = self._cells(X)
+        profile = np.where(
+            cells >= 0, self.profile_[np.maximum(cells, 0)], self.fallback_
+        )
+        return self._level(X) + profile
+
+    def _level(self, X: pd.DataFrame) -> np.ndarray:
+        if self.level_column is not None and self.level_column in X:
+            return X[self.level_column].to_numpy(dtype=np.float64)
+        return np.zeros(len(X))
+
+
+class Ridge(FastEstimator):
+    def __init__(
+        self,
+        alpha: float = 1.0,
+        one_hot_columns: Sequence[str] = ("day_of_week", "hour"),
+    ):
+        """A closed-form ridge regression on the standardized numeric columns (e.g. the lags and the trend) and the one-hot encoded one_hot_columns.
+        Missing values are replaced by the mean of their column in fit().
+
+        Args:
+            alpha (float, optional): The L2 penalty of the coefficients, the intercept is not penalized. Defaults to 1.0.
+            one_hot_columns (Sequence[str], optional): The categorical columns, which are one-hot encoded. Defaults to ("day_of_week", "hour").
+        """
+        self.alpha = alpha
+        self.one_hot_columns = one_hot_columns
+
+    def fit(self, X: pd.DataFrame, y) -> "Ridge":
+        self.numeric_columns_ = [c for c in X.columns if c not in self.one_hot_columns]
+        numeric = X[self.numeric_columns_].to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            self.means_ = np.nan_to_num(np.nanmean(numeric, axis=0))
+        numeric = np.where(np.isnan(numeric), self.means_, numeric)
+        self.scales_ = numeric.std(axis=0)
+        self.scales_[self.scales_ == 0] = 1.0
+        self.categories_ = [
+            np.unique(X[column].to_numpy(dtype=np.float64))
+            for column in self.one_hot_columns
+            if column in X
+        ]
+
+        design = self._design(X)
+        y = np.asarray(y, dtype=np.float64)
+        self.design_means_ = design.mean(axis=0)
+        self.intercept_ = y.mean()
+        centered = design - self.design_means_
+        self.coef_ = np.linalg.solve(
+            centered.T @ centered + self.alpha * np.eye(design.shape[1]),
+            centered.T @ (y - self.intercept_),
+        )
+        return self
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        return (self._design(X) - self.design_means_) @ self.coef_ + self.intercept_
+
+    def _design(self, X: pd.DataFrame) -> np.ndarray:
+        """Returns the standardized numeric columns followed by the one-hot columns, values not seen in fit() have no one-hot column."""
+        numeric = X[self.numeric_columns_].to_numpy(dtype=np.float64)
+        numeric = (np.where(np.isnan(numeric), self.means_, numeric) - self.means_) / (
+            self.scales_
+        )
+        one_hots = []
+        columns = [c for c in self.one_hot_columns if c in X]
+        for column, categories in zip(columns, self.categories_):
+            codes = _encode(X[column].to_numpy(dtype=np.float64), categories)
+            one_hot = np.zeros((len(X), len(categories)))
+            rows = np.flatnonzero(codes >= 0)
+            one_hot[rows, codes[rows]] = 1.0
+            one_hots.append(one_hot)
+        return np.hstack([numeric, *one_hots])
+
+
+def _encode(values: np.ndarray, categories: np.ndarray) -> np.ndarray:
+    """Returns the index of every value in the sorted categories, -1 for values not in categories."""
+    if len(categories) == 0:
+        return np.full(len(values), -1)
+    codes = np.minimum(np.searchsorted(categories, values), len(categories) - 1)
+    return np.where(categories[codes] == values, codes, -1)
@@ -0,0 +1,79 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.instrumentation import stage
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.sklearn import create_estimator
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+# The columns identifying a series in a long df
+SERIES_COLUMNS = ["station", "sorte"]
+
+
+@instrumented("forecast_global")
+def forecast_global(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    series_columns: List[str] = SERIES_COLUMNS,
+) -> pd.DataFrame:
+    """Forecasts all series of a long df with one global estimator, which is fitted once on the stacked is_last==0 rows of all series.
+    Besides the exogenous variables, the estimator gets the series columns as codes and the mean training price of every series (series_level).
+    The codes are passed as categorical features if the estimator supports them and they fit into its bins.
+
+    Args:
+        df (pd.DataFrame): The long df on which to forecast. This df must contain the is_last column and the series_columns.
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+        series_columns (List[str], optional): The columns identifying a series. Defaults to ["station", "sorte"].
+
+    Raises:
+        ValueError: If a column of series_columns is not in df.
+
+    Returns:
+        pd.DataFrame: A df where rows with is_last==1 contain the forecast values.
+    """
+    for column in series_columns:
+        if column not in df:
+            raise ValueError(f"The series column: {column} is not in the df.")
+
+    exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+    estimator = create_estimator(forecast_config)
+    is_train = df["is_last"].to_numpy() == 0
+    y = df[forecast_col_name].to_numpy(dtype=np.float64)
+
+    # Encode the series columns and the level of every series without Python loops
+    X = df[exogenous_vars].copy()
+    for column in series_columns:
+        X[column] = pd.factorize(df[column])[0]
+    series_codes = df.groupby(series_columns, sort=False).ngroup().to_numpy()
+    series_sums = np.bincount(
+        series_codes[is_train], weights=y[is_train], minlength=series_codes.max() + 1
+    )
+    series_counts = np.bincount(
+        series_codes[is_train], minlength=series_codes.max() + 1
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        X["series_level"] = (series_sums / series_counts)[series_codes]
+
+    if "categorical_features" in estimator.get_params():
+        max_bins = estimator.get_params().get("max_bins", 255)
+        estimator.set_params(
+            categorical_features=[
+                column in series_columns and X[column].max() < max_bins
+                for column in X.columns
+            ]
+        )
+
+    with stage("estimator_fit") as current_stage:
+        X_train = X[is_train]
+        current_stage.set_result(X_train)
+        estimator.fit(X=X_train, y=y[is_train])
+    with stage("estimator_predict") as current_stage:
+        X_pred = X[~is_train]
+        current_stage.set_result(X_pred)
+        df.loc[~is_train, "pred"] = estimator.predict(X=X_pred)
+
+    return df
@@ -1,30 +1,104 @@
+from typing import List
+from typing import Optional
+from typing import Sequence
+
 import pandas as pd
+from tpa_analytics_engine.models.global_model import forecast_global
+from tpa_analytics_engine.models.global_model import SERIES_COLUMNS
+from tpa_analytics_engine.models.model_cache import ModelCache
+from tpa_analytics_engine.models.models_config import estimator_dict
 from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.parallel import forecast_sklearn_many
 from tpa_analytics_engine.models.sklearn import forecast_sklearn
 
 
 def run(
-    df: pd.DataFrame, forecast_config: Forecast_Config, forecast_col_name: str = "price"
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    model_cache: Optional[ModelCache] = None,
+    series_id: str = "",
 ) -> pd.DataFrame:
     """A wrapper function to run the forecast on a passed data frame, according to a specified forecast configuration.
 
     Args:
-        df (pd.DataFrame): The data frame on which to run the forecast
+        df (pd.DataFrame): The data frame on which to run the forecast. In the "global" mode, a long df of several series with the columns station and sorte.
         config_dict (Forecast_Config): A dictionary containing the config with a key 'forecast_config'.
         forecast_col_name (str, optional): The column name of the column that should be forecasted. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators. Defaults to None.
+        series_id (str, optional): The id of the series in df used as part of the model_cache key and as name of the exported model. Defaults to "", i.e. the estimator is not exported.
 
     Raises:
+        ValueError: If the forecast config is in the "global" mode and df is not a long df with the columns station and sorte.
         NotImplementedError: If the forecast config specifies an estimator class which is not implemented.
 
     Returns:
         pd.DataFrame: A data frame with the forecasts.
     """
 
-    if forecast_config.use_estimator_class == "sklearn":
-        return forecast_sklearn(
+    if (
+        forecast_config.use_estimator_class in estimator_dict
+        and forecast_config.mode == "global"
+    ):
+        missing = [column for column in SERIES_COLUMNS if column not in df]
+        if missing:
+            raise ValueError(
+                f'The "global" mode forecasts a long df of several series, but the df lacks the series columns {missing}. '
+                'Pass a long df, e.g. of Forecast.load_dfs(), or use the "local" mode for a single series.'
+            )
+        return forecast_global(
             df=df, forecast_config=forecast_config, forecast_col_name=forecast_col_name
         )
 
+    # All registered estimators follow the fit/predict interface of the sklearn estimators
+    elif forecast_config.use_estimator_class in estimator_dict:
+        return forecast_sklearn(
+            df=df,
+            forecast_config=forecast_config,
+            forecast_col_name=forecast_col_name,
+            model_cache=model_cache,
+            series_id=series_id,
+        )
+
+    else:
+        raise NotImplementedError(
+            f"{forecast_config.use_estimator_class} is not supported."
+        )
+
+
+def run_many(
+    dfs: List[pd.DataFrame],
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    model_cache: Optional[ModelCache] = None,
+    series_ids: Optional[Sequence[str]] = None,
+) -> List[pd.DataFrame]:
+    """A wrapper function to run the forecast on several data frames, using the executor specified in the forecast configuration.
+
+    Args:
+        dfs (List[pd.DataFrame]): The data frames on which to run the forecast.
+        forecast_config (Forecast_Config): The forecast configuration.
+        forecast_col_name (str, optional): The column name of the column that should be forecasted. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators. Defaults to None.
+        series_ids (Optional[Sequence[str]], optional): The ids of the series in dfs used as part of the model_cache key. Defaults to None, i.e. empty ids.
+
+    Raises:
+        ValueError: If the forecast config is in the "global" mode, use run() on the concatenated dfs instead.
+        NotImplementedError: If the forecast config specifies an estimator class which is not implemented.
+
+    Returns:
+        List[pd.DataFrame]: The data frames with the forecasts, in the order of dfs.
+    """
+
+    if forecast_config.use_estimator_class in estimator_dict:
+        return forecast_sklearn_many(
+            dfs=dfs,
+            forecast_config=forecast_config,
+            forecast_col_name=forecast_col_name,
+            model_cache=model_cache,
+            series_ids=series_ids,
+        )
+
     else:
         raise NotImplementedError(
             f"{forecast_config.use_estimator_class} is not supported."
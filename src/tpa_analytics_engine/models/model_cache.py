@@ -0,0 +1,241 @@
+import copy
+import datetime
+import functools
+import hashlib
+import importlib.metadata
+import os
+import pickle
+import platform
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.models_config import Model_Cache_Config
+from tpa_analytics_engine.models.sklearn import create_estimator
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+
+class ModelCache:
+    def __init__(self, model_cache_config: Model_Cache_Config) -> None:
+        """An LRU cache of fitted estimators keyed by the series id, a fingerprint of the training data, the estimator configuration and the library versions.
+        The fitted estimators are kept in memory and, if a directory is configured, pickled to disk, where the least recently used ones are deleted beyond max_bytes.
+        Since the versions are part of the key, pickles of other Python, NumPy, scikit-learn or package versions are never loaded and eventually deleted.
+        The cache can be shared by threads: its bookkeeping is guarded by a lock, while the estimators are fitted outside of it.
+
+        Args:
+            model_cache_config (Model_Cache_Config): The configuration of the model cache.
+        """
+        self.model_cache_config = model_cache_config
+        self.models: "OrderedDict[str, Any]" = OrderedDict()
+        # The key and the first training date of the latest model of every series and estimator configuration
+        self.latest: Dict[Tuple[str, str], Tuple[str, Any]] = {}
+        # The selected candidate and the date of the selection of every series, see forecast_selected()
+        self.selections: Dict[str, Tuple[str, datetime.date]] = {}
+        self.directory = (
+            None
+            if model_cache_config.directory is None
+            else Path(model_cache_config.directory)
+        )
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+
+    def fit(
+        self,
+        series_id: str,
+        X: Union[pd.DataFrame, np.ndarray],
+        y: Union[pd.Series, np.ndarray],
+        forecast_config: Forecast_Config,
+        window_start: Any = None,
+    ) -> Any:
+        """Returns a fitted estimator for the training data, fitting it only if no estimator for the same series, data and configuration is cached.
+        If warm_start_iter is configured and the training window of the series only slid forward, the latest estimator is refitted with warm_start.
+
+        Args:
+            series_id (str): The id of the series, e.g. "{sorte}_{station}".
+            X (Union[pd.DataFrame, np.ndarray]): The exogenous variables of the training rows.
+            y (Union[pd.Series, np.ndarray]): The target of the training rows.
+            forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+            window_start (Any, optional): The first date of the training rows, used to detect a window which slid forward. Defaults to None.
+
+        Returns:
+            Any: The fitted estimator.
+        """
+        config_fingerprint = fingerprint_config(forecast_config)
+        key = hashlib.sha256(
+            f"{series_id}|{fingerprint_data(X, y)}|{config_fingerprint}|{library_versions()}".encode(
+                "utf-8"
+            )
+        ).hexdigest()
+
+        estimator = self.get(key)
+        if estimator is None:
+            estimator = self._warm_start(
+                series_id=series_id,
+                config_fingerprint=config_fingerprint,
+                window_start=window_start,
+            )
+            if estimator is None:
+                estimator = create_estimator(forecast_config)
+            estimator.fit(X=X, y=y)
+            self.put(key, estimator)
+
+        with self._lock:
+            self.latest[(series_id, config_fingerprint)] = (key, window_start)
+        return estimator
+
+    def get(self, key: str) -> Any:
+        """Returns the estimator cached under key from memory or disk, or None."""
+        with self._lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+        if self.directory is None:
+            return None
+        try:
+            # Mark the file as recently used, it may have been evicted by another thread or process
+            os.utime(self.directory / f"{key}.pkl")
+            with open(self.directory / f"{key}.pkl", "rb") as file:
+                estimator = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        self._add(key, estimator)
+        return estimator
+
+    def put(self, key: str, estimator: Any) -> None:
+        """Caches the estimator under key in memory and, if configured, on disk."""
+        self._add(key, estimator)
+        if self.directory is not None:
+            tmp_file = (
+                self.directory / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            with open(tmp_file, "wb") as file:
+                pickle.dump(estimator, file)
+            os.replace(tmp_file, self.directory / f"{key}.pkl")
+            self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently used persisted estimators until the directory is within max_bytes."""
+        if self.directory is None:
+            return
+        model_files = []
+        for file in self.directory.glob("*.pkl"):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                # Evicted by another thread or process
+                continue
+            model_files.append((stat.st_mtime_ns, stat.st_size, file))
+        total_bytes = sum(size for _, size, _ in model_files)
+        for _, size, file in sorted(model_files):
+            if total_bytes <= self.model_cache_config.max_bytes:
+                break
+            file.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def _add(self, key: str, estimator: Any) -> None:
+        """Adds the estimator to the memory and evicts the least recently used ones beyond max_models."""
+        with self._lock:
+            self.models[key] = estimator
+            self.models.move_to_end(key)
+            while len(self.models) > self.model_cache_config.max_models:
+                self.models.popitem(last=False)
+
+    def _warm_start(
+        self, series_id: str, config_fingerprint: str, window_start: Any
+    ) -> Any:
+        """Returns a copy of the latest estimator of the series prepared for a warm-start refit, or None if not possible."""
+        latest = self.latest.get((series_id, config_fingerprint))
+        if (
+            self.model_cache_config.warm_start_iter is None
+            or window_start is None
+            or latest is None
+        ):
+            return None
+
+        latest_key, latest_window_start = latest
+        latest_estimator = self.get(latest_key)
+        if (
+            latest_estimator is None
+            or latest_window_start is None
+            or window_start <= latest_window_start
+            or "warm_start" not in latest_estimator.get_params()
+            or not hasattr(latest_estimator, "n_iter_")
+        ):
+            return None
+
+        estimator = copy.deepcopy(latest_estimator)
+        estimator.set_params(
+            warm_start=True,
+            max_iter=estimator.n_iter_ + self.model_cache_config.warm_start_iter,
+        )
+        return estimator
+
+
+@functools.lru_cache(maxsize=None)
+def library_versions() -> str:
+    """Returns the versions of Python and of the libraries whose pickles of fitted estimators may not load in other versions, without importing them.
+
+    Returns:
+        str: The versions, e.g. "python=3.11.7|numpy=1.26.4|scikit-learn=1.4.2|tpa_analytics_engine=0.1.0".
+    """
+    versions = [f"python={platform.python_version()}"]
+    for package in ["numpy", "scikit-learn", "tpa_analytics_engine"]:
+        try:
+            versions.append(f"{package}={importlib.metadata.version(package)}")
+        except importlib.metadata.PackageNotFoundError:
+            versions.append(f"{package}=")
+    return "|".join(versions)
+
+
+def fingerprint_data(
+    X: Union[pd.DataFrame, np.ndarray], y: Union[pd.Series, np.ndarray]
+) -> str:
+    """Returns a sha256 fingerprint of the values and column names of the training data.
+    Arrays are fingerprinted by their dtype, shape and bytes, so an estimator fitted on arrays is never returned for the df of the same values and vice versa.
+
+    Args:
+        X (Union[pd.DataFrame, np.ndarray]): The exogenous variables of the training rows.
+        y (Union[pd.Series, np.ndarray]): The target of the training rows.
+
+    Returns:
+        str: The hex digest of the fingerprint.
+    """
+    if isinstance(X, np.ndarray):
+        fingerprint = hashlib.sha256(f"ndarray|{X.dtype}|{X.shape}".encode("utf-8"))
+        fingerprint.update(np.ascontiguousarray(X).tobytes())
+    else:
+        fingerprint = hashlib.sha256(",".join(map(str, X.columns)).encode("utf-8"))
+        fingerprint.update(
+            pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes()
+        )
+    if isinstance(y, np.ndarray):
+        fingerprint.update(f"{y.dtype}".encode("utf-8"))
+        fingerprint.update(np.ascontiguousarray(y).tobytes())
+    else:
+        fingerprint.update(
+            pd.util.hash_pandas_object(y, index=False).to_numpy().tobytes()
+        )
+    return fingerprint.hexdigest()
+
+
+def fingerprint_config(forecast_config: Forecast_Config) -> str:
+    """Returns a sha256 fingerprint of the configuration of the used estimator.
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+
+    Returns:
+        str: The hex digest of the fingerprint.
+    """
+    estimator_json = get_estimator_config(forecast_config).model_dump_json()
+    return hashlib.sha256(
+        f"{forecast_config.use_estimator_class}|{estimator_json}".encode("utf-8")
+    ).hexdigest()
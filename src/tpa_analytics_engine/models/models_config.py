@@ -1,16 +1,103 @@
+import importlib.metadata
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Literal
+from typing import Optional
 
 from pydantic import BaseModel
 from pydantic import field_validator
-from sklearn.ensemble import HistGradientBoostingRegressor
+from pydantic import model_validator
 
 
-# Create the estimator_dict mapping all allowed models
+# The entry point group under which installed packages register estimators as "{estimator_class}.{estimator_type}" = "module:Class"
+ESTIMATOR_ENTRY_POINT_GROUP = "tpa_analytics_engine.estimators"
+
+# Create the estimator_dict mapping all allowed models to their classes or, imported only on first use, their import paths
 estimator_dict: Dict[str, Dict[str, Any]] = {
-    "sklearn": {"HistGradientBoostingRegressor": HistGradientBoostingRegressor}
+    "sklearn": {
+        "HistGradientBoostingRegressor": "sklearn.ensemble.HistGradientBoostingRegressor"
+    },
+    "numpy": {
+        "SeasonalNaive": "tpa_analytics_engine.models.fast_estimators.SeasonalNaive",
+        "WeightedProfile": "tpa_analytics_engine.models.fast_estimators.WeightedProfile",
+        "Ridge": "tpa_analytics_engine.models.fast_estimators.Ridge",
+    },
 }
+_entry_points_loaded = False
+
+
+def register_estimator(
+    estimator_class: str, estimator_type: str, estimator: Any
+) -> None:
+    """Registers an estimator in the estimator_dict. Estimators follow the fit(X, y)/predict(X) interface of the sklearn estimators.
+
+    Args:
+        estimator_class (str): The estimator class (e.g. "numpy"), which is created if it does not exist.
+        estimator_type (str): The estimator type (e.g. "SeasonalNaive").
+        estimator (Any): The estimator class or its import path "module.Class", which is imported on first use.
+    """
+    estimator_dict.setdefault(estimator_class, {})[estimator_type] = estimator
+
+
+def load_entry_points() -> None:
+    """Registers the estimators of the entry points in ESTIMATOR_ENTRY_POINT_GROUP of all installed packages, once per process.
+    The entry point name is "{estimator_class}.{estimator_type}", the entry point is only loaded on first use, e.g. in a pyproject.toml:
+        [project.entry-points."tpa_analytics_engine.estimators"]
+        "numpy.MyModel" = "my_package.models:MyModel"
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        entry_points = importlib.metadata.entry_points(
+            group=ESTIMATOR_ENTRY_POINT_GROUP
+        )
+    except TypeError:
+        # Python 3.9 returns a dict of all groups
+        entry_points = importlib.metadata.entry_points().get(  # type: ignore
+            ESTIMATOR_ENTRY_POINT_GROUP, []
+        )
+    for entry_point in entry_points:
+        estimator_class, _, estimator_type = entry_point.name.partition(".")
+        if estimator_type:
+            estimator_dict.setdefault(estimator_class, {}).setdefault(
+                estimator_type, entry_point
+            )
+
+
+def get_estimator_class(estimator_class: str, estimator_type: str) -> Any:
+    """Returns the class registered in the estimator_dict, importing it if it is registered by its import path or entry point.
+
+    Args:
+        estimator_class (str): The estimator class (e.g. "sklearn") in the estimator_dict.
+        estimator_type (str): The estimator type (e.g. "HistGradientBoostingRegressor") in the estimator_dict.
+
+    Raises:
+        ValueError: If the estimator is not registered in the estimator_dict.
+
+    Returns:
+        Any: The estimator class.
+    """
+    registered = estimator_dict.get(estimator_class, {}).get(estimator_type)
+    if registered is None:
+        load_entry_points()
+        registered = estimator_dict.get(estimator_class, {}).get(estimator_type)
+    if registered is None:
+        raise ValueError(
+            f"The estimator {estimator_type} of {estimator_class} is not registered."
+        )
+    if isinstance(registered, (str, importlib.metadata.EntryPoint)):
+        if isinstance(registered, str):
+            module_name, class_name = registered.rsplit(".", 1)
+            registered = getattr(importlib.import_module(module_name), class_name)
+        else:
+            registered = registered.load()
+        # Replace the import path by the imported class
+        estimator_dict[estimator_class][estimator_type] = registered
+    return registered
+
 
 # Pydantic Base Class for ForecEstimatorast
 class Estimator_Config(BaseModel):
@@ -23,6 +110,130 @@ class Estimator_Config(BaseModel):
     exogenous_vars: List[str]
 
 
+# Pydantic Base Class for the Executor
+class Executor_Config(BaseModel):
+    """A pydantic class to specify how several series are forecasted.
+    The configuration specifies:
+        - backend: "serial" fits one series after the other, "thread" and "process" fan the fits out over a concurrent.futures pool.
+        - n_jobs: The number of workers of the pool.
+        - chunk_size: The number of series submitted to a worker at once.
+    """
+
+    backend: Literal["serial", "thread", "process"] = "serial"
+    n_jobs: int = 1
+    chunk_size: int = 1
+
+    @field_validator("n_jobs", "chunk_size")
+    def validate_positive(cls, value):
+        if value < 1:
+            raise ValueError("n_jobs and chunk_size must be at least 1.")
+        return value
+
+
+# Pydantic Base Class for the Model Cache
+class Model_Cache_Config(BaseModel):
+    """A pydantic class to specify the cache of fitted estimators.
+    The configuration specifies:
+        - max_models: The number of fitted estimators kept in memory, the least recently used ones are evicted beyond it.
+        - directory: An optional directory where the fitted estimators are persisted.
+        - max_bytes: The maximum size of the persisted estimators in directory, the least recently used ones are deleted beyond it.
+        - warm_start_iter: If set, estimators supporting warm_start are refitted with this number of additional iterations when the training window of a series slid forward.
+    """
+
+    max_models: int = 128
+    directory: Optional[str] = None
+    max_bytes: int = 2**30
+    warm_start_iter: Optional[int] = None
+
+
+# Pydantic Base Class for the Model Export
+class Export_Config(BaseModel):
+    """A pydantic class to specify the export of the fitted estimators for serving without sklearn (see models.export).
+    The configuration specifies:
+        - directory: The directory where every fitted HistGradientBoostingRegressor is exported as "{series_id}.npz" after its fit, other estimators are not exported.
+    """
+
+    directory: str
+
+
+# Pydantic Base Class for the Estimator Selection
+class Selection_Config(BaseModel):
+    """A pydantic class to specify the automatic selection of the estimator of every series.
+    The configuration specifies:
+        - candidates: The estimators to choose from as "{estimator_class}.{estimator}" keys of the estimators, e.g. ["numpy.profile", "sklearn.estimator1"].
+        - validation_days: The number of last training days on which the candidates fitted on the days before are validated.
+        - tolerance: The relative margin of the validation MAE within which the candidate with the shortest fit is preferred over the most accurate one.
+        - max_age_days: The number of days a selection is reused for a series with a model cache before the candidates are validated again.
+    """
+
+    candidates: List[str]
+    validation_days: int = 2
+    tolerance: float = 0.05
+    max_age_days: int = 7
+
+    @field_validator("validation_days", "max_age_days")
+    def validate_positive(cls, value):
+        if value < 1:
+            raise ValueError("validation_days and max_age_days must be at least 1.")
+        return value
+
+
+# Pydantic Base Class for the Hyperparameter Search
+class Tuning_Config(BaseModel):
+    """A pydantic class to specify a hyperparameter search over the estimators of the forecast configuration (see models.tuning.tune).
+    The configuration specifies:
+        - candidates: The estimators "{estimator_class}.{estimator}" whose configurations are the base of the search. Defaults to None, i.e. all estimators.
+        - estimator_kwargs: The values to try per keyword argument of a candidate, e.g. {"sklearn.estimator1": {"max_iter": [50, 100], "learning_rate": [0.05, 0.1]}}.
+        - exogenous_vars: Alternative lists of exogenous variables tried with every candidate, empty to keep those of the candidate.
+        - n_before: The numbers of days to include for estimating the forecast model, empty to keep the n_before of the forecast configuration.
+        - n_samples: If set, a random sample of n_samples configurations of the grid is searched instead of the whole grid.
+        - n_stations: The number of series sampled to evaluate the configurations on.
+        - n_cutoffs, horizon_days, step_days: The rolling-origin backtest of every configuration (see models.backtest.backtest).
+        - halving_factor: After each rung of the successive halving, the best 1/halving_factor of the configurations are evaluated on halving_factor times more cutoffs.
+        - random_state: The seed of the sampled configurations and series.
+    """
+
+    candidates: Optional[List[str]] = None
+    estimator_kwargs: Dict[str, Dict[str, List[Any]]] = {}
+    exogenous_vars: List[List[str]] = []
+    n_before: List[int] = []
+    n_samples: Optional[int] = None
+    n_stations: int = 20
+    n_cutoffs: int = 27
+    horizon_days: int = 1
+    step_days: int = 1
+    halving_factor: int = 3
+    random_state: int = 0
+
+    @field_validator("n_stations", "n_cutoffs", "horizon_days", "step_days")
+    def validate_positive(cls, value):
+        if value < 1:
+            raise ValueError(
+                "n_stations, n_cutoffs, horizon_days and step_days must be at least 1."
+            )
+        return value
+
+    @field_validator("halving_factor")
+    def validate_halving_factor(cls, value):
+        if value < 2:
+            raise ValueError("halving_factor must be at least 2.")
+        return value
+
+    @model_validator(mode="after")
+    def validate_values(self):
+        if self.n_samples is not None and self.n_samples < 1:
+            raise ValueError("n_samples must be at least 1.")
+        if any(value < 1 for value in self.n_before):
+            raise ValueError("The values of n_before must be at least 1.")
+        for candidate, kwargs in self.estimator_kwargs.items():
+            for name, values in kwargs.items():
+                if not values:
+                    raise ValueError(
+                        f"The values of {name} of {candidate} must not be empty."
+                    )
+        return self
+
+
 # Pydantic Base Class for Forecast
 class Forecast_Config(BaseModel):
     """A pydantic class to specify the forecast configuration.
@@ -31,6 +242,13 @@ class Forecast_Config(BaseModel):
         - use_estimator_class: The estimator class to use --> the key of estimator_dict.
         - use_estimator: The estimator name to use --> must be a key in the sub-dictionary of use_estimator_class in estimator_dict.
         - estimators: A dictionary with the specified estimators and their configurations (Estimator_Configs).
+        - executor: The configuration of the executor used when forecasting several series (Executor_Config).
+        - model_cache: An optional configuration of the cache of fitted estimators (Model_Cache_Config).
+        - mode: "local" fits one estimator per series, "global" fits one estimator on all series of a long df (see forecast_global).
+        - horizon_mode: How the prediction days (Data_Config.horizon_days) are forecasted in the "local" mode. "single" uses the features of add_columns(),
+          "pooled" fits one estimator with the horizon as feature and "direct" one estimator per horizon, both on lags shifted by the horizon (see forecast_multi_horizon).
+        - selection: An optional configuration of the automatic selection of the estimator of every series in the "local" mode (Selection_Config), which replaces use_estimator_class and use_estimator.
+        - export: An optional configuration of the export of the fitted estimators of forecast_sklearn() (Export_Config).
 
     """
 
@@ -38,15 +256,43 @@ class Forecast_Config(BaseModel):
     use_estimator_class: str
     use_estimator: str
     estimators: Dict[str, Dict[str, Estimator_Config]]
+    executor: Executor_Config = Executor_Config()
+    model_cache: Optional[Model_Cache_Config] = None
+    mode: Literal["local", "global"] = "local"
+    horizon_mode: Literal["single", "pooled", "direct"] = "single"
+    selection: Optional[Selection_Config] = None
+    export: Optional[Export_Config] = None
 
     @field_validator("use_estimator_class")
     def validate_use_estimator_class(cls, value):
+        if value not in estimator_dict:
+            load_entry_points()
         if value not in estimator_dict:
             raise ValueError(
                 f"Invalid estimator_class in use_estimator_class. Allowed values are {estimator_dict.keys()}"
             )
         return value
 
+    @model_validator(mode="after")
+    def validate_horizon_mode(self):
+        if self.mode == "global" and self.horizon_mode != "single":
+            raise ValueError(
+                'The "global" mode only supports the horizon_mode "single".'
+            )
+        return self
+
+    @model_validator(mode="after")
+    def validate_selection(self):
+        if self.selection is None:
+            return self
+        if self.mode == "global":
+            raise ValueError('The "global" mode does not support a selection.')
+        for candidate in self.selection.candidates:
+            estimator_class, _, estimator = candidate.partition(".")
+            if estimator not in self.estimators.get(estimator_class, {}):
+                raise ValueError(f"The candidate {candidate} is not in the estimators.")
+        return self
+
 
 def create_forecast_config(config_dict: dict) -> Forecast_Config:
     """A function taking in the config dict and extracting the Forecast_Config.
@@ -58,3 +304,33 @@ def create_forecast_config(config_dict: dict) -> Forecast_Config:
         Forecast_Config: A forecast configuration.
     """
     return Forecast_Config(**config_dict.get("forecast_config", {}))
+
+
+def check_local_mode(forecast_config: Forecast_Config, name: str) -> None:
+    """Checks that a forecast configuration is in the "local" mode before it is used by name, which forecasts every series separately.
+    The "global" mode is only supported by run() on a long df and Forecast.create_forecasts().
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration.
+        name (str): The name of the function or class using forecast_config, used in the error message.
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode.
+    """
+    if forecast_config.mode == "global":
+        raise ValueError(
+            f'{name} forecasts every series separately and does not support the "global" mode, '
+            "use Forecast.create_forecasts() or run() on a long df of several series."
+        )
+
+
+def create_tuning_config(config_dict: dict) -> Tuning_Config:
+    """A function taking in the config dict and extracting the Tuning_Config.
+
+    Args:
+        config_dict (dict): A dictionary containing the config with an optional key 'tuning_config'.
+
+    Returns:
+        Tuning_Config: A tuning configuration, the default one if the config has none.
+    """
+    return Tuning_Config(**(config_dict.get("tuning_config") or {}))
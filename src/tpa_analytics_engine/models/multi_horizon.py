@@ -0,0 +1,174 @@
+import re
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.data_handler.prepare_forecast_format import _daily_lag
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.instrumentation import stage
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.sklearn import create_estimator
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+if TYPE_CHECKING:
+    from tpa_analytics_engine.models.model_cache import ModelCache
+
+# The daily lag features of add_columns(), which are shifted by the horizon
+LAG_PATTERN = re.compile(r"^avg_daily_price_lag(\d+)$")
+
+
+def build_horizon_features(
+    df: pd.DataFrame, exogenous_vars: List[str], forecast_col_name: str = "price"
+) -> Tuple[List[pd.DataFrame], pd.Series, pd.DataFrame, np.ndarray]:
+    """Builds the features of a direct multi-horizon forecast from a df of add_columns().
+    The prediction rows of horizon h are h days after the last training day, so their daily lags must be known h days earlier.
+    Every horizon gets a copy of the training rows whose lag features are shifted by h further days, the other features are those of the target row.
+    The copy of horizon 0 has the lags of df, also for the first days of a df filtered by filter_n_days_before().
+
+    Args:
+        df (pd.DataFrame): The df on which to forecast, with the columns Day and is_last.
+        exogenous_vars (List[str]): The exogenous variables of the estimator, lags named avg_daily_price_lag{k} are shifted.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+
+    Returns:
+        Tuple[List[pd.DataFrame], pd.Series, pd.DataFrame, np.ndarray]: The training features of every horizon, the training target,
+            the features of the prediction rows and their horizons (0 is the first day after the last training day).
+    """
+    is_train = df["is_last"].to_numpy() == 0
+    day_number = df["Day"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    unique_days, day_codes = np.unique(day_number[is_train], return_inverse=True)
+    avg_daily_price = (
+        df.loc[is_train, forecast_col_name]
+        .groupby(day_codes)
+        .mean()
+        .to_numpy(dtype=np.float64)
+    )
+    lags = {
+        column: int(match.group(1))
+        for column in exogenous_vars
+        if (match := LAG_PATTERN.match(column))
+    }
+
+    # Prepend the daily averages before the first day, which the lags of the first training row still know
+    max_lag = max(lags.values(), default=0)
+    first_row = np.flatnonzero(is_train)[:1]
+    days_before = [
+        df[f"avg_daily_price_lag{lag}"].to_numpy(dtype=np.float64)[first_row]
+        if f"avg_daily_price_lag{lag}" in df
+        else np.full(len(first_row), np.nan)
+        for lag in range(max_lag, 0, -1)
+    ]
+    avg_daily_price = np.concatenate([*days_before, avg_daily_price])
+    day_codes = day_codes + max_lag * (len(first_row) > 0)
+
+    # The horizon of a prediction row counts the calendar days after the last training day
+    horizons = day_number[~is_train] - (unique_days[-1] + 1)
+    n_horizons = int(horizons.max()) + 1 if len(horizons) else 1
+
+    X_train = df.loc[is_train, exogenous_vars]
+    X_train_by_horizon = []
+    for horizon in range(n_horizons):
+        X_horizon = X_train.copy()
+        for column, lag in lags.items():
+            X_horizon[column] = _daily_lag(
+                avg_daily_price=avg_daily_price, day_codes=day_codes, lag=lag + horizon
+            )
+        X_train_by_horizon.append(X_horizon)
+
+    # The lags of all prediction rows are the last daily averages before the horizon
+    X_pred = df.loc[~is_train, exogenous_vars].copy()
+    for column, lag in lags.items():
+        X_pred[column] = (
+            avg_daily_price[max(len(avg_daily_price) - lag, 0)]
+            if len(avg_daily_price) > 0
+            else np.nan
+        )
+    return X_train_by_horizon, df.loc[is_train, forecast_col_name], X_pred, horizons
+
+
+@instrumented("forecast_multi_horizon")
+def forecast_multi_horizon(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    model_cache: Optional["ModelCache"] = None,
+    series_id: str = "",
+) -> pd.DataFrame:
+    """Forecasts all prediction days of df at once with the horizon_mode of forecast_config, see build_horizon_features().
+        - "pooled" fits one estimator on the training copies of all horizons stacked, with the horizon as additional feature.
+        - "direct" fits one estimator per horizon on its training copy.
+
+    Args:
+        df (pd.DataFrame): The df on which to forecast, e.g. of add_columns() with horizon_days days. This df must contain the columns Day and is_last.
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators, which skips the fits if the training data did not change. Defaults to None.
+        series_id (str, optional): The id of the series in df used as part of the model_cache key. Defaults to "".
+
+    Returns:
+        pd.DataFrame: A df where rows with is_last==1 contain the forecast values of all horizons.
+    """
+    current_estimator = get_estimator_config(forecast_config)
+    X_train_by_horizon, y_train, X_pred, horizons = build_horizon_features(
+        df=df,
+        exogenous_vars=current_estimator.exogenous_vars,
+        forecast_col_name=forecast_col_name,
+    )
+    is_train = df["is_last"].to_numpy() == 0
+    window_start = df["Day_Hours"][is_train].min() if "Day_Hours" in df else None
+
+    if forecast_config.horizon_mode == "pooled":
+        X_train = pd.concat(
+            [
+                X_horizon.assign(horizon=horizon)
+                for horizon, X_horizon in enumerate(X_train_by_horizon)
+            ],
+            ignore_index=True,
+        )
+        tasks = [
+            (
+                f"{series_id}|pooled",
+                X_train,
+                pd.concat([y_train] * len(X_train_by_horizon), ignore_index=True),
+                X_pred.assign(horizon=horizons),
+                np.ones(len(X_pred), dtype=bool),
+            )
+        ]
+    else:
+        tasks = [
+            (
+                f"{series_id}|h{horizon}",
+                X_horizon,
+                y_train,
+                X_pred[horizons == horizon],
+                horizons == horizon,
+            )
+            for horizon, X_horizon in enumerate(X_train_by_horizon)
+        ]
+
+    pred = np.full(len(X_pred), np.nan)
+    for task_id, X_train, y, X_task, in_task in tasks:
+        with stage("estimator_fit") as current_stage:
+            current_stage.set_result(X_train)
+            if model_cache is not None:
+                estimator = model_cache.fit(
+                    series_id=task_id,
+                    X=X_train,
+                    y=y,
+                    forecast_config=forecast_config,
+                    window_start=window_start,
+                )
+            else:
+                estimator = create_estimator(forecast_config)
+                estimator.fit(X=X_train, y=y)
+        if len(X_task) == 0:
+            continue
+        with stage("estimator_predict") as current_stage:
+            current_stage.set_result(X_task)
+            pred[in_task] = estimator.predict(X=X_task)
+
+    df.loc[~is_train, "pred"] = pred
+    return df
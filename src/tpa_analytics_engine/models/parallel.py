@@ -0,0 +1,199 @@
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.models.export import export_fitted
+from tpa_analytics_engine.models.model_cache import ModelCache
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.sklearn import create_estimator
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+# A task is the (start, stop, n_train) row range of one series in the packed matrix
+Task = Tuple[int, int, int]
+
+
+@instrumented("forecast_sklearn_many")
+def forecast_sklearn_many(
+    dfs: List[pd.DataFrame],
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    model_cache: Optional[ModelCache] = None,
+    series_ids: Optional[Sequence[str]] = None,
+) -> List[pd.DataFrame]:
+    """Forecasts several dfs with forecast_sklearn(), fanning the fits out as configured in forecast_config.executor.
+    The feature matrices of all dfs are packed into one float64 matrix, which is handed to process workers via shared memory.
+    Every backend forecasts the same as forecast_sklearn(): the fitted estimators are exported as configured and, since the model cache lives in this process,
+    the dfs are forecasted one after the other if a model_cache is passed.
+
+    Args:
+        dfs (List[pd.DataFrame]): The dfs on which to forecast. Each df must contain the is_last column.
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator and executor.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators, see forecast_sklearn(). Defaults to None.
+        series_ids (Optional[Sequence[str]], optional): The ids of the series of dfs used as part of the model_cache key and as name of the exported models.
+            Defaults to None, i.e. an empty id for every df, whose estimators are not exported.
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode or series_ids has another length than dfs.
+
+    Returns:
+        List[pd.DataFrame]: The dfs in the order of dfs, where rows with is_last==1 contain the forecast values.
+    """
+    check_local_mode(forecast_config, "forecast_sklearn_many()")
+    if series_ids is None:
+        series_ids = [""] * len(dfs)
+    if len(series_ids) != len(dfs):
+        raise ValueError(
+            f"Got {len(series_ids)} series_ids for {len(dfs)} dfs, pass one per df."
+        )
+    executor_config = forecast_config.executor
+    # The multi-horizon features and the selection are built per df, so these dfs are forecasted one after the other
+    if (
+        executor_config.backend == "serial"
+        or executor_config.n_jobs == 1
+        or forecast_config.horizon_mode != "single"
+        or forecast_config.selection is not None
+        or model_cache is not None
+    ):
+        return [
+            forecast_sklearn(
+                df=df,
+                forecast_config=forecast_config,
+                forecast_col_name=forecast_col_name,
+                model_cache=model_cache,
+                series_id=series_id,
+            )
+            for df, series_id in zip(dfs, series_ids)
+        ]
+
+    # Pack the training rows followed by the prediction rows of every df into one matrix
+    exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+    tasks: List[Task] = []
+    blocks = []
+    start = 0
+    for df in dfs:
+        is_last = df["is_last"].to_numpy() == 1
+        order = np.concatenate([np.flatnonzero(~is_last), np.flatnonzero(is_last)])
+        block = np.empty((len(df), len(exogenous_vars) + 1), dtype=np.float64)
+        block[:, :-1] = df[exogenous_vars].to_numpy(dtype=np.float64)[order]
+        block[:, -1] = df[forecast_col_name].to_numpy(dtype=np.float64)[order]
+        blocks.append(block)
+        tasks.append((start, start + len(df), int((~is_last).sum())))
+        start += len(df)
+    chunks = [
+        (
+            tasks[i : i + executor_config.chunk_size],
+            list(series_ids[i : i + executor_config.chunk_size]),
+        )
+        for i in range(0, len(tasks), executor_config.chunk_size)
+    ]
+
+    if executor_config.backend == "thread":
+        matrix = np.concatenate(blocks)
+        with ThreadPoolExecutor(max_workers=executor_config.n_jobs) as executor:
+            results = _map_chunks(
+                executor,
+                _fit_predict_chunk,
+                [
+                    (matrix, chunk, chunk_series_ids, forecast_config)
+                    for chunk, chunk_series_ids in chunks
+                ],
+            )
+    else:
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(start * (len(exogenous_vars) + 1) * 8, 1)
+        )
+        try:
+            matrix = np.ndarray(
+                (start, len(exogenous_vars) + 1), dtype=np.float64, buffer=shm.buf
+            )
+            np.concatenate(blocks, out=matrix)
+            del blocks
+            with ProcessPoolExecutor(max_workers=executor_config.n_jobs) as executor:
+                results = _map_chunks(
+                    executor,
+                    _fit_predict_chunk_shared,
+                    [
+                        (
+                            shm.name,
+                            matrix.shape,
+                            chunk,
+                            chunk_series_ids,
+                            forecast_config,
+                        )
+                        for chunk, chunk_series_ids in chunks
+                    ],
+                )
+            del matrix
+        finally:
+            shm.close()
+            shm.unlink()
+
+    # Write the predictions back in the order of dfs
+    for df, pred in zip(dfs, results):
+        df.loc[df.is_last == 1, "pred"] = pred
+
+    return dfs
+
+
+def _map_chunks(executor: Executor, fn, args_list: list) -> List[np.ndarray]:
+    """Submits fn for every argument tuple and flattens the chunk results in submission order."""
+    futures = [executor.submit(fn, *args) for args in args_list]
+    return [pred for future in futures for pred in future.result()]
+
+
+def _fit_predict_chunk(
+    matrix: np.ndarray,
+    chunk: List[Task],
+    series_ids: List[str],
+    forecast_config: Forecast_Config,
+) -> List[np.ndarray]:
+    """Fits one estimator per task of chunk on the packed matrix, exports it as configured and returns the predictions of the prediction rows."""
+    exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+    preds = []
+    for (start, stop, n_train), series_id in zip(chunk, series_ids):
+        X = pd.DataFrame(matrix[start:stop, :-1], columns=exogenous_vars)
+        estimator = create_estimator(forecast_config)
+        estimator.fit(X=X.iloc[:n_train], y=matrix[start : start + n_train, -1])
+        if forecast_config.export is not None:
+            export_fitted(
+                estimator=estimator,
+                directory=forecast_config.export.directory,
+                series_id=series_id,
+                feature_names=exogenous_vars,
+            )
+        preds.append(estimator.predict(X=X.iloc[n_train:]))
+    return preds
+
+
+def _fit_predict_chunk_shared(
+    shm_name: str,
+    shape: Tuple[int, int],
+    chunk: List[Task],
+    series_ids: List[str],
+    forecast_config: Forecast_Config,
+) -> List[np.ndarray]:
+    """Attaches to the shared memory block shm_name and runs _fit_predict_chunk() on it inside a process worker."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        preds = _fit_predict_chunk(
+            matrix=matrix,
+            chunk=chunk,
+            series_ids=series_ids,
+            forecast_config=forecast_config,
+        )
+        del matrix
+    finally:
+        shm.close()
+    return preds
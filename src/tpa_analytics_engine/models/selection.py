@@ -0,0 +1,312 @@
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.models.export import export_fitted
+from tpa_analytics_engine.models.model_cache import fingerprint_data
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.sklearn import create_estimator
+from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+if TYPE_CHECKING:
+    from tpa_analytics_engine.models.model_cache import ModelCache
+
+# The number of selections kept by forecast_selected() with their fitted estimators, the least recently used are evicted beyond it
+MAX_CACHED_SELECTIONS = 128
+
+
+class Candidate_Score(BaseModel):
+    """The validation of one candidate estimator of a series: its mean absolute error on the validation days and the seconds of its fit."""
+
+    candidate: str
+    mae: float
+    fit_seconds: float
+
+
+# The selected candidate and its fitted estimator by the fingerprint of the series, its training rows and the selection, see forecast_selected()
+_selections: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def candidate_config(
+    forecast_config: Forecast_Config, candidate: str
+) -> Forecast_Config:
+    """Returns the forecast configuration using the candidate "{estimator_class}.{estimator}" instead of the selection."""
+    estimator_class, _, estimator = candidate.partition(".")
+    return forecast_config.model_copy(
+        update={
+            "use_estimator_class": estimator_class,
+            "use_estimator": estimator,
+            "selection": None,
+        }
+    )
+
+
+@instrumented("select_estimator")
+def select_estimator(
+    df: pd.DataFrame, forecast_config: Forecast_Config, forecast_col_name: str = "price"
+) -> Tuple[str, List[Candidate_Score]]:
+    """Selects the estimator of a series by fitting every candidate of the selection on the training days before the last validation_days days and validating it on these.
+    The candidate is chosen from the scores by choose_candidate().
+
+    Args:
+        df (pd.DataFrame): The df of one series on which to forecast. This df must contain the columns Day and is_last.
+        forecast_config (Forecast_Config): The forecast configuration with a selection.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+
+    Raises:
+        ValueError: If forecast_config has no selection.
+
+    Returns:
+        Tuple[str, List[Candidate_Score]]: The selected candidate and the scores of all candidates.
+    """
+    selection = forecast_config.selection
+    if selection is None:
+        raise ValueError("The forecast configuration has no selection.")
+
+    is_train = df["is_last"].to_numpy() == 0
+    train_df = df[is_train]
+    train_days = np.unique(train_df["Day"].to_numpy())
+    is_validation = (
+        train_df["Day"].to_numpy()
+        >= train_days[max(len(train_days) - selection.validation_days, 0)]
+    )
+    # Without days before the validation days, the candidates are validated on their training days
+    if is_validation.all():
+        is_validation[:] = False
+    fit_df, validation_df = train_df[~is_validation], train_df[is_validation]
+    if len(validation_df) == 0:
+        validation_df = fit_df
+
+    scores = []
+    for candidate in selection.candidates:
+        config = candidate_config(forecast_config, candidate)
+        exogenous_vars = get_estimator_config(config).exogenous_vars
+        start = time.perf_counter()
+        estimator = create_estimator(config)
+        estimator.fit(X=fit_df[exogenous_vars], y=fit_df[forecast_col_name])
+        fit_seconds = time.perf_counter() - start
+        error = np.abs(
+            estimator.predict(X=validation_df[exogenous_vars])
+            - validation_df[forecast_col_name].to_numpy()
+        )
+        error = error[~np.isnan(error)]
+        scores.append(
+            Candidate_Score(
+                candidate=candidate,
+                mae=float(error.mean()) if len(error) else np.inf,
+                fit_seconds=fit_seconds,
+            )
+        )
+
+    return choose_candidate(scores, tolerance=selection.tolerance), scores
+
+
+def choose_candidate(scores: Sequence[Candidate_Score], tolerance: float) -> str:
+    """Chooses the candidate among the candidates whose MAE is within tolerance of the best MAE, which has the shortest fit,
+    so a heavy estimator is only selected where it is clearly more accurate.
+    A candidate without a validation error, e.g. whose predictions or validation prices are all NaN, has an infinite MAE and is only chosen if no candidate has a finite one.
+    Ties are broken by the order of the scores, so if no candidate has a finite MAE, the first candidate is chosen.
+
+    Args:
+        scores (Sequence[Candidate_Score]): The scores of the candidates in the order of the selection.
+        tolerance (float): The relative margin of the MAE within which the shorter fit is preferred.
+
+    Returns:
+        str: The chosen candidate.
+    """
+    maes = [score.mae if np.isfinite(score.mae) else np.inf for score in scores]
+    best_mae = min(maes)
+    if not np.isfinite(best_mae):
+        return scores[0].candidate
+    acceptable = [
+        score
+        for score, mae in zip(scores, maes)
+        if mae <= best_mae * (1 + tolerance) or mae == best_mae
+    ]
+    # min() returns the first of several candidates with the same fit time
+    return min(acceptable, key=lambda score: score.fit_seconds).candidate
+
+
+def forecast_selected(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    model_cache: Optional["ModelCache"] = None,
+    series_id: str = "",
+) -> pd.DataFrame:
+    """Forecasts df with the estimator selected for the series by select_estimator().
+    After a new selection, the selected candidate is fitted on all training rows like forecast_sklearn(), so the forecast and the export include the validation days.
+    The selection and this estimator are kept in process by a fingerprint of the series and its training rows, so the same data is never validated or fitted twice.
+    With a model cache and a series_id, the selection of the series is additionally reused for max_age_days days, and the selected candidate is fitted on new data by forecast_sklearn().
+
+    Args:
+        df (pd.DataFrame): The df on which to forecast. This df must contain the columns Day and is_last.
+        forecast_config (Forecast_Config): The forecast configuration with a selection.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators and selections. Defaults to None.
+        series_id (str, optional): The id of the series in df used as key of the model_cache. Defaults to "".
+
+    Raises:
+        ValueError: If forecast_config has no selection.
+
+    Returns:
+        pd.DataFrame: A df where rows with is_last==1 contain the forecast values, df.attrs["estimator"] is the selected candidate.
+    """
+    selection = forecast_config.selection
+    if selection is None:
+        raise ValueError("The forecast configuration has no selection.")
+    today = datetime.date.today()
+    key = fingerprint_selection(
+        df=df,
+        forecast_config=forecast_config,
+        forecast_col_name=forecast_col_name,
+        series_id=series_id,
+    )
+    with _lock:
+        cached = _selections.get(key)
+        if cached is not None:
+            _selections.move_to_end(key)
+
+    if cached is not None:
+        candidate, estimator = cached
+    else:
+        candidate = None
+        if model_cache is not None and series_id:
+            candidate, selected_on = model_cache.selections.get(series_id, (None, None))
+            if (
+                candidate not in selection.candidates
+                or (today - selected_on).days >= selection.max_age_days
+            ):
+                candidate = None
+        if candidate is not None:
+            df = forecast_sklearn(
+                df=df,
+                forecast_config=candidate_config(forecast_config, candidate),
+                forecast_col_name=forecast_col_name,
+                model_cache=model_cache,
+                series_id=series_id,
+            )
+            df.attrs["estimator"] = candidate
+            return df
+
+        candidate, scores = select_estimator(
+            df=df, forecast_config=forecast_config, forecast_col_name=forecast_col_name
+        )
+        estimator = _fit_selected(
+            df=df,
+            forecast_config=candidate_config(forecast_config, candidate),
+            forecast_col_name=forecast_col_name,
+            model_cache=model_cache,
+            series_id=series_id,
+        )
+        with _lock:
+            _selections[key] = (candidate, estimator)
+            while len(_selections) > MAX_CACHED_SELECTIONS:
+                _selections.popitem(last=False)
+        if model_cache is not None and series_id:
+            model_cache.selections[series_id] = (candidate, today)
+
+    config = candidate_config(forecast_config, candidate)
+    exogenous_vars = get_estimator_config(config).exogenous_vars
+    if config.export is not None:
+        export_fitted(
+            estimator=estimator,
+            directory=config.export.directory,
+            series_id=series_id,
+            feature_names=exogenous_vars,
+        )
+    is_pred = df["is_last"].to_numpy() == 1
+    df.loc[is_pred, "pred"] = estimator.predict(X=df.loc[is_pred, exogenous_vars])
+    df.attrs["estimator"] = candidate
+    return df
+
+
+def _fit_selected(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str,
+    model_cache: Optional["ModelCache"],
+    series_id: str,
+) -> Any:
+    """Fits the estimator of the selected candidate on the is_last==0 rows of df like forecast_sklearn(), through the model cache if passed."""
+    exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+    is_train = df["is_last"].to_numpy() == 0
+    X_train = df.loc[is_train, exogenous_vars]
+    y_train = df.loc[is_train, forecast_col_name]
+    if model_cache is not None:
+        return model_cache.fit(
+            series_id=series_id,
+            X=X_train,
+            y=y_train,
+            forecast_config=forecast_config,
+            window_start=df["Day_Hours"][is_train].min() if "Day_Hours" in df else None,
+        )
+    estimator = create_estimator(forecast_config)
+    estimator.fit(y=y_train, X=X_train)
+    return estimator
+
+
+def fingerprint_selection(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str,
+    series_id: str,
+) -> str:
+    """Returns a sha256 fingerprint of the series, the training rows of df used by the candidates and the selection with the configurations of its candidates.
+
+    Args:
+        df (pd.DataFrame): The df on which to forecast. This df must contain the columns Day and is_last.
+        forecast_config (Forecast_Config): The forecast configuration with a selection.
+        forecast_col_name (str): The name of the column to forecast.
+        series_id (str): The id of the series in df.
+
+    Returns:
+        str: The hex digest of the fingerprint.
+    """
+    configs = [
+        candidate_config(forecast_config, candidate)
+        for candidate in forecast_config.selection.candidates  # type: ignore
+    ]
+    columns = list(
+        dict.fromkeys(
+            ["Day"]
+            + [
+                column
+                for config in configs
+                for column in get_estimator_config(config).exogenous_vars
+            ]
+        )
+    )
+    is_train = df["is_last"].to_numpy() == 0
+    data_fingerprint = fingerprint_data(
+        X=df.loc[is_train, columns], y=df.loc[is_train, forecast_col_name]
+    )
+    config_json = "|".join(
+        f"{config.use_estimator_class}.{get_estimator_config(config).model_dump_json()}"
+        for config in configs
+    )
+    return hashlib.sha256(
+        f"{series_id}|{data_fingerprint}|{forecast_config.selection.model_dump_json()}|{config_json}".encode(  # type: ignore
+            "utf-8"
+        )
+    ).hexdigest()
+
+
+def clear_selection_cache() -> None:
+    """Clears the selections kept by forecast_selected(), so every series is validated again on its next forecast."""
+    with _lock:
+        _selections.clear()
@@ -1,52 +1,243 @@
+from typing import Any
+from typing import Optional
+from typing import TYPE_CHECKING
+
+import numpy as np
 import pandas as pd
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.instrumentation import stage
+from tpa_analytics_engine.models.export import export_fitted
+from tpa_analytics_engine.models.models_config import check_local_mode
 from tpa_analytics_engine.models.models_config import Estimator_Config
-from tpa_analytics_engine.models.models_config import estimator_dict
 from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.models_config import get_estimator_class
+
+if TYPE_CHECKING:
+    from tpa_analytics_engine.models.model_cache import ModelCache
+
+# The estimator classes whose estimators are fitted on the arrays of predict_last() directly, the others get a df over the arrays with the exogenous variables as columns
+ARRAY_ESTIMATOR_CLASSES = {"sklearn"}
+
+
+def get_estimator_config(forecast_config: Forecast_Config) -> Estimator_Config:
+    """Returns the Estimator_Config selected by use_estimator_class and use_estimator.
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+
+    Returns:
+        Estimator_Config: The configuration of the estimator to use.
+    """
+    return forecast_config.estimators.get(forecast_config.use_estimator_class, {}).get(
+        forecast_config.use_estimator
+    )  # type: ignore
 
 
+def create_estimator(forecast_config: Forecast_Config) -> Any:
+    """Creates an unfitted estimator object as specified by the forecast configuration.
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+
+    Returns:
+        Any: The estimator object created with the configured estimator_kwargs.
+    """
+    current_estimator = get_estimator_config(forecast_config)
+    # Get the current_estimator_class from the estimator_dict, importing it on first use
+    current_estimator_class = get_estimator_class(
+        forecast_config.use_estimator_class, current_estimator.estimator_type
+    )
+    # Create the estimator object from the current_estimator_class
+    return current_estimator_class(**current_estimator.estimator_kwargs)  # type: ignore
+
+
+@instrumented("forecast_sklearn")
 def forecast_sklearn(
     df: pd.DataFrame,
     forecast_config: Forecast_Config,
     forecast_col_name: str = "price",
+    model_cache: Optional["ModelCache"] = None,
+    series_id: str = "",
 ) -> pd.DataFrame:
     """Forecasts the forecast_col_name(default 'price') column in df using the estimator_config.
+    With an export configuration, the fitted estimator is exported for serving without sklearn, see models.export.export_fitted().
+    With a selection, the estimator of the series is selected by forecast_selected().
+    With a horizon_mode other than "single", all prediction days are forecasted by forecast_multi_horizon().
 
     Args:
         df (pd.DataFrame): The df on which to forecast. This df must contain the is_last column.
         forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
         forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators, which skips the fit if the training data did not change. Defaults to None.
+        series_id (str, optional): The id of the series in df used as part of the model_cache key and as name of the exported model. Defaults to "", i.e. the estimator is not exported.
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode.
 
     Returns:
         pd.DataFrame: A df where rows with is_last==1 contain the forecast values.
     """
-    # Get the needed estimator_dict
-    current_estimator: Estimator_Config = forecast_config.estimators.get(
-        forecast_config.use_estimator_class, {}
-    ).get(
-        forecast_config.use_estimator
-    )  # type: ignore
-    # Get the current_estimator_class from the estimator_dict
-    current_estimator_class = estimator_dict.get(
-        forecast_config.use_estimator_class, {}
-    ).get(current_estimator.estimator_type)
-    # Create the estimator object from the current_estimator_class
-    current_estimator_object = current_estimator_class(
-        **current_estimator.estimator_kwargs
-    )  # type: ignore
+    check_local_mode(forecast_config, "forecast_sklearn()")
+    if forecast_config.selection is not None:
+        # Import here, since selection imports this module
+        from tpa_analytics_engine.models.selection import forecast_selected
+
+        return forecast_selected(
+            df=df,
+            forecast_config=forecast_config,
+            forecast_col_name=forecast_col_name,
+            model_cache=model_cache,
+            series_id=series_id,
+        )
+    if forecast_config.horizon_mode != "single":
+        # Import here, since multi_horizon imports this module
+        from tpa_analytics_engine.models.multi_horizon import forecast_multi_horizon
+
+        return forecast_multi_horizon(
+            df=df,
+            forecast_config=forecast_config,
+            forecast_col_name=forecast_col_name,
+            model_cache=model_cache,
+            series_id=series_id,
+        )
+
+    # Get the needed estimator config
+    current_estimator = get_estimator_config(forecast_config)
+    # Compute the mask once, every .loc selection copies the selected rows once
+    is_train = df["is_last"].to_numpy() == 0
+    y_train = df.loc[is_train, forecast_col_name]
+    X_train = df.loc[is_train, current_estimator.exogenous_vars]
 
     # Fit the estimator_object for is_last==0 providing exogenous variables from estimator_config.
-    current_estimator_object.fit(
-        y=df.loc[df.is_last == 0, forecast_col_name].reset_index(drop=True),
-        X=df.loc[df.is_last == 0, current_estimator.exogenous_vars].reset_index(
-            drop=True
-        ),
-    )
+    with stage("estimator_fit") as current_stage:
+        current_stage.set_result(X_train)
+        if model_cache is not None:
+            current_estimator_object = model_cache.fit(
+                series_id=series_id,
+                X=X_train,
+                y=y_train,
+                forecast_config=forecast_config,
+                window_start=df["Day_Hours"][is_train].min()
+                if "Day_Hours" in df
+                else None,
+            )
+        else:
+            current_estimator_object = create_estimator(forecast_config)
+            current_estimator_object.fit(y=y_train, X=X_train)
+    if forecast_config.export is not None:
+        export_fitted(
+            estimator=current_estimator_object,
+            directory=forecast_config.export.directory,
+            series_id=series_id,
+            feature_names=current_estimator.exogenous_vars,
+        )
 
     # Make the prediction for is_last==1.
-    df.loc[df.is_last == 1, "pred"] = current_estimator_object.predict(
-        X=df.loc[df.is_last == 1, current_estimator.exogenous_vars].reset_index(
-            drop=True
-        ),
-    )
+    with stage("estimator_predict") as current_stage:
+        X_pred = df.loc[~is_train, current_estimator.exogenous_vars]
+        current_stage.set_result(X_pred)
+        df.loc[~is_train, "pred"] = current_estimator_object.predict(X=X_pred)
 
     return df
+
+
+@instrumented("predict_last")
+def predict_last(
+    df: pd.DataFrame,
+    forecast_config: Forecast_Config,
+    forecast_col_name: str = "price",
+    model_cache: Optional["ModelCache"] = None,
+    series_id: str = "",
+    n_before: Optional[int] = None,
+    dtype: Any = np.float32,
+) -> np.ndarray:
+    """A low-overhead variant of forecast_sklearn() for serving single requests, which returns the forecasts instead of writing them into df.
+    The mask of the prediction rows is computed once and the exogenous variables are copied once into a C-contiguous dtype array,
+    whose training and prediction rows are passed to the estimator as views if the prediction rows are the last rows. df is not modified.
+    With a selection or a horizon_mode other than "single", forecast_sklearn() runs on a copy of df.
+
+    Args:
+        df (pd.DataFrame): The df on which to forecast. This df must contain the is_last column and, with n_before, the Day column.
+        forecast_config (Forecast_Config): The forecast configuration specifying the details of the forecast estimator.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+        model_cache (Optional[ModelCache], optional): A cache of fitted estimators, which skips the fit if the training data did not change. Defaults to None.
+        series_id (str, optional): The id of the series in df used as part of the model_cache key and as name of the exported model. Defaults to "", i.e. the estimator is not exported.
+        n_before (Optional[int], optional): If passed, only the last n_before days of df are used, like after filter_n_days_before() but without copying df. Defaults to None.
+        dtype (Any, optional): The dtype of the arrays of the exogenous variables. Defaults to np.float32.
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode.
+
+    Returns:
+        np.ndarray: The forecasts of the rows with is_last==1 in the order of df.
+    """
+    check_local_mode(forecast_config, "predict_last()")
+    rows = np.arange(len(df))
+    if n_before is not None:
+        day = df["Day"].to_numpy(dtype="datetime64[D]")
+        rows = np.flatnonzero(day >= day.max() - np.timedelta64(n_before - 1, "D"))
+    is_last = df["is_last"].to_numpy()[rows] == 1
+
+    if (
+        forecast_config.selection is not None
+        or forecast_config.horizon_mode != "single"
+    ):
+        forecast_df = forecast_sklearn(
+            df=df.take(rows),
+            forecast_config=forecast_config,
+            forecast_col_name=forecast_col_name,
+            model_cache=model_cache,
+            series_id=series_id,
+        )
+        return forecast_df["pred"].to_numpy(dtype=np.float64)[is_last]
+
+    # Copy the window rows of every column once, slices keep the column arrays views
+    exogenous_vars = get_estimator_config(forecast_config).exogenous_vars
+    is_range = len(rows) == 0 or rows[-1] - rows[0] == len(rows) - 1
+    window = slice(rows[0], rows[-1] + 1) if len(rows) else slice(0, 0)
+    X = np.empty((len(rows), len(exogenous_vars)), dtype=dtype)
+    for i, column in enumerate(exogenous_vars):
+        values = df[column].to_numpy()
+        X[:, i] = values[window] if is_range else values[rows]
+    y = df[forecast_col_name].to_numpy()
+    y = y[window] if is_range else y[rows]
+
+    # The prediction rows are the last rows of a df of add_columns(), so both parts are views of X
+    n_train = int(np.argmax(is_last)) if is_last.any() else len(is_last)
+    if not is_last[n_train:].all():
+        n_train = len(is_last) - int(is_last.sum())
+        order = np.concatenate([np.flatnonzero(~is_last), np.flatnonzero(is_last)])
+        X, y = X[order], y[order]
+    X_train, y_train, X_pred = X[:n_train], y[:n_train], X[n_train:]
+    if forecast_config.use_estimator_class not in ARRAY_ESTIMATOR_CLASSES:
+        X_train = pd.DataFrame(X_train, columns=exogenous_vars, copy=False)
+        X_pred = pd.DataFrame(X_pred, columns=exogenous_vars, copy=False)
+
+    with stage("estimator_fit") as current_stage:
+        current_stage.set_result(X_train)
+        if model_cache is not None:
+            estimator = model_cache.fit(
+                series_id=series_id,
+                X=X_train,
+                y=y_train,
+                forecast_config=forecast_config,
+                window_start=df["Day_Hours"].iloc[rows[~is_last]].min()
+                if "Day_Hours" in df
+                else None,
+            )
+        else:
+            estimator = create_estimator(forecast_config)
+            estimator.fit(X=X_train, y=y_train)
+    if forecast_config.export is not None:
+        export_fitted(
+            estimator=estimator,
+            directory=forecast_config.export.directory,
+            series_id=series_id,
+            feature_names=exogenous_vars,
+        )
+
+    with stage("estimator_predict") as current_stage:
+        current_stage.set_result(X_pred)
+        if len(X_pred) == 0:
+            return np.empty(0, dtype=np.float64)
+        return np.asarray(estimator.predict(X=X_pred), dtype=np.float64)
@@ -0,0 +1,442 @@
+"""A hyperparameter search over the estimators of the forecast configuration, which prints the winning forecast_config block for the config YAML.
+
+Run with: tpa-forecast-tune --config configs/config.yaml --output tuned.yaml
+The search space is read from the tuning_config of the config, see Tuning_Config.
+"""
+import argparse
+import functools
+import math
+import sys
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import yaml  # type: ignore
+from pydantic import BaseModel
+from tpa_analytics_engine.instrumentation import instrumented
+from tpa_analytics_engine.models.backtest import backtest_chunk
+from tpa_analytics_engine.models.backtest import create_executor
+from tpa_analytics_engine.models.backtest import lag_columns
+from tpa_analytics_engine.models.backtest import prepare_series
+from tpa_analytics_engine.models.backtest import select_cutoffs
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import Estimator_Config
+from tpa_analytics_engine.models.models_config import Forecast_Config
+from tpa_analytics_engine.models.models_config import Tuning_Config
+from tpa_analytics_engine.models.sklearn import get_estimator_config
+
+# The prepared series of the search of a process worker, which receives them once through _set_series() instead of with every task.
+# Threads and the calling process get the series of their search with every task instead, so concurrent searches do not share them.
+_series: List[tuple] = []
+
+# The sums of the absolute and squared errors and the number of evaluated rows
+Error_Sums = Tuple[float, float, int]
+
+
+class Tuning_Trial(BaseModel):
+    """One configuration of the search and its backtest errors on the sampled series.
+    n_cutoffs is the number of cutoffs per series it was evaluated on, which is smaller than the n_cutoffs of the Tuning_Config if it was stopped early.
+    """
+
+    estimator_class: str
+    estimator: str
+    estimator_config: Estimator_Config
+    n_before: int
+    n_cutoffs: int = 0
+    mae: float = math.inf
+    rmse: float = math.inf
+    n: int = 0
+
+
+class Tuning_Result(BaseModel):
+    """The result of tune(): the best trial, all trials (those evaluated on the most cutoffs first and by ascending MAE) and the (station, sorte) pairs they were evaluated on."""
+
+    best: Tuning_Trial
+    trials: List[Tuning_Trial]
+    series: List[Tuple[str, str]]
+
+
+def create_trials(
+    forecast_config: Forecast_Config, tuning_config: Tuning_Config
+) -> List[Tuning_Trial]:
+    """Creates the trials of the grid spanned by tuning_config, or a random sample of n_samples of them.
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration with the estimators the search is based on.
+        tuning_config (Tuning_Config): The search space.
+
+    Raises:
+        ValueError: If a candidate or a key of the estimator_kwargs is not in the estimators of forecast_config.
+
+    Returns:
+        List[Tuning_Trial]: The trials, not yet evaluated.
+    """
+    candidates = tuning_config.candidates or [
+        f"{estimator_class}.{estimator}"
+        for estimator_class, estimators in forecast_config.estimators.items()
+        for estimator in estimators
+    ]
+    for candidate in [*candidates, *tuning_config.estimator_kwargs]:
+        estimator_class, _, estimator = candidate.partition(".")
+        if estimator not in forecast_config.estimators.get(estimator_class, {}):
+            raise ValueError(f"The candidate {candidate} is not in the estimators.")
+
+    # Every candidate spans the grid of its keyword arguments, the exogenous variables and n_before
+    grids = []
+    for candidate in candidates:
+        kwargs = tuning_config.estimator_kwargs.get(candidate, {})
+        dimensions = [
+            *kwargs.values(),
+            tuning_config.exogenous_vars or [None],
+            tuning_config.n_before or [forecast_config.n_before],
+        ]
+        grids.append((candidate, list(kwargs), dimensions))
+    sizes = [
+        math.prod(len(values) for values in dimensions) for *_, dimensions in grids
+    ]
+    n_grid = sum(sizes)
+
+    # A sample is drawn from the flat indices of the grids, so the grids are never enumerated
+    if tuning_config.n_samples is None or tuning_config.n_samples >= n_grid:
+        indices: Iterable[int] = range(n_grid)
+    else:
+        rng = np.random.default_rng(tuning_config.random_state)
+        indices = np.sort(rng.choice(n_grid, tuning_config.n_samples, replace=False))
+    offsets = [0, *accumulate(sizes)]
+
+    trials = []
+    for index in indices:
+        grid_number = int(np.searchsorted(offsets, index, side="right")) - 1
+        candidate, names, dimensions = grids[grid_number]
+        position = np.unravel_index(
+            int(index) - offsets[grid_number], [len(values) for values in dimensions]
+        )
+        *kwarg_values, exogenous_vars, n_before = [
+            values[i] for values, i in zip(dimensions, position)
+        ]
+        estimator_class, _, estimator = candidate.partition(".")
+        base = forecast_config.estimators[estimator_class][estimator]
+        trials.append(
+            Tuning_Trial(
+                estimator_class=estimator_class,
+                estimator=estimator,
+                estimator_config=Estimator_Config(
+                    estimator_type=base.estimator_type,
+                    estimator_kwargs={
+                        **base.estimator_kwargs,
+                        **dict(zip(names, kwarg_values)),
+                    },
+                    exogenous_vars=exogenous_vars or base.exogenous_vars,
+                ),
+                n_before=n_before,
+            )
+        )
+    return trials
+
+
+def trial_config(
+    forecast_config: Forecast_Config, trial: Tuning_Trial
+) -> Forecast_Config:
+    """Returns the forecast configuration using the estimator and n_before of the trial instead of use_estimator and the selection, without model cache and export."""
+    return forecast_config.model_copy(
+        update={
+            "n_before": trial.n_before,
+            "use_estimator_class": trial.estimator_class,
+            "use_estimator": trial.estimator,
+            "estimators": {
+                trial.estimator_class: {trial.estimator: trial.estimator_config}
+            },
+            "selection": None,
+            "model_cache": None,
+            "export": None,
+        }
+    )
+
+
+@instrumented("tune")
+def tune(
+    frames: Iterable[Tuple[Tuple[str, str], pd.DataFrame]],
+    forecast_config: Forecast_Config,
+    tuning_config: Tuning_Config,
+    forecast_col_name: str = "price",
+) -> Tuning_Result:
+    """Searches the configurations of create_trials() by a rolling-origin backtest on the series of frames, stopping clearly worse ones early by successive halving:
+    all trials are evaluated on the newest cutoffs first, only the best 1/halving_factor of them on halving_factor times more cutoffs, until the best ones are evaluated on all n_cutoffs cutoffs.
+    The feature matrix of every series is computed once with the exogenous variables of all trials and shared by all trials,
+    the process workers of forecast_config.executor receive it once when they start instead of with every task.
+
+    Args:
+        frames (Iterable[Tuple[Tuple[str, str], pd.DataFrame]]): The (station, sorte) pairs and their dfs of add_columns() without prediction rows, e.g. iter_feature_frames() with add_pred=False
+            of a sample of n_stations series.
+        forecast_config (Forecast_Config): The forecast configuration with the estimators the search is based on and the executor on which the trials run.
+        tuning_config (Tuning_Config): The search space.
+        forecast_col_name (str, optional): The name of the column to forecast. Defaults to "price".
+
+    Raises:
+        ValueError: If forecast_config is in the "global" mode, there is no trial, no series or an exogenous variable of a trial is not a column of the dfs.
+
+    Returns:
+        Tuning_Result: The best trial and all trials with their errors on the series.
+    """
+    check_local_mode(forecast_config, "tune()")
+    trials = create_trials(forecast_config=forecast_config, tuning_config=tuning_config)
+    if not trials:
+        raise ValueError("The tuning configuration has no trials.")
+    exogenous_vars = list(
+        dict.fromkeys(
+            column
+            for trial in trials
+            for column in trial.estimator_config.exogenous_vars
+        )
+    )
+    horizon_days = tuning_config.horizon_days
+    fast_path = forecast_config.horizon_mode == "single"
+
+    series, pairs = [], []
+    for pair, df in frames:
+        missing = [column for column in exogenous_vars if column not in df]
+        if missing:
+            raise ValueError(f"The exogenous variables {missing} are not in the df.")
+        df = df.sort_values("Day_Hours", kind="stable", ignore_index=True)
+        day_number = df["Day"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+        if len(day_number) == 0:
+            continue
+        X, y, day_codes, avg_daily_price = prepare_series(
+            df=df, exogenous_vars=exogenous_vars, forecast_col_name=forecast_col_name
+        )
+        cutoffs = select_cutoffs(
+            day_number=day_number,
+            n_cutoffs=tuning_config.n_cutoffs,
+            horizon_days=horizon_days,
+            step_days=tuning_config.step_days,
+        )
+        series.append(
+            (
+                None if fast_path else df,
+                X,
+                y,
+                day_number,
+                day_codes,
+                avg_daily_price,
+                cutoffs[::-1],
+            )
+        )
+        pairs.append(pair)
+    if not series:
+        raise ValueError("There are no series to tune on.")
+
+    # The rungs evaluate the newest budgets[0] cutoffs, then the next ones up to budgets[1], ...
+    factor = tuning_config.halving_factor
+    n_rungs = 1
+    while (
+        factor**n_rungs < len(trials) and tuning_config.n_cutoffs // factor**n_rungs
+    ):
+        n_rungs += 1
+    budgets = [
+        tuning_config.n_cutoffs // factor ** (n_rungs - 1 - rung)
+        for rung in range(n_rungs)
+    ]
+    sums = np.zeros((len(trials), 3))
+    tasks = [
+        (
+            trial_config(forecast_config=forecast_config, trial=trial),
+            [exogenous_vars.index(c) for c in trial.estimator_config.exogenous_vars],
+        )
+        for trial in trials
+    ]
+
+    # Process workers keep the series of this search in their module global, threads and the calling process get them bound to every task
+    if forecast_config.executor.backend == "process":
+        executor = create_executor(
+            forecast_config.executor, initializer=_set_series, initargs=(series,)
+        )
+    else:
+        executor = create_executor(forecast_config.executor)
+    evaluate = (
+        _evaluate_worker_trial
+        if isinstance(executor, ProcessPoolExecutor)
+        else functools.partial(_evaluate_trial, series)
+    )
+    try:
+        alive = list(range(len(trials)))
+        for rung, budget in enumerate(budgets):
+            first = budgets[rung - 1] if rung > 0 else 0
+            results: List = []
+            for trial_number in alive:
+                config, columns = tasks[trial_number]
+                for series_number in range(len(series)):
+                    task_args = (
+                        config,
+                        columns,
+                        series_number,
+                        first,
+                        budget,
+                        max(config.n_before - horizon_days, 1),
+                        horizon_days,
+                        forecast_col_name,
+                    )
+                    results.append(
+                        (
+                            trial_number,
+                            evaluate(*task_args)
+                            if executor is None
+                            else executor.submit(evaluate, *task_args),
+                        )
+                    )
+            for trial_number, result in results:
+                sums[trial_number] += (
+                    result.result() if isinstance(result, Future) else result
+                )
+            for trial_number in alive:
+                absolute, squared, n = sums[trial_number]
+                trials[trial_number].n_cutoffs = budget
+                trials[trial_number].n = int(n)
+                trials[trial_number].mae = absolute / n if n else math.inf
+                trials[trial_number].rmse = math.sqrt(squared / n) if n else math.inf
+            # Only the best trials are evaluated on the cutoffs of the next rung
+            alive = sorted(alive, key=lambda number: trials[number].mae)[
+                : math.ceil(len(alive) / factor)
+            ]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    ranked = sorted(trials, key=lambda trial: (-trial.n_cutoffs, trial.mae))
+    return Tuning_Result(best=ranked[0], trials=ranked, series=pairs)
+
+
+def tuned_config_block(
+    forecast_config: Forecast_Config,
+    trial: Tuning_Trial,
+    estimator_name: str = "tuned",
+) -> dict:
+    """Returns the forecast_config block of the config YAML using the trial: its estimator is added to the estimators as estimator_name and used with the n_before of the trial.
+    A selection of forecast_config is dropped, since it would replace the tuned estimator.
+
+    Args:
+        forecast_config (Forecast_Config): The forecast configuration the search was based on.
+        trial (Tuning_Trial): The trial to use, e.g. the best of tune().
+        estimator_name (str, optional): The name of the estimator of the trial in the estimators. Defaults to "tuned".
+
+    Returns:
+        dict: A dictionary with the key 'forecast_config', which can be dumped into the config YAML.
+    """
+    estimators = {
+        estimator_class: dict(estimators)
+        for estimator_class, estimators in forecast_config.estimators.items()
+    }
+    estimators.setdefault(trial.estimator_class, {})[
+        estimator_name
+    ] = trial.estimator_config
+    config = forecast_config.model_copy(
+        update={
+            "n_before": trial.n_before,
+            "use_estimator_class": trial.estimator_class,
+            "use_estimator": estimator_name,
+            "estimators": estimators,
+            "selection": None,
+        }
+    )
+    return {"forecast_config": config.model_dump(mode="json", exclude_defaults=True)}
+
+
+def _set_series(series: List[tuple]) -> None:
+    """Sets the prepared series of the search in this process, called once in every worker."""
+    global _series
+    _series = series
+
+
+def _evaluate_worker_trial(*args) -> Error_Sums:
+    """Evaluates a trial like _evaluate_trial() on the series set by _set_series() in this process worker."""
+    return _evaluate_trial(_series, *args)
+
+
+def _evaluate_trial(
+    series: List[tuple],
+    forecast_config: Forecast_Config,
+    columns: List[int],
+    series_number: int,
+    first: int,
+    stop: int,
+    n_train_days: int,
+    horizon_days: int,
+    forecast_col_name: str,
+) -> Error_Sums:
+    """Backtests the trial of forecast_config, whose exogenous variables are the columns of the shared feature matrix,
+    on the cutoffs first:stop (from the newest on) of the prepared series series_number of series and returns the sums of its errors.
+    A prepared series is the df (only needed without the fast path of backtest_chunk()), the feature matrix of all searched exogenous variables,
+    the target, the day numbers, the day codes, the daily averages and the cutoffs from the newest on.
+    """
+    df, X, y, day_number, day_codes, avg_daily_price, cutoffs = series[series_number]
+    cutoffs = np.sort(cutoffs[first:stop])
+    if len(cutoffs) == 0:
+        return 0.0, 0.0, 0
+    # Only the rows of the windows of the cutoffs are sliced
+    lo, hi = np.searchsorted(
+        day_number, [cutoffs[0] - n_train_days, cutoffs[-1] + horizon_days]
+    )
+    positions, _, pred = backtest_chunk(
+        None if df is None else df.iloc[lo:hi],
+        X[lo:hi, columns],
+        y[lo:hi],
+        day_number[lo:hi],
+        day_codes[lo:hi],
+        avg_daily_price,
+        lag_columns(get_estimator_config(forecast_config).exogenous_vars),
+        lo,
+        cutoffs,
+        forecast_config,
+        n_train_days,
+        horizon_days,
+        forecast_col_name,
+    )
+    error = pred - y[positions]
+    error = error[np.isfinite(error)]
+    return float(np.abs(error).sum()), float((error**2).sum()), len(error)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument(
+        "--output", default=None, help="The YAML file of the block, default stdout."
+    )
+    parser.add_argument("--estimator-name", default="tuned")
+    args = parser.parse_args()
+
+    # The api imports the models, so it is only imported when run as a script
+    from tpa_analytics_engine.api import Forecast
+
+    forecast = Forecast(args.config)
+    result = forecast.tune()
+    for trial in result.trials:
+        print(
+            f"{trial.mae:10.5f} {trial.n_cutoffs:4d} cutoffs  n_before={trial.n_before}  "
+            f"{trial.estimator_class}.{trial.estimator} {trial.estimator_config.estimator_kwargs} "
+            f"{trial.estimator_config.exogenous_vars}",
+            file=sys.stderr,
+        )
+    block = yaml.safe_dump(
+        tuned_config_block(
+            forecast_config=forecast.forecast_config,
+            trial=result.best,
+            estimator_name=args.estimator_name,
+        ),
+        sort_keys=False,
+    )
+    if args.output is None:
+        print(block)
+    else:
+        with open(args.output, "w") as file:
+            file.write(block)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""A long-running HTTP/JSON forecast service, which keeps the config, the connection, the loaded dfs and the fitted estimators in memory.
+
+Endpoints:
+    GET  /health     -> {"status": "ok", "frames": <number of loaded dfs>}
+    POST /forecast   {"pairs": [[station, sorte], ...]} -> {"forecasts": [{"station", "sorte", "Day_Hours", "pred"}, ...]}
+    POST /summaries  {"pairs": [[station, sorte], ...], "groupCol": "hour", "centralize_mean": false}
+                     -> {"summaries": [{"station", "sorte", "summary": {group: value}}, ...]}
+
+Instead of pairs, a single "station" and "sorte" can be passed. All pairs of a request are loaded with one read and forecasted in one batch.
+Requests are computed concurrently: a pair requested by several requests at once is loaded once, and its estimator is fitted once.
+A changed config file is reloaded on the next request, unless --no-hot-reload is passed.
+
+Run with: tpa-forecast-server --config configs/config.yaml --port 8080
+"""
+import argparse
+import datetime
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pandas as pd
+from tpa_analytics_engine.api import Forecast
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    load_stations_sortes,
+)
+from tpa_analytics_engine.explorative.summaries import mean_centralize
+from tpa_analytics_engine.explorative.summaries import summarize
+from tpa_analytics_engine.models.model_cache import ModelCache
+from tpa_analytics_engine.models.models_config import check_local_mode
+from tpa_analytics_engine.models.models_config import Model_Cache_Config
+from tpa_analytics_engine.models.sklearn import predict_last
+
+
+class ForecastService:
+    def __init__(
+        self,
+        config_path: str,
+        max_frames: int = 256,
+        hot_reload: bool = True,
+        config_snapshot_dir: Optional[str] = None,
+    ) -> None:
+        """A forecast service keeping the config, the connection, up to max_frames loaded dfs and the fitted estimators warm.
+        The dfs are reloaded on the next day, since their prediction rows depend on the current date.
+        If no model cache is configured, an in-memory one with the default configuration is used.
+
+        Args:
+            config_path (str): The path to the config YAML file.
+            max_frames (int, optional): The maximum number of dfs kept in memory, the least recently used are dropped beyond it. Defaults to 256.
+            hot_reload (bool, optional): If True, every request checks whether the config file changed and reloads it, dropping the loaded dfs. Defaults to True.
+            config_snapshot_dir (Optional[str], optional): A directory of JSON snapshots of the validated configs, see load_config(). Defaults to None.
+
+        Raises:
+            ValueError: If the forecast configuration is in the "global" mode.
+        """
+        self.forecast = Forecast(config_path, config_snapshot_dir=config_snapshot_dir)
+        check_local_mode(self.forecast.forecast_config, "ForecastService")
+        if self.forecast.model_cache is None:
+            self.forecast.model_cache = ModelCache(Model_Cache_Config())
+        self.hot_reload = hot_reload
+        self.max_frames = max_frames
+        self.frames: "OrderedDict[Tuple[str, str], pd.DataFrame]" = OrderedDict()
+        self.frames_date = datetime.date.today()
+        # The lock only guards the frames, the config and the maps below, the dfs are loaded and the estimators fitted outside of it
+        self._lock = threading.Lock()
+        # The futures of the dfs being loaded by a request, which other requests of the same pairs wait for (single flight)
+        self._loading: Dict[Tuple[str, str], "Future[pd.DataFrame]"] = {}
+        # The number of times the frames were dropped, dfs loaded before are not kept
+        self._generation = 0
+        # A lock per pair, so the estimator of a pair is fitted by one request while the others wait for it in the model cache
+        self._pair_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def get_frames(
+        self, pairs: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], pd.DataFrame]:
+        """Returns the dfs with date features of the pairs, loading all missing ones with a single read outside of the lock.
+        Pairs which another request is loading are not loaded again, but waited for.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The (station, sorte) pairs.
+
+        Returns:
+            Dict[Tuple[str, str], pd.DataFrame]: The dfs by pair.
+        """
+        with self._lock:
+            if self.hot_reload and self.forecast.reload_config():
+                self._clear_frames()
+                if self.forecast.model_cache is None:
+                    self.forecast.model_cache = ModelCache(Model_Cache_Config())
+            if self.frames_date != datetime.date.today():
+                self._clear_frames()
+                self.frames_date = datetime.date.today()
+
+            frames = {}
+            pending = {}
+            missing = []
+            for pair in dict.fromkeys(pairs):
+                if pair in self.frames:
+                    self.frames.move_to_end(pair)
+                    frames[pair] = self.frames[pair]
+                    continue
+                if pair not in self._loading:
+                    self._loading[pair] = Future()
+                    missing.append(pair)
+                pending[pair] = self._loading[pair]
+            generation = self._generation
+            pandas_connection = self.forecast.pandas_connection
+            data_config = self.forecast.data_config
+
+        if missing:
+            self._load_frames(missing, pandas_connection, data_config, generation)
+        for pair, future in pending.items():
+            frames[pair] = future.result()
+        return frames
+
+    def _load_frames(
+        self,
+        pairs: List[Tuple[str, str]],
+        pandas_connection: Any,
+        data_config: Data_Config,
+        generation: int,
+    ) -> None:
+        """Loads the dfs of the pairs with a single read, sets the results of their futures and keeps them unless the frames were dropped meanwhile."""
+        try:
+            long_df = load_stations_sortes(
+                pandas_connection=pandas_connection,
+                data_config=data_config,
+                pairs=pairs,
+                add_pred=True,
+            )
+            loaded = {
+                (station, sorte): add_columns(
+                    df=series_df.drop(columns=["station", "sorte"]),
+                    dtype_policy=data_config.dtype_policy,
+                    horizon_days=data_config.horizon_days,
+                )
+                for (station, sorte), series_df in long_df.groupby(
+                    ["station", "sorte"], sort=False
+                )
+            }
+        except BaseException as error:
+            with self._lock:
+                for pair in pairs:
+                    self._loading.pop(pair).set_exception(error)
+            raise
+
+        with self._lock:
+            for pair in pairs:
+                future = self._loading.pop(pair)
+                if pair not in loaded:
+                    future.set_exception(KeyError(f"The pair {pair} is not in the df."))
+                    continue
+                if generation == self._generation:
+                    self.frames[pair] = loaded[pair]
+                future.set_result(loaded[pair])
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+
+    def _clear_frames(self) -> None:
+        """Drops the loaded dfs, must be called with the lock held."""
+        self.frames.clear()
+        self._generation += 1
+
+    def _pair_lock(self, pair: Tuple[str, str]) -> threading.Lock:
+        """Returns the lock of the pair, which serializes the fits of its estimator."""
+        with self._lock:
+            return self._pair_locks.setdefault(pair, threading.Lock())
+
+    def create_forecasts(self, pairs: List[Tuple[str, str]]) -> List[dict]:
+        """Creates the forecasts of the pairs with the warm dfs and estimators.
+        The estimators are fitted outside of the lock of the service, so requests of other pairs are not blocked by a fit.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The (station, sorte) pairs to forecast.
+
+        Returns:
+            List[dict]: The forecasted rows with the keys station, sorte, Day_Hours and pred.
+        """
+        frames = self.get_frames(pairs)
+        with self._lock:
+            forecast_config = self.forecast.forecast_config
+            model_cache = self.forecast.model_cache
+        forecasts = []
+        for (station, sorte), df in frames.items():
+            with self._pair_lock((station, sorte)):
+                pred = predict_last(
+                    df=df,
+                    forecast_config=forecast_config,
+                    model_cache=model_cache,
+                    series_id=f"{sorte}_{station}",
+                    n_before=forecast_config.n_before,
+                )
+            day_hours = df["Day_Hours"].to_numpy()[df["is_last"].to_numpy() == 1]
+            forecasts.extend(
+                {
+                    "station": station,
+                    "sorte": sorte,
+                    "Day_Hours": pd.Timestamp(day).isoformat(),
+                    "pred": float(value),
+                }
+                for day, value in zip(day_hours, pred)
+            )
+        return forecasts
+
+    def create_summaries(
+        self, pairs: List[Tuple[str, str]], groupCol: str, centralize_mean: bool
+    ) -> List[dict]:
+        """Summarises the "price" column of the pairs by groupCol, see Forecast.create_summaries().
+
+        Args:
+            pairs (List[Tuple[str, str]]): The (station, sorte) pairs to summarise.
+            groupCol (str): The time column by which to group by.
+            centralize_mean (bool): If True, centralizes the mean of the summaries.
+
+        Raises:
+            ValueError: If groupCol is not in the dfs.
+
+        Returns:
+            List[dict]: The summaries with the keys station, sorte and summary.
+        """
+        frames = self.get_frames(pairs)
+        summaries = []
+        for (station, sorte), df in frames.items():
+            summary = summarize(
+                df=df[df.is_last == 0], groupCol=groupCol, aggCol="price"
+            )
+            if centralize_mean:
+                summary = mean_centralize(summary)
+            summaries.append(
+                {
+                    "station": station,
+                    "sorte": sorte,
+                    "summary": {
+                        str(key): float(value) for key, value in summary.items()
+                    },
+                }
+            )
+        return summaries
+
+
+def parse_pairs(body: dict) -> List[Tuple[str, str]]:
+    """Returns the (station, sorte) pairs of a request body with either "pairs" or "station" and "sorte".
+
+    Args:
+        body (dict): The JSON body of the request.
+
+    Raises:
+        ValueError: If the body contains no pairs.
+
+    Returns:
+        List[Tuple[str, str]]: The pairs.
+    """
+    if "pairs" in body:
+        pairs = [(str(station), str(sorte)) for station, sorte in body["pairs"]]
+    elif "station" in body and "sorte" in body:
+        pairs = [(str(body["station"]), str(body["sorte"]))]
+    else:
+        pairs = []
+    if len(pairs) == 0:
+        raise ValueError("The request must contain pairs or a station and a sorte.")
+    return pairs
+
+
+def create_server(
+    service: ForecastService, host: str = "127.0.0.1", port: int = 8080
+) -> ThreadingHTTPServer:
+    """Creates an HTTP server answering the requests with service, see the module docstring for the endpoints.
+
+    Args:
+        service (ForecastService): The service computing the responses.
+        host (str, optional): The host to bind. Defaults to "127.0.0.1".
+        port (int, optional): The port to bind, 0 for a free port. Defaults to 8080.
+
+    Returns:
+        ThreadingHTTPServer: The server, which is started with serve_forever().
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self._respond(200, {"status": "ok", "frames": len(service.frames)})
+            else:
+                self._respond(404, {"error": f"Unknown path: {self.path}"})
+
+        def do_POST(self) -> None:
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/forecast":
+                    response = {
+                        "forecasts": service.create_forecasts(parse_pairs(body))
+                    }
+                elif self.path == "/summaries":
+                    response = {
+                        "summaries": service.create_summaries(
+                            pairs=parse_pairs(body),
+                            groupCol=body.get("groupCol", "hour"),
+                            centralize_mean=bool(body.get("centralize_mean", False)),
+                        )
+                    }
+                else:
+                    self._respond(404, {"error": f"Unknown path: {self.path}"})
+                    return
+            except (ValueError, KeyError, TypeError) as error:
+                self._respond(400, {"error": str(error)})
+                return
+            self._respond(200, response)
+
+        def _respond(self, status: int, response: dict) -> None:
+            content = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-frames", type=int, default=256)
+    parser.add_argument(
+        "--no-hot-reload",
+        action="store_true",
+        help="Do not reload the config when its file changes.",
+    )
+    parser.add_argument("--config-snapshot-dir", default=None)
+    args = parser.parse_args()
+
+    server = create_server(
+        ForecastService(
+            args.config,
+            max_frames=args.max_frames,
+            hot_reload=not args.no_hot_reload,
+            config_snapshot_dir=args.config_snapshot_dir,
+        ),
+        host=args.host,
+        port=args.port,
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+import os
+import sys
+
 import yaml  # type: ignore
 
 
@@ -18,3 +21,25 @@ def get_config(config_path: str) -> dict:
     return configDict
 
     # TODO: Change argument to Pathlib type
+
+
+def get_rss_bytes() -> int:
+    """A shared function returning the current resident set size of the process.
+    On systems without /proc, the peak resident set size is returned instead, and 0 where neither is available (Windows).
+
+    Returns:
+        int: The resident set size in bytes.
+    """
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
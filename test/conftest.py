@@ -1,10 +1,15 @@
+import copy
+
 import pytest
+import yaml  # type: ignore
 from cloud_storage_wrapper.oci_access.config import create_OCI_Connection_from_dict
 from cloud_storage_wrapper.oci_access.pandas import create_PandasOCI_from_dict
 from tpa_analytics_engine.api import Forecast
+from tpa_analytics_engine.data_handler.cache import create_cached_connection
 from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
 from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
 from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
 from tpa_analytics_engine.models.models_config import create_forecast_config
 from tpa_analytics_engine.utils import get_config
 
@@ -22,13 +27,16 @@ def provide_oci_config(provide_config):
 
 
 @pytest.fixture(scope="session")
-def provide_oci_pandas_config(provide_config):
-    return create_PandasOCI_from_dict(provide_config)
+def provide_data_config(provide_config, provide_oci_config):
+    return Data_Config(**provide_config["data_config"])
 
 
 @pytest.fixture(scope="session")
-def provide_data_config(provide_config, provide_oci_config):
-    return Data_Config(**provide_config["data_config"])
+def provide_oci_pandas_config(provide_config, provide_data_config):
+    return create_cached_connection(
+        pandas_connection=create_PandasOCI_from_dict(provide_config),
+        cache_config=provide_data_config.cache,
+    )
 
 
 @pytest.fixture(scope="session")
@@ -55,3 +63,23 @@ def provide_forecast_config(provide_config):
 @pytest.fixture(scope="function")
 def provide_Forecast_object(provide_config):
     return Forecast(config_path=config_path)
+
+
+@pytest.fixture(scope="session")
+def provide_local_data_dir(tmp_path_factory):
+    local_dir = tmp_path_factory.mktemp("local_data")
+    wide_df = make_wide_df(n_stations=5, n_days=60)
+    wide_df.to_feather(local_dir / "BASE_df_wide.ftr", chunksize=1000)
+    wide_df.to_parquet(local_dir / "BASE_df_wide.parquet", row_group_size=1000)
+    return local_dir
+
+
+@pytest.fixture(scope="session")
+def provide_local_config_path(provide_config, provide_local_data_dir):
+    local_config = copy.deepcopy(provide_config)
+    local_config["data_config"]["local_dir"] = str(provide_local_data_dir)
+    local_config["data_config"].pop("cache", None)
+    local_config_path = provide_local_data_dir / "local_config.yaml"
+    with open(local_config_path, "w") as file:
+        yaml.safe_dump(local_config, file)
+    return str(local_config_path)
@@ -1,4 +1,30 @@
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
 import pytest
+import yaml  # type: ignore
+from tpa_analytics_engine import server
+from tpa_analytics_engine.api import Forecast
+from tpa_analytics_engine.async_api import AsyncForecast
+from tpa_analytics_engine.config import clear_config_cache
+from tpa_analytics_engine.config import get_snapshot_path
+from tpa_analytics_engine.config import load_config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    load_stations_sortes,
+)
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.instrumentation import InMemoryCollector
+from tpa_analytics_engine.instrumentation import PrometheusExporter
+from tpa_analytics_engine.instrumentation import use_sink
+from tpa_analytics_engine.server import create_server
+from tpa_analytics_engine.server import ForecastService
 
 
 def test_load_df(provide_Forecast_object):
@@ -52,3 +78,256 @@ def test_create_summaries(provide_Forecast_object):
     assert abs(summary_hour.mean()) < 1
     assert len(summary_week) == len(provide_Forecast_object.df["week"].unique())
     assert summary_week.mean() > 1
+
+
+def test_create_forecasts(provide_Forecast_object):
+    with pytest.raises(ValueError):
+        provide_Forecast_object.create_forecasts()
+
+    pairs = [("9771", "diesel"), ("9771", "e5")]
+    forecast_df = provide_Forecast_object.create_forecasts(pairs=pairs)
+
+    assert list(forecast_df.groupby(["station", "sorte"], sort=False).groups) == pairs
+    assert forecast_df.loc[forecast_df.is_last == 1, "pred"].mean() > 0
+    assert forecast_df.loc[forecast_df.is_last == 0, "pred"].isna().all()
+
+
+def test_forecast_metrics(provide_local_config_path):
+    collector = InMemoryCollector()
+    forecast = Forecast(str(provide_local_config_path), metrics_sink=collector)
+    forecast.load_df(station="1", sorte="e5")
+    forecast.create_forecast()
+    forecast.create_summaries(groupCol="hour", centralize_mean=False)
+
+    metrics_df = collector.to_df()
+    for stage in [
+        "Forecast.load_df",
+        "load_station_sorte",
+        "retrieve_df",
+        "add_columns",
+        "Forecast.create_forecast",
+        "filter_n_days_before",
+        "forecast_sklearn",
+        "estimator_fit",
+        "estimator_predict",
+        "Forecast.create_summaries",
+        "summarize",
+    ]:
+        assert stage in set(metrics_df["stage"])
+    assert (metrics_df["seconds"] >= 0).all()
+    retrieve_metrics = metrics_df[metrics_df["stage"] == "retrieve_df"].iloc[0]
+    assert retrieve_metrics["rows"] > 0 and retrieve_metrics["bytes_read"] > 0
+    assert collector.summary().loc["add_columns", "rows"] == len(forecast.df)
+
+    # Without a sink, no stage is measured
+    collector.clear()
+    forecast.metrics_sink = None
+    forecast.create_forecast()
+    assert len(collector.records) == 0
+
+    exporter = PrometheusExporter()
+    with use_sink(exporter):
+        forecast.create_forecast()
+    text = exporter.render()
+    assert "# TYPE tpa_analytics_engine_stage_seconds_total counter" in text
+    assert 'tpa_analytics_engine_stage_calls_total{stage="estimator_fit"} 1' in text
+
+
+class FakeObjectStore:
+    def __init__(self, directory, latency, counter):
+        """A local stand-in for PandasOCI, which delays every download and counts the concurrent downloads."""
+        self.source = ArrowFileSource(directory)
+        self.latency = latency
+        self.counter = counter
+
+    def retrieve_df(self, path, df_format, columns=None):
+        with self.counter["lock"]:
+            self.counter["running"] += 1
+            self.counter["max_running"] = max(
+                self.counter["max_running"], self.counter["running"]
+            )
+        time.sleep(self.latency)
+        with self.counter["lock"]:
+            self.counter["running"] -= 1
+        return self.source.retrieve_df(path=path, df_format=df_format, columns=columns)
+
+
+def test_async_forecast(provide_local_config_path, provide_local_data_dir):
+    pairs = [(str(station), "e5") for station in range(5)]
+    counter = {"lock": threading.Lock(), "running": 0, "max_running": 0}
+
+    async def create_forecasts():
+        async with AsyncForecast(
+            str(provide_local_config_path),
+            max_connections=2,
+            connection_factory=lambda: FakeObjectStore(
+                str(provide_local_data_dir), latency=0.05, counter=counter
+            ),
+        ) as async_forecast:
+            assert async_forecast.pool.size == 2
+            return await async_forecast.create_forecasts(pairs)
+
+    forecast_df = asyncio.run(create_forecasts())
+    assert counter["max_running"] == 2
+
+    forecast = Forecast(str(provide_local_config_path))
+    for station, sorte in pairs:
+        forecast.load_df(station=station, sorte=sorte)
+        expected = forecast.create_forecast()
+        actual = forecast_df[
+            (forecast_df.station == station) & (forecast_df.sorte == sorte)
+        ]
+        pd.testing.assert_series_equal(
+            actual["pred"].reset_index(drop=True),
+            expected["pred"].reset_index(drop=True),
+        )
+
+
+def test_forecast_server(provide_local_config_path):
+    service = ForecastService(str(provide_local_config_path))
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def post(path, body):
+        request = urllib.request.Request(
+            url + path,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        with urllib.request.urlopen(url + "/health") as response:
+            assert json.loads(response.read())["status"] == "ok"
+
+        forecasts = post("/forecast", {"pairs": [["1", "e5"], ["2", "diesel"]]})[
+            "forecasts"
+        ]
+        assert len(service.frames) == 2
+        assert {(f["station"], f["sorte"]) for f in forecasts} == {
+            ("1", "e5"),
+            ("2", "diesel"),
+        }
+
+        forecast = Forecast(str(provide_local_config_path))
+        forecast.load_df(station="1", sorte="e5")
+        forecast_df = forecast.create_forecast()
+        expected = forecast_df.loc[forecast_df.is_last == 1, "pred"].tolist()
+        assert [f["pred"] for f in forecasts if f["station"] == "1"] == expected
+
+        # A repeated request uses the warm df and estimator
+        n_models = len(service.forecast.model_cache.models)
+        assert post("/forecast", {"station": "1", "sorte": "e5"})["forecasts"] == [
+            f for f in forecasts if f["station"] == "1"
+        ]
+        assert len(service.forecast.model_cache.models) == n_models
+
+        summaries = post(
+            "/summaries",
+            {"pairs": [["1", "e5"]], "groupCol": "hour", "centralize_mean": True},
+        )["summaries"]
+        forecast_summary = forecast.create_summaries(
+            groupCol="hour", centralize_mean=True
+        )
+        assert list(summaries[0]["summary"].values()) == pytest.approx(
+            forecast_summary.tolist()
+        )
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post("/forecast", {})
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_forecast_service_concurrency(provide_local_config_path, monkeypatch):
+    service = ForecastService(str(provide_local_config_path))
+    expected = service.create_forecasts([("1", "e5")])
+
+    # A load in progress does not block requests of loaded pairs, and concurrent requests of a pair load it once
+    loads = []
+    loading, release = threading.Event(), threading.Event()
+
+    def slow_load(**kwargs):
+        loads.append(kwargs["pairs"])
+        loading.set()
+        release.wait(timeout=10)
+        return load_stations_sortes(**kwargs)
+
+    monkeypatch.setattr(server, "load_stations_sortes", slow_load)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(service.create_forecasts([("2", "diesel")]))
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    assert loading.wait(timeout=10)
+    assert service.create_forecasts([("1", "e5")]) == expected
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert loads == [[("2", "diesel")]]
+    assert len(results) == 4 and all(result == results[0] for result in results)
+    assert len(service.frames) == 2
+    assert len(service.forecast.model_cache.models) == 2
+
+
+def test_load_config(provide_local_config_path, tmp_path, monkeypatch):
+    with open(provide_local_config_path) as file:
+        config_dict = yaml.safe_load(file)
+    config_path = tmp_path / "config.yaml"
+    with open(config_path, "w") as file:
+        yaml.safe_dump(config_dict, file)
+    snapshot_dir = str(tmp_path / "snapshots")
+
+    forecast = Forecast(str(config_path), config_snapshot_dir=snapshot_dir)
+    assert Forecast(str(config_path)).loaded_config is forecast.loaded_config
+    assert (
+        forecast.forecast_config.n_before == config_dict["forecast_config"]["n_before"]
+    )
+    assert get_snapshot_path(str(config_path), snapshot_dir).exists()
+
+    # A new process validates the snapshot instead of parsing the YAML
+    clear_config_cache()
+    with monkeypatch.context() as patch:
+        patch.setattr(yaml, "safe_load", None)
+        loaded = load_config(str(config_path), snapshot_dir=snapshot_dir)
+    assert loaded == forecast.loaded_config
+    assert loaded is not forecast.loaded_config
+
+    # An unchanged file is not reloaded, a changed one is, keeping the connection
+    assert not forecast.reload_config()
+    pandas_connection = forecast.pandas_connection
+    # A changed size is detected even where the modification time is coarse
+    config_dict["forecast_config"]["n_before"] = 100 * forecast.forecast_config.n_before
+    with open(config_path, "w") as file:
+        yaml.safe_dump(config_dict, file)
+    assert forecast.reload_config()
+    assert (
+        forecast.forecast_config.n_before == config_dict["forecast_config"]["n_before"]
+    )
+    assert forecast.pandas_connection is pandas_connection
+    assert not forecast.reload_config()
+    assert (
+        load_config(str(config_path), snapshot_dir=snapshot_dir).forecast_config
+        == forecast.forecast_config
+    )
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys; import tpa_analytics_engine.api; "
+        "print(sorted({'sklearn', 'cloud_storage_wrapper'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout
+    assert output.strip() == "[]"
@@ -1,7 +1,38 @@
+import subprocess
+import sys
+import types
+import warnings
+from datetime import date
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+import yaml  # type: ignore
+from pydantic import ValidationError
+from tpa_analytics_engine.api import Forecast
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.cache import Cache_Config
+from tpa_analytics_engine.data_handler.cache import CachedPandasConnection
+from tpa_analytics_engine.data_handler.cache import create_cached_connection
+from tpa_analytics_engine.data_handler.feature_store import FeatureStore
+from tpa_analytics_engine.data_handler import prepare_forecast_format
+from tpa_analytics_engine.data_handler.incremental import IncrementalFeatureBuilder
+from tpa_analytics_engine.data_handler.prepare_forecast_format import _add_pred_rows
 from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import COMPACT_DTYPES
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
 from tpa_analytics_engine.data_handler.prepare_forecast_format import (
     filter_n_days_before,
 )
+from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    load_stations_sortes,
+)
+from tpa_analytics_engine.data_handler.prepare_forecast_format import N_LAG_DAYS
+from tpa_analytics_engine.data_handler.streaming import iter_feature_frames
+from tpa_analytics_engine.data_handler.streaming import list_pairs
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+from tpa_analytics_engine.utils import get_rss_bytes
 
 
 def test_add_columns(provide_data_frame):
@@ -32,3 +63,439 @@ def test_filter_n_days_before(provide_data_frame, provide_data_config):
 
     assert len(df[provide_data_config.date_column].dt.date.unique()) == 10
     assert len(df_filtered[provide_data_config.date_column].dt.date.unique()) == 5
+
+
+def test_load_stations_sortes(provide_oci_pandas_config, provide_data_config):
+    pairs = [("9771", "diesel"), ("9771", "e5")]
+    df = load_stations_sortes(
+        pandas_connection=provide_oci_pandas_config,
+        data_config=provide_data_config,
+        pairs=pairs,
+        add_pred=False,
+    )
+    df_single = load_station_sorte(
+        pandas_connection=provide_oci_pandas_config,
+        data_config=provide_data_config,
+        station="9771",
+        sorte="e5",
+        add_pred=False,
+    )
+
+    assert list(df.groupby(["station", "sorte"], sort=False).groups) == pairs
+    assert df.query("sorte == 'e5'")["price"].tolist() == df_single["price"].tolist()
+
+    with pytest.raises(ValueError):
+        load_stations_sortes(
+            pandas_connection=provide_oci_pandas_config,
+            data_config=provide_data_config,
+            pairs=[],
+        )
+
+
+def test_add_columns_values():
+    df = (
+        make_wide_df(n_stations=1, n_days=400, sortes=["e5"], end=date(2024, 1, 10))
+        .rename(columns={"e5_0": "price"})
+        .dropna()
+        .reset_index(drop=True)
+    )
+    df_added = add_columns(df)
+    avg_daily_price = df.groupby(df["Day_Hours"].dt.date)["price"].mean()
+
+    assert "Day" not in df
+    assert (df_added["week"].astype(str) == df["Day_Hours"].dt.strftime("%Y-%W")).all()
+    assert (
+        df_added["hour_format"].astype(str)
+        == df["Day_Hours"].dt.time.astype(str).str[:5]
+    ).all()
+    assert (df_added["Day"].dt.date == df["Day_Hours"].dt.date).all()
+    assert df_added["trend"].max() == 399
+    assert df_added.loc[df_added.is_last == 1, "Day"].nunique() == 1
+    for lag in (1, 2, 3):
+        lagged = avg_daily_price.shift(lag).bfill()
+        assert (
+            df_added[f"avg_daily_price_lag{lag}"] == df["Day_Hours"].dt.date.map(lagged)
+        ).all()
+
+
+def test_add_pred_rows():
+    today = date.today()
+    df = (
+        make_wide_df(n_stations=1, n_days=30, sortes=["e5"], missing_share=0.0)
+        .rename(columns={"e5_0": "price"})
+        .query("Day_Hours.dt.date < @today")
+    )
+    last_week = df[df["Day_Hours"].dt.date == today - timedelta(days=7)]
+
+    # One day gets the times of the same day last week
+    df_pred = _add_pred_rows(df, date_column="Day_Hours")
+    pred = df_pred.iloc[len(df) :]
+    assert (pred["price"] == 0).all()
+    assert (
+        pred["Day_Hours"].to_numpy()
+        == (last_week["Day_Hours"] + timedelta(days=7)).to_numpy()
+    ).all()
+
+    # Several days repeat the last week, a frequency creates a regular grid
+    pred = _add_pred_rows(df, date_column="Day_Hours", horizon_days=10).iloc[len(df) :]
+    assert pred["Day_Hours"].dt.date.nunique() == 10
+    assert pred["Day_Hours"].is_monotonic_increasing
+    long_df = df.assign(series="e5_0")
+    pred = _add_pred_rows(
+        long_df, date_column="Day_Hours", horizon_days=2, pred_freq="1h"
+    ).iloc[len(df) :]
+    assert len(pred) == 48 and (pred["series"] == "e5_0").all()
+    assert list(pred.columns) == list(long_df.columns)
+
+    # All prediction days are flagged and their lags carry the last average price forward
+    df_added = add_columns(
+        _add_pred_rows(df, date_column="Day_Hours", horizon_days=3), horizon_days=3
+    )
+    pred = df_added[df_added.is_last == 1]
+    assert pred["Day"].nunique() == 3
+    last_avg = df.loc[df["Day_Hours"].dt.date == today - timedelta(days=1), "price"]
+    assert pred["avg_daily_price_lag1"].to_numpy() == pytest.approx(last_avg.mean())
+
+
+@pytest.mark.parametrize(
+    "today, hours",
+    [
+        # The clocks move from 02:00 to 03:00, so the day has no 02:00
+        (date(2024, 3, 31), [hour for hour in range(24) if hour != 2]),
+        # The clocks move from 03:00 back to 02:00, the times of last week keep their hour
+        (date(2024, 10, 27), list(range(24))),
+    ],
+)
+def test_add_pred_rows_dst(today, hours, monkeypatch):
+    class FixedDate(date):
+        @classmethod
+        def today(cls):
+            return today
+
+    monkeypatch.setattr(
+        prepare_forecast_format, "datetime", types.SimpleNamespace(date=FixedDate)
+    )
+    day_hours = pd.date_range(
+        end=pd.Timestamp(today) - pd.Timedelta(hours=1),
+        periods=14 * 24,
+        freq="h",
+    ).tz_localize("Europe/Berlin")
+    df = pd.DataFrame({"Day_Hours": day_hours, "price": 1.0})
+
+    pred = _add_pred_rows(df, date_column="Day_Hours").iloc[len(df) :]
+
+    assert (pred["Day_Hours"].dt.date == today).all()
+    assert pred["Day_Hours"].dt.hour.tolist() == hours
+    assert pred["Day_Hours"].is_unique
+
+
+def test_compact_dtype_policy():
+    df = (
+        make_wide_df(n_stations=1, n_days=60, sortes=["e5"])
+        .rename(columns={"e5_0": "price"})
+        .dropna()
+    )
+    df_default = add_columns(df)
+    df_compact = add_columns(df, dtype_policy="compact")
+
+    for column, dtype in COMPACT_DTYPES.items():
+        assert df_compact[column].dtype == dtype
+        assert df_compact[column].to_numpy() == pytest.approx(
+            df_default[column].to_numpy(), rel=1e-6
+        )
+    assert (
+        df_compact.memory_usage(deep=True).sum()
+        < 0.7 * df_default.memory_usage(deep=True).sum()
+    )
+
+    # The filtered df is independent of the passed df
+    df_filtered = filter_n_days_before(df_compact, n_before=10)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        df_filtered.loc[df_filtered.is_last == 1, "pred"] = 1.0
+    assert "pred" not in df_compact
+    assert df_filtered["Day"].nunique() == 10
+
+
+class CountingConnection:
+    def __init__(self, df):
+        self.df = df
+        self.calls = 0
+
+    def retrieve_df(self, path, df_format, columns=None):
+        self.calls += 1
+        return self.df[columns]
+
+
+def test_cached_pandas_connection(tmp_path, monkeypatch):
+    connection = CountingConnection(make_wide_df(n_stations=2, n_days=5))
+    file_size = len(connection.df) * 2 * 8
+    cached_connection = CachedPandasConnection(
+        pandas_connection=connection,
+        cache_config=Cache_Config(directory=str(tmp_path), max_bytes=3 * file_size),
+    )
+    columns = ["Day_Hours", "e5_0"]
+
+    df_first = cached_connection.retrieve_df("df.ftr", "ftr", columns)
+    df_second = cached_connection.retrieve_df("df.ftr", "ftr", columns)
+    assert connection.calls == 1
+    assert df_first.equals(df_second)
+
+    # A new version stamp is a cache miss
+    cached_connection.cache_config.version = "v2"
+    cached_connection.retrieve_df("df.ftr", "ftr", columns)
+    assert connection.calls == 2
+
+    # A configured version_stamp function is called with the connection and the path
+    stamps = {"df.ftr": "etag-1"}
+    connection.df_stamps = stamps
+    monkeypatch.setitem(
+        sys.modules,
+        "remote_stamps",
+        types.SimpleNamespace(
+            stamp=lambda pandas_connection, path: pandas_connection.df_stamps[path]
+        ),
+    )
+    stamped_connection = create_cached_connection(
+        pandas_connection=connection,
+        cache_config=Cache_Config(
+            directory=str(tmp_path / "stamped"), version_stamp="remote_stamps:stamp"
+        ),
+    )
+    stamped_connection.retrieve_df("df.ftr", "ftr", columns)
+    stamped_connection.retrieve_df("df.ftr", "ftr", columns)
+    assert connection.calls == 3
+    stamps["df.ftr"] = "etag-2"
+    stamped_connection.retrieve_df("df.ftr", "ftr", columns)
+    assert connection.calls == 4
+    with pytest.raises(ValidationError):
+        Cache_Config(directory=str(tmp_path), version_stamp="remote_stamps.stamp")
+
+    # The least recently used files are evicted beyond max_bytes
+    for column in ["e5_1", "diesel_0", "diesel_1", "e10_0"]:
+        cached_connection.retrieve_df("df.ftr", "ftr", ["Day_Hours", column])
+    assert len(list(tmp_path.glob("*.ftr"))) < 6
+    assert not (
+        tmp_path / f"{cached_connection.get_key('df.ftr', columns)}.ftr"
+    ).exists()
+
+
+@pytest.mark.parametrize("df_format", ["ftr", "parquet"])
+def test_arrow_file_source(provide_local_data_dir, df_format):
+    source = ArrowFileSource(str(provide_local_data_dir))
+    data_config = Data_Config(
+        df_path=f"BASE_df_wide.{df_format}",
+        df_format=df_format,
+        date_column="Day_Hours",
+    )
+    df_full = add_columns(
+        load_station_sorte(
+            pandas_connection=source,
+            data_config=data_config,
+            station="1",
+            sorte="e5",
+            add_pred=True,
+        )
+    )
+    df_window = add_columns(
+        load_station_sorte(
+            pandas_connection=source,
+            data_config=data_config,
+            station="1",
+            sorte="e5",
+            add_pred=True,
+            n_before=10,
+        )
+    )
+
+    assert df_window["Day"].nunique() == 10 + N_LAG_DAYS
+    assert list(df_window.columns) == list(df_full.columns)
+
+    # The features of the forecast window are identical up to the start of the trend
+    window_full = filter_n_days_before(df_full, 10).reset_index(drop=True)
+    window = filter_n_days_before(df_window, 10).reset_index(drop=True)
+    for column in window.columns.drop(["trend", "hour_format", "week"]):
+        assert window[column].equals(window_full[column])
+    assert window["week"].astype(str).equals(window_full["week"].astype(str))
+    assert (window_full["trend"] - window["trend"]).nunique() == 1
+
+    # An unknown station names its missing column
+    with pytest.raises(KeyError, match="e5_999"):
+        load_station_sorte(
+            pandas_connection=source,
+            data_config=data_config,
+            station="999",
+            sorte="e5",
+            n_before=10,
+        )
+
+
+@pytest.mark.parametrize(
+    "dtype_policy, horizon_days", [("default", 1), ("compact", 1), ("default", 3)]
+)
+def test_incremental_feature_builder(dtype_policy, horizon_days):
+    df = (
+        make_wide_df(n_stations=1, n_days=12, sortes=["e5"])
+        .rename(columns={"e5_0": "price"})
+        .dropna()
+        .reset_index(drop=True)
+    )
+    builder = IncrementalFeatureBuilder(
+        dtype_policy=dtype_policy, horizon_days=horizon_days
+    )
+    rows_per_day = df.groupby(df["Day_Hours"].dt.date).size().max()
+    # Start with less than N_LAG_DAYS days, split some days between updates and add single rows
+    bounds = [0, 30, 100, 101, 400, 401, 402, 450, len(df) - 1, len(df)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        n_days_before = len(builder.day_numbers)
+        df_new = builder.update(df.iloc[start:stop])
+        assert len(df_new) == stop - start
+        pd.testing.assert_frame_equal(
+            builder.to_frame(),
+            add_columns(
+                df.iloc[:stop],
+                dtype_policy=dtype_policy,
+                horizon_days=horizon_days,
+            ),
+        )
+        # Only the new rows and the rows of the previous prediction days are touched once the first days are complete
+        if n_days_before > N_LAG_DAYS + horizon_days:
+            assert builder.n_computed_rows <= stop - start + horizon_days * rows_per_day
+
+    with pytest.raises(ValueError):
+        builder.update(df.iloc[:10])
+
+
+def test_feature_store(provide_config, tmp_path):
+    make_wide_df(n_stations=2, n_days=30).to_feather(tmp_path / "BASE_df_wide.ftr")
+    config = {
+        **provide_config,
+        "data_config": {
+            "df_path": "BASE_df_wide.ftr",
+            "df_format": "ftr",
+            "date_column": "Day_Hours",
+            "local_dir": str(tmp_path),
+            "feature_store": {"directory": str(tmp_path / "features")},
+        },
+    }
+    config_path = tmp_path / "config.yaml"
+    with open(config_path, "w") as file:
+        yaml.safe_dump(config, file)
+    forecast = Forecast(str(config_path))
+    n_before = forecast.forecast_config.n_before
+
+    forecast.load_df(station="1", sorte="e5")
+    expected = add_columns(
+        load_station_sorte(
+            pandas_connection=forecast.pandas_connection,
+            data_config=forecast.data_config,
+            station="1",
+            sorte="e5",
+        )
+    )
+    pd.testing.assert_frame_equal(forecast.df, expected)
+    stored_file = tmp_path / "features" / "e5" / "1.ftr"
+    mtime_ns = stored_file.stat().st_mtime_ns
+
+    # A forecast of the stored window is a lookup without rebuilding the features
+    forecast.load_df(station="1", sorte="e5", only_forecast_window=True)
+    pd.testing.assert_frame_equal(
+        forecast.df,
+        filter_n_days_before(expected, n_before=n_before).reset_index(drop=True),
+    )
+    assert stored_file.stat().st_mtime_ns == mtime_ns
+    forecast_df = forecast.create_forecast()
+    assert forecast_df.loc[forecast_df.is_last == 1, "pred"].notna().all()
+
+    # New raw data invalidates the stored features
+    make_wide_df(n_stations=2, n_days=31, seed=1).to_feather(
+        tmp_path / "BASE_df_wide.ftr"
+    )
+    forecast.load_df(station="1", sorte="e5")
+    assert forecast.df["price"].iloc[0] != expected["price"].iloc[0]
+    assert stored_file.stat().st_mtime_ns != mtime_ns
+
+    store = FeatureStore(forecast.data_config.feature_store)
+    assert list(store.read_index()) == ["e5/1.ftr"]
+    assert list(store.read("1", "e5", columns=["price"]).columns) == ["price"]
+    store.invalidate()
+    assert store.read_index() == {} and not stored_file.exists()
+    with pytest.raises(KeyError):
+        store.read("1", "e5")
+
+
+def test_iter_feature_frames(provide_local_data_dir):
+    source = ArrowFileSource(str(provide_local_data_dir))
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+    )
+    pairs = list_pairs(source=source, data_config=data_config)
+    assert len(pairs) == 15 and ("0", "diesel") in pairs
+
+    long_df = load_stations_sortes(
+        pandas_connection=source, data_config=data_config, pairs=pairs
+    )
+    streamed = list(
+        iter_feature_frames(
+            pandas_connection=source, data_config=data_config, batch_size=4
+        )
+    )
+    assert [pair for pair, _ in streamed] == pairs
+    for ((station, sorte), df), (_, series_df) in zip(
+        streamed, long_df.groupby(["station", "sorte"], sort=False)
+    ):
+        pd.testing.assert_frame_equal(
+            df,
+            add_columns(
+                series_df.drop(columns=["station", "sorte"]).reset_index(drop=True)
+            ),
+        )
+
+    with pytest.raises(ValueError):
+        next(iter_feature_frames(source, data_config, batch_size=0))
+
+
+STREAMING_RSS_CODE = """
+import sys, threading
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.data_handler.streaming import iter_feature_frames
+from tpa_analytics_engine.utils import get_rss_bytes
+
+data_config = Data_Config(df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours")
+peak, stop = [0], threading.Event()
+
+def sample():
+    while not stop.wait(0.001):
+        peak[0] = max(peak[0], get_rss_bytes())
+
+base = get_rss_bytes()
+sampler = threading.Thread(target=sample)
+sampler.start()
+for _ in iter_feature_frames(ArrowFileSource(sys.argv[1]), data_config, batch_size=6):
+    pass
+stop.set()
+sampler.join()
+print(peak[0] - base)
+"""
+
+
+@pytest.mark.skipif(get_rss_bytes() == 0, reason="The RSS is not available.")
+def test_streaming_peak_rss_is_flat(tmp_path):
+    peaks = {}
+    for n_stations in [10, 80]:
+        directory = tmp_path / str(n_stations)
+        directory.mkdir()
+        make_wide_df(n_stations=n_stations, n_days=120).to_feather(
+            directory / "BASE_df_wide.ftr"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", STREAMING_RSS_CODE, str(directory)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        peaks[n_stations] = int(output.strip().splitlines()[-1])
+
+    # The input grows 8 times, loading it at once grows the peak about 6 times
+    assert peaks[80] < 2 * peaks[10] + 2**20
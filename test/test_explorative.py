@@ -1,6 +1,9 @@
+import pandas as pd
 import pytest
+from tpa_analytics_engine.api import Forecast
 from tpa_analytics_engine.explorative.summaries import mean_centralize
 from tpa_analytics_engine.explorative.summaries import summarize
+from tpa_analytics_engine.explorative.summaries import summarize_many
 
 # from tpa_analytics_engine.explorative.summaries import extract_time
 
@@ -46,6 +49,67 @@ def test_mean_centralize(provide_data_frame_transformed):
     assert abs(test_df_summarized_centralized.mean()) < 0.1
 
 
+def test_summarize_many(provide_local_config_path):
+    forecast = Forecast(str(provide_local_config_path))
+    forecast.load_dfs(pairs=[("0", "e5"), ("1", "e5"), ("1", "diesel")])
+    summaries = forecast.create_batch_summaries(
+        groupCols=["day_of_week", "hour", "trend"],
+        aggregations=["mean", "median", "count"],
+        quantiles=[0.1, 0.9],
+    )
+    history_df = forecast.long_df.query("is_last == 0")
+
+    for groupCol in ["day_of_week", "hour", "trend"]:
+        grouped = history_df.groupby(["station", "sorte", groupCol], observed=True)[
+            "price"
+        ]
+        summary = summaries[groupCol]
+        expected = grouped.mean()
+        assert summary.index.names == ["station", "sorte", groupCol]
+        assert len(summary) == len(expected)
+        summary = summary.loc[expected.index]
+        assert summary["mean"].to_numpy() == pytest.approx(expected.to_numpy())
+        assert summary["median"].to_numpy() == pytest.approx(
+            grouped.median().to_numpy()
+        )
+        assert summary["q0.1"].to_numpy() == pytest.approx(
+            grouped.quantile(0.1).to_numpy()
+        )
+        assert (summary["count"].to_numpy() == grouped.size().to_numpy()).all()
+
+    centralized = forecast.create_batch_summaries(
+        groupCols=["hour"], centralize_mean=True
+    )["hour"].sort_index()
+    for (station, sorte), series_df in history_df.groupby(
+        ["station", "sorte"], sort=False
+    ):
+        expected = mean_centralize(
+            summarize(series_df, groupCol="hour", aggCol="price")
+        )
+        assert centralized.loc[(station, sorte), "mean"].to_numpy() == pytest.approx(
+            expected.to_numpy()
+        )
+
+    # A df of one series
+    single = summarize_many(
+        history_df[history_df.sorte == "diesel"],
+        groupCols=["day_of_week"],
+        series_columns=(),
+    )["day_of_week"]
+    pd.testing.assert_series_equal(
+        single["mean"],
+        summarize(
+            history_df[history_df.sorte == "diesel"],
+            groupCol="day_of_week",
+            aggCol="price",
+        ),
+        check_names=False,
+    )
+
+    with pytest.raises(ValueError):
+        summarize_many(history_df, groupCols=["hour"], aggregations=["max"])
+
+
 # def test_extract_time(provide_data_frame_transformed, provide_data_config):
 #     assert (
 #         provide_data_frame_transformed[provide_data_config.date_column].dtype
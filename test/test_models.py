@@ -1,10 +1,59 @@
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
+import numpy as np
+import pandas as pd
 import pytest
+import yaml  # type: ignore
 from pydantic import ValidationError
+from sklearn.ensemble import HistGradientBoostingRegressor
+from tpa_analytics_engine.api import Forecast
+from tpa_analytics_engine.data_handler.arrow_source import ArrowFileSource
+from tpa_analytics_engine.data_handler.prepare_forecast_format import add_columns
+from tpa_analytics_engine.data_handler.prepare_forecast_format import Data_Config
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    filter_n_days_before,
+)
+from tpa_analytics_engine.data_handler.prepare_forecast_format import load_station_sorte
+from tpa_analytics_engine.data_handler.prepare_forecast_format import (
+    load_stations_sortes,
+)
+from tpa_analytics_engine.data_handler.streaming import iter_feature_frames
+from tpa_analytics_engine.data_handler.synthetic import make_wide_df
+from tpa_analytics_engine.models import models_config
+from tpa_analytics_engine.models.backtest import backtest
+from tpa_analytics_engine.models.backtest import backtest_metrics
+from tpa_analytics_engine.models.export import CompiledEnsemble
+from tpa_analytics_engine.models.export import export_estimator
+from tpa_analytics_engine.models.export import load_exported
+from tpa_analytics_engine.models.export import predict_exported
+from tpa_analytics_engine.models.fast_estimators import Ridge
 from tpa_analytics_engine.models.make_forecast import run
+from tpa_analytics_engine.models.model_cache import ModelCache
 from tpa_analytics_engine.models.models_config import create_forecast_config
+from tpa_analytics_engine.models.models_config import Estimator_Config
+from tpa_analytics_engine.models.models_config import estimator_dict
+from tpa_analytics_engine.models.models_config import Executor_Config
+from tpa_analytics_engine.models.models_config import Export_Config
+from tpa_analytics_engine.models.models_config import get_estimator_class
+from tpa_analytics_engine.models.models_config import Model_Cache_Config
+from tpa_analytics_engine.models.models_config import Selection_Config
+from tpa_analytics_engine.models.models_config import Tuning_Config
+from tpa_analytics_engine.models.multi_horizon import build_horizon_features
+from tpa_analytics_engine.models.parallel import forecast_sklearn_many
+from tpa_analytics_engine.models.selection import Candidate_Score
+from tpa_analytics_engine.models.selection import candidate_config
+from tpa_analytics_engine.models.selection import choose_candidate
+from tpa_analytics_engine.models.selection import clear_selection_cache
+from tpa_analytics_engine.models.selection import select_estimator
 from tpa_analytics_engine.models.sklearn import forecast_sklearn
+from tpa_analytics_engine.models.sklearn import predict_last
+from tpa_analytics_engine.models import tuning
+from tpa_analytics_engine.models.tuning import create_trials
+from tpa_analytics_engine.models.tuning import tune
+from tpa_analytics_engine.models.tuning import tuned_config_block
 
 
 def test_create_forecast_config(provide_config):
@@ -49,3 +98,792 @@ def test_forecast_sklearn(provide_forecast_config, provide_data_frame_transforme
     assert forecast_df.loc[forecast_df.is_last == 0, "pred"].isna().sum() == len(
         forecast_df.query("is_last == 0")
     )
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_forecast_sklearn_many(
+    provide_forecast_config, provide_data_frame_transformed, backend
+):
+    dfs = [provide_data_frame_transformed.copy() for _ in range(3)]
+    serial_dfs = forecast_sklearn_many(
+        dfs=[df.copy() for df in dfs], forecast_config=provide_forecast_config
+    )
+    parallel_config = provide_forecast_config.model_copy(
+        update={"executor": Executor_Config(backend=backend, n_jobs=2, chunk_size=2)}
+    )
+    parallel_dfs = forecast_sklearn_many(dfs=dfs, forecast_config=parallel_config)
+
+    assert len(parallel_dfs) == len(serial_dfs)
+    for serial_df, parallel_df in zip(serial_dfs, parallel_dfs):
+        assert serial_df["pred"].equals(parallel_df["pred"])
+
+    with pytest.raises(ValidationError):
+        Executor_Config(backend=backend, n_jobs=0)
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_forecast_sklearn_many_options(
+    provide_forecast_config, provide_local_data_dir, tmp_path, backend
+):
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+    )
+    dfs = [
+        filter_n_days_before(
+            add_columns(
+                load_station_sorte(
+                    pandas_connection=ArrowFileSource(str(provide_local_data_dir)),
+                    data_config=data_config,
+                    station=station,
+                    sorte="e5",
+                )
+            ),
+            n_before=20,
+        )
+        for station in ["1", "2", "3"]
+    ]
+    series_ids = ["e5_1", "e5_2", "e5_3"]
+
+    def forecast(backend, directory, model_cache=None):
+        forecast_config = provide_forecast_config.model_copy(
+            update={
+                "executor": Executor_Config(backend=backend, n_jobs=2, chunk_size=2),
+                "export": Export_Config(directory=str(directory)),
+            }
+        )
+        return forecast_sklearn_many(
+            dfs=[df.copy() for df in dfs],
+            forecast_config=forecast_config,
+            model_cache=model_cache,
+            series_ids=series_ids,
+        )
+
+    # The parallel fits export the same models as the serial ones under the series ids
+    serial_dfs = forecast("serial", tmp_path / "serial")
+    parallel_dfs = forecast(backend, tmp_path / "parallel")
+    for serial_df, parallel_df, series_id in zip(serial_dfs, parallel_dfs, series_ids):
+        np.testing.assert_array_equal(serial_df["pred"], parallel_df["pred"])
+        np.testing.assert_array_equal(
+            predict_exported(
+                df=serial_df, directory=str(tmp_path / "serial"), series_id=series_id
+            ),
+            predict_exported(
+                df=parallel_df,
+                directory=str(tmp_path / "parallel"),
+                series_id=series_id,
+            ),
+        )
+
+    # The model cache is honored by every backend
+    model_cache = ModelCache(Model_Cache_Config())
+    cached_dfs = forecast(backend, tmp_path / "cached", model_cache=model_cache)
+    assert len(model_cache.models) == len(dfs)
+    for serial_df, cached_df in zip(serial_dfs, cached_dfs):
+        np.testing.assert_array_equal(serial_df["pred"], cached_df["pred"])
+    with pytest.raises(ValueError):
+        forecast_sklearn_many(
+            dfs=dfs, forecast_config=provide_forecast_config, series_ids=["e5_1"]
+        )
+
+
+def test_model_cache(provide_forecast_config, tmp_path):
+    raw_df = (
+        make_wide_df(n_stations=1, n_days=12, sortes=["e5"])
+        .rename(columns={"e5_0": "price"})
+        .dropna()
+        .reset_index(drop=True)
+    )
+    days = raw_df["Day_Hours"].dt.normalize()
+    window_df = filter_n_days_before(add_columns(raw_df[days < days.max()]), n_before=8)
+    slid_window_df = filter_n_days_before(add_columns(raw_df), n_before=8)
+    model_cache = ModelCache(
+        Model_Cache_Config(max_models=2, directory=str(tmp_path), warm_start_iter=5)
+    )
+
+    forecast_df = forecast_sklearn(
+        df=window_df.copy(), forecast_config=provide_forecast_config
+    )
+    cached_forecast_df = forecast_sklearn(
+        df=window_df.copy(),
+        forecast_config=provide_forecast_config,
+        model_cache=model_cache,
+        series_id="e5_0",
+    )
+    assert cached_forecast_df["pred"].equals(forecast_df["pred"])
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+
+    # A second call with the same training data does not fit again
+    with patch.object(HistGradientBoostingRegressor, "fit") as fit:
+        forecast_sklearn(
+            df=window_df.copy(),
+            forecast_config=provide_forecast_config,
+            model_cache=model_cache,
+            series_id="e5_0",
+        )
+        fit.assert_not_called()
+
+    # The window slid forward, so the latest estimator is refitted with warm_start
+    forecast_sklearn(
+        df=slid_window_df.copy(),
+        forecast_config=provide_forecast_config,
+        model_cache=model_cache,
+        series_id="e5_0",
+    )
+    n_iters = [estimator.n_iter_ for estimator in model_cache.models.values()]
+    assert len(n_iters) == 2
+    assert n_iters[1] == n_iters[0] + 5
+    assert model_cache.models[next(reversed(model_cache.models))].warm_start
+
+    # Other library versions are a cache miss, and the disk is bounded by max_bytes
+    old_files = set(tmp_path.glob("*.pkl"))
+    model_size = max(file.stat().st_size for file in old_files)
+    upgraded_cache = ModelCache(
+        Model_Cache_Config(directory=str(tmp_path), max_bytes=2 * model_size)
+    )
+    with patch(
+        "tpa_analytics_engine.models.model_cache.library_versions",
+        return_value="scikit-learn=0.0",
+    ):
+        forecast_sklearn(
+            df=window_df.copy(),
+            forecast_config=provide_forecast_config,
+            model_cache=upgraded_cache,
+            series_id="e5_0",
+        )
+    new_files = set(tmp_path.glob("*.pkl"))
+    assert len(new_files - old_files) == 1
+    assert len(new_files) == 2
+
+
+def test_forecast_global(provide_forecast_config, provide_local_data_dir):
+    long_df = load_stations_sortes(
+        pandas_connection=ArrowFileSource(str(provide_local_data_dir)),
+        data_config=Data_Config(
+            df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+        ),
+        pairs=[("0", "e5"), ("1", "e5"), ("1", "diesel")],
+    )
+    long_df = pd.concat(
+        [
+            filter_n_days_before(add_columns(series_df.reset_index(drop=True)), 20)
+            for _, series_df in long_df.groupby(["station", "sorte"], sort=False)
+        ],
+        ignore_index=True,
+    )
+    global_config = provide_forecast_config.model_copy(update={"mode": "global"})
+
+    forecast_df = run(df=long_df, forecast_config=global_config)
+
+    assert forecast_df.loc[forecast_df.is_last == 0, "pred"].isna().all()
+    assert forecast_df.loc[forecast_df.is_last == 1, "pred"].notna().all()
+    assert (
+        forecast_df[forecast_df.is_last == 1]
+        .groupby(["station", "sorte"])["pred"]
+        .mean()
+        .between(1, 3)
+        .all()
+    )
+
+    with pytest.raises(ValueError, match="series columns"):
+        run(df=long_df.drop(columns="sorte"), forecast_config=global_config)
+    # The single-series APIs reject the "global" mode instead of silently fitting local estimators
+    series_df = long_df[long_df.station == "0"].drop(columns=["station", "sorte"])
+    with pytest.raises(ValueError, match='"global" mode'):
+        forecast_sklearn(df=series_df.copy(), forecast_config=global_config)
+    with pytest.raises(ValueError, match='"global" mode'):
+        predict_last(df=series_df, forecast_config=global_config)
+    with pytest.raises(ValueError, match='"global" mode'):
+        forecast_sklearn_many(dfs=[series_df], forecast_config=global_config)
+
+
+def test_forecast_multi_horizon(provide_forecast_config, provide_local_data_dir):
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr",
+        df_format="ftr",
+        date_column="Day_Hours",
+        horizon_days=7,
+    )
+    df = filter_n_days_before(
+        add_columns(
+            load_station_sorte(
+                pandas_connection=ArrowFileSource(str(provide_local_data_dir)),
+                data_config=data_config,
+                station="1",
+                sorte="e5",
+            ),
+            horizon_days=7,
+        ),
+        n_before=27,
+    )
+    exogenous_vars = provide_forecast_config.estimators["sklearn"][
+        "estimator1"
+    ].exogenous_vars
+
+    # The training copy of horizon h has the lags of h further days
+    X_train_by_horizon, _, X_pred, horizons = build_horizon_features(
+        df=df, exogenous_vars=exogenous_vars
+    )
+    assert len(X_train_by_horizon) == 7 and set(horizons) == set(range(7))
+    pd.testing.assert_frame_equal(
+        X_train_by_horizon[0], df.loc[df.is_last == 0, exogenous_vars]
+    )
+    assert (
+        X_train_by_horizon[2]["avg_daily_price_lag1"]
+        .iloc[200:]
+        .equals(X_train_by_horizon[0]["avg_daily_price_lag3"].iloc[200:])
+    )
+
+    # The first horizon of the direct models equals the single day forecast
+    first_day = df[(df.is_last == 0) | (df.Day == df.loc[df.is_last == 1, "Day"].min())]
+    single = forecast_sklearn(
+        df=first_day.copy(), forecast_config=provide_forecast_config
+    )
+    for horizon_mode in ["pooled", "direct"]:
+        forecast_df = run(
+            df=df.copy(),
+            forecast_config=provide_forecast_config.model_copy(
+                update={"horizon_mode": horizon_mode}
+            ),
+        )
+        pred = forecast_df.loc[forecast_df.is_last == 1, "pred"]
+        assert pred.notna().all() and pred.between(1, 3).all()
+        assert forecast_df.loc[forecast_df.is_last == 1, "Day"].nunique() == 7
+    assert forecast_df.loc[
+        single.index[single.is_last == 1], "pred"
+    ].to_numpy().tolist() == pytest.approx(
+        single.loc[single.is_last == 1, "pred"].tolist()
+    )
+
+    with pytest.raises(ValidationError):
+        create_forecast_config(
+            {
+                "forecast_config": {
+                    **provide_forecast_config.model_dump(),
+                    "mode": "global",
+                    "horizon_mode": "pooled",
+                }
+            }
+        )
+
+
+@pytest.fixture(scope="module")
+def provide_local_window_df(provide_local_data_dir):
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+    )
+    return filter_n_days_before(
+        add_columns(
+            load_station_sorte(
+                pandas_connection=ArrowFileSource(str(provide_local_data_dir)),
+                data_config=data_config,
+                station="1",
+                sorte="e5",
+            )
+        ),
+        n_before=20,
+    )
+
+
+@pytest.fixture(scope="module")
+def provide_fast_forecast_config(provide_forecast_config):
+    exogenous_vars = provide_forecast_config.estimators["sklearn"][
+        "estimator1"
+    ].exogenous_vars
+    return provide_forecast_config.model_copy(
+        update={
+            "estimators": {
+                **provide_forecast_config.estimators,
+                "numpy": {
+                    name: Estimator_Config(
+                        estimator_type=estimator_type,
+                        estimator_kwargs={},
+                        exogenous_vars=exogenous_vars,
+                    )
+                    for name, estimator_type in [
+                        ("naive", "SeasonalNaive"),
+                        ("profile", "WeightedProfile"),
+                        ("ridge", "Ridge"),
+                    ]
+                },
+            }
+        }
+    )
+
+
+def test_fast_estimators(provide_fast_forecast_config, provide_local_window_df):
+    df = provide_local_window_df
+    for estimator in ["naive", "profile", "ridge"]:
+        forecast_df = run(
+            df=df.copy(),
+            forecast_config=provide_fast_forecast_config.model_copy(
+                update={"use_estimator_class": "numpy", "use_estimator": estimator}
+            ),
+        )
+        pred = forecast_df.loc[forecast_df.is_last == 1, "pred"]
+        assert pred.notna().all() and pred.between(1, 3).all()
+        if estimator == "naive":
+            # The prediction rows repeat the prices of the same times last week
+            last_week = df.set_index("Day_Hours")["price"]
+            assert pred.to_numpy() == pytest.approx(
+                last_week.loc[
+                    forecast_df.loc[forecast_df.is_last == 1, "Day_Hours"]
+                    - pd.Timedelta(days=7)
+                ].to_numpy()
+            )
+
+    # The ridge without penalty is the least squares fit
+    X = df[["avg_daily_price_lag1", "trend", "day_of_week", "hour"]]
+    ridge = Ridge(alpha=1e-9).fit(X, df["price"])
+    design = pd.get_dummies(X, columns=["day_of_week", "hour"], dtype=float)
+    design["intercept"] = 1.0
+    coef = np.linalg.lstsq(design.to_numpy(), df["price"].to_numpy(), rcond=None)[0]
+    assert ridge.predict(X) == pytest.approx(design.to_numpy() @ coef, abs=1e-6)
+    assert ridge.set_params(alpha=2.0).get_params() == {
+        "alpha": 2.0,
+        "one_hot_columns": ("day_of_week", "hour"),
+    }
+    with pytest.raises(ValueError):
+        ridge.set_params(foo=1)
+
+
+def test_estimator_selection(provide_fast_forecast_config, provide_local_window_df):
+    candidates = ["numpy.naive", "numpy.profile", "sklearn.estimator1"]
+    selection_config = create_forecast_config(
+        {
+            "forecast_config": {
+                **provide_fast_forecast_config.model_dump(),
+                "selection": {"candidates": candidates, "tolerance": 0.0},
+            }
+        }
+    )
+    candidate, scores = select_estimator(
+        df=provide_local_window_df, forecast_config=selection_config
+    )
+    assert [score.candidate for score in scores] == candidates
+    assert candidate == min(scores, key=lambda score: score.mae).candidate
+
+    # With a large tolerance the candidate with the shortest fit is selected
+    tolerant_config = selection_config.model_copy(
+        update={
+            "selection": selection_config.selection.model_copy(
+                update={"tolerance": 10.0}
+            )
+        }
+    )
+    clear_selection_cache()
+    model_cache = ModelCache(Model_Cache_Config())
+    forecast_df = forecast_sklearn(
+        df=provide_local_window_df.copy(),
+        forecast_config=tolerant_config,
+        model_cache=model_cache,
+        series_id="e5_1",
+    )
+    assert forecast_df.attrs["estimator"] != "sklearn.estimator1"
+    assert model_cache.selections["e5_1"][0] == forecast_df.attrs["estimator"]
+    assert forecast_df.loc[forecast_df.is_last == 1, "pred"].notna().all()
+    # A new selection forecasts like forecast_sklearn() with the selected candidate fitted on all training rows
+    candidate_df = forecast_sklearn(
+        df=provide_local_window_df.copy(),
+        forecast_config=candidate_config(
+            tolerant_config, forecast_df.attrs["estimator"]
+        ),
+    )
+    pd.testing.assert_series_equal(forecast_df["pred"], candidate_df["pred"])
+    assert len(model_cache.models) == 1
+    for candidate in ["numpy.profile", "sklearn.estimator1"]:
+        single_config = selection_config.model_copy(
+            update={
+                "selection": selection_config.selection.model_copy(
+                    update={"candidates": [candidate]}
+                )
+            }
+        )
+        pd.testing.assert_series_equal(
+            forecast_sklearn(
+                df=provide_local_window_df.copy(), forecast_config=single_config
+            )["pred"],
+            forecast_sklearn(
+                df=provide_local_window_df.copy(),
+                forecast_config=candidate_config(single_config, candidate),
+            )["pred"],
+        )
+
+    # The selection of the series is reused, and without a model cache by the fingerprint of the training rows
+    with patch("tpa_analytics_engine.models.selection.select_estimator") as select:
+        for cache in [model_cache, None]:
+            cached_df = forecast_sklearn(
+                df=provide_local_window_df.copy(),
+                forecast_config=tolerant_config,
+                model_cache=cache,
+                series_id="e5_1",
+            )
+            pd.testing.assert_series_equal(cached_df["pred"], forecast_df["pred"])
+    select.assert_not_called()
+    changed_df = provide_local_window_df.copy()
+    changed_df.iloc[0, changed_df.columns.get_loc("price")] += 1.0
+    with patch(
+        "tpa_analytics_engine.models.selection.select_estimator",
+        wraps=select_estimator,
+    ) as select:
+        forecast_sklearn(df=changed_df, forecast_config=tolerant_config)
+    select.assert_called_once()
+
+    # Candidates without a validation error are only chosen if no candidate has one, ties keep the order of the candidates
+    scores = [
+        Candidate_Score(candidate="numpy.naive", mae=np.nan, fit_seconds=0.0),
+        Candidate_Score(candidate="numpy.profile", mae=2.0, fit_seconds=0.1),
+        Candidate_Score(candidate="sklearn.estimator1", mae=2.0, fit_seconds=0.1),
+    ]
+    assert choose_candidate(scores, tolerance=0.0) == "numpy.profile"
+    assert choose_candidate(scores[:1], tolerance=0.0) == "numpy.naive"
+    nan_df = provide_local_window_df.copy()
+    train_days = np.unique(nan_df.loc[nan_df.is_last == 0, "Day"])
+    nan_df.loc[(nan_df.is_last == 0) & (nan_df.Day >= train_days[-2]), "price"] = np.nan
+    candidate, scores = select_estimator(df=nan_df, forecast_config=selection_config)
+    assert candidate == candidates[0]
+    assert all(score.mae == np.inf for score in scores)
+
+    with pytest.raises(ValidationError):
+        create_forecast_config(
+            {
+                "forecast_config": {
+                    **provide_fast_forecast_config.model_dump(),
+                    "selection": {"candidates": ["numpy.foo"]},
+                }
+            }
+        )
+
+
+def test_estimator_entry_points(tmp_path, monkeypatch):
+    (tmp_path / "my_plugin.py").write_text(
+        "class MeanEstimator:\n"
+        "    def fit(self, X, y):\n"
+        "        self.mean_ = y.mean()\n"
+        "        return self\n"
+    )
+    dist_info = tmp_path / "my_plugin-0.1.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: my-plugin\nVersion: 0.1\n"
+    )
+    (dist_info / "entry_points.txt").write_text(
+        "[tpa_analytics_engine.estimators]\nplugin.Mean = my_plugin:MeanEstimator\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(models_config, "_entry_points_loaded", False)
+    monkeypatch.setitem(estimator_dict, "plugin", {})
+
+    estimator_class = get_estimator_class("plugin", "Mean")
+    assert estimator_class.__name__ == "MeanEstimator"
+    assert estimator_dict["plugin"]["Mean"] is estimator_class
+    with pytest.raises(ValueError):
+        get_estimator_class("plugin", "Median")
+
+
+def test_backtest(provide_forecast_config, provide_local_data_dir):
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+    )
+    frames = [
+        (
+            (station, "e5"),
+            add_columns(
+                load_station_sorte(
+                    pandas_connection=ArrowFileSource(str(provide_local_data_dir)),
+                    data_config=data_config,
+                    station=station,
+                    sorte="e5",
+                    add_pred=False,
+                )
+            ),
+        )
+        for station in ["0", "1"]
+    ]
+    predictions = backtest(
+        frames=frames, forecast_config=provide_forecast_config, n_cutoffs=5
+    )
+    assert predictions.groupby(["station", "cutoff"]).ngroups == 10
+    assert (predictions["horizon"] == 0).all()
+
+    # A cutoff equals the forecast of the day with the n_before days up to it
+    df = frames[1][1]
+    cutoff = predictions["cutoff"].max()
+    window_df = filter_n_days_before(
+        df[df["Day"] <= cutoff], n_before=provide_forecast_config.n_before
+    )
+    window_df["is_last"] = (window_df["Day"] == cutoff).astype(int)
+    expected = forecast_sklearn(df=window_df, forecast_config=provide_forecast_config)
+    actual = predictions[(predictions.station == "1") & (predictions.cutoff == cutoff)]
+    assert actual["pred"].to_numpy() == pytest.approx(
+        expected.loc[expected.is_last == 1, "pred"].to_numpy()
+    )
+
+    # Several horizons, a thread executor and the path through forecast_sklearn()
+    threaded = backtest(
+        frames=frames,
+        forecast_config=provide_forecast_config.model_copy(
+            update={"executor": Executor_Config(backend="thread", n_jobs=2)}
+        ),
+        n_cutoffs=3,
+        horizon_days=3,
+        cutoff_chunk_size=2,
+    )
+    pooled = backtest(
+        frames=frames,
+        forecast_config=provide_forecast_config.model_copy(
+            update={"horizon_mode": "pooled"}
+        ),
+        n_cutoffs=3,
+        horizon_days=3,
+    )
+    assert set(threaded["horizon"]) == {0, 1, 2}
+    assert len(pooled) == len(threaded) and pooled["pred"].notna().all()
+
+    metrics = backtest_metrics(threaded)
+    assert len(metrics) == 6 and (metrics["n"] > 0).all()
+    assert metrics["mae"].between(0, 0.5).all()
+    assert (metrics["rmse"] >= metrics["mae"]).all()
+    assert list(backtest_metrics(threaded, by=["horizon"]).index) == [0, 1, 2]
+
+    with pytest.raises(ValueError):
+        backtest(frames=frames, forecast_config=provide_forecast_config, n_cutoffs=0)
+
+
+def test_tune(
+    provide_fast_forecast_config, provide_local_config_path, provide_local_window_df
+):
+    forecast = Forecast(provide_local_config_path)
+    forecast.forecast_config = provide_fast_forecast_config.model_copy(
+        update={"executor": Executor_Config(backend="process", n_jobs=2)}
+    )
+    tuning_config = Tuning_Config(
+        candidates=["numpy.ridge", "numpy.profile"],
+        estimator_kwargs={
+            "numpy.ridge": {"alpha": [0.1, 1.0, 10.0]},
+            "numpy.profile": {"halflife_days": [3.0, 14.0]},
+        },
+        n_before=[10, 20],
+        n_stations=3,
+        n_cutoffs=9,
+    )
+    result = forecast.tune(tuning_config=tuning_config)
+
+    # Successive halving evaluates 10 trials on 1 cutoff, the best 4 on 3 and the best 2 on 9
+    assert len(result.trials) == 10
+    assert [trial.n_cutoffs for trial in result.trials].count(9) == 2
+    assert [trial.n_cutoffs for trial in result.trials].count(3) == 2
+    assert result.best == result.trials[0] and result.best.n_cutoffs == 9
+    assert result.best.mae <= result.trials[1].mae
+
+    # The error of the best trial is that of its backtest on the sampled series
+    assert len(result.series) == 3
+    frames = [
+        frame
+        for frame in iter_feature_frames(
+            pandas_connection=forecast.pandas_connection,
+            data_config=forecast.data_config,
+            add_pred=False,
+        )
+        if frame[0] in result.series
+    ]
+    block = tuned_config_block(
+        forecast_config=forecast.forecast_config, trial=result.best
+    )
+    tuned_config = create_forecast_config(yaml.safe_load(yaml.safe_dump(block)))
+    assert tuned_config.use_estimator == "tuned"
+    assert tuned_config.n_before == result.best.n_before
+    assert (
+        tuned_config.estimators["numpy"]["tuned"].estimator_kwargs
+        == result.best.estimator_config.estimator_kwargs
+    )
+    predictions = backtest(frames=frames, forecast_config=tuned_config, n_cutoffs=9)
+    assert len(predictions) == result.best.n
+    assert result.best.mae == pytest.approx(
+        (predictions["pred"] - predictions["price"]).abs().mean()
+    )
+
+    # Concurrent searches on threads do not share their series
+    thread_config = forecast.forecast_config.model_copy(
+        update={"executor": Executor_Config(backend="thread", n_jobs=2)}
+    )
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [
+            pool.submit(
+                tune,
+                frames=series_frames,
+                forecast_config=thread_config,
+                tuning_config=tuning_config,
+            )
+            for series_frames in [frames, frames[:1]]
+        ]
+        results = [future.result() for future in futures]
+    assert results[0].best == result.best
+    assert results[1].series == result.series[:1]
+    assert tuning._series == []
+
+    # A selection of the base config is dropped, so the block forecasts with the tuned estimator
+    selected_block = tuned_config_block(
+        forecast_config=forecast.forecast_config.model_copy(
+            update={"selection": Selection_Config(candidates=["numpy.profile"])}
+        ),
+        trial=result.best,
+    )
+    selected_config = create_forecast_config(
+        yaml.safe_load(yaml.safe_dump(selected_block))
+    )
+    assert selected_config.selection is None
+    assert selected_config.use_estimator == "tuned"
+    forecast_df = forecast_sklearn(
+        df=provide_local_window_df.copy(), forecast_config=selected_config
+    )
+    assert "estimator" not in forecast_df.attrs
+    pd.testing.assert_series_equal(
+        forecast_df["pred"],
+        forecast_sklearn(
+            df=provide_local_window_df.copy(), forecast_config=tuned_config
+        )["pred"],
+    )
+
+    with pytest.raises(ValueError):
+        create_trials(
+            forecast_config=forecast.forecast_config,
+            tuning_config=Tuning_Config(candidates=["numpy.missing"]),
+        )
+    sampled = create_trials(
+        forecast_config=forecast.forecast_config,
+        tuning_config=tuning_config.model_copy(update={"n_samples": 4}),
+    )
+    assert len(sampled) == 4
+
+
+def test_predict_last(
+    provide_forecast_config, provide_fast_forecast_config, provide_local_data_dir
+):
+    data_config = Data_Config(
+        df_path="BASE_df_wide.ftr", df_format="ftr", date_column="Day_Hours"
+    )
+    df = add_columns(
+        load_station_sorte(
+            pandas_connection=ArrowFileSource(str(provide_local_data_dir)),
+            data_config=data_config,
+            station="2",
+            sorte="diesel",
+        )
+    )
+    original_df = df.copy()
+    window_df = filter_n_days_before(df, n_before=provide_forecast_config.n_before)
+    expected = forecast_sklearn(
+        df=window_df.copy(), forecast_config=provide_forecast_config
+    )
+    expected_pred = expected.loc[expected.is_last == 1, "pred"].to_numpy()
+
+    # The window of n_before days is used without copying df, which is not modified
+    pred = predict_last(
+        df=df,
+        forecast_config=provide_forecast_config,
+        n_before=provide_forecast_config.n_before,
+    )
+    pd.testing.assert_frame_equal(df, original_df)
+    assert pred.dtype == np.float64
+    assert pred == pytest.approx(expected_pred, abs=1e-4)
+    assert predict_last(
+        df=window_df, forecast_config=provide_forecast_config, dtype=np.float64
+    ) == pytest.approx(expected_pred)
+
+    # Prediction rows before training rows and the estimators fitted on a df
+    shuffled_df = window_df.sample(frac=1, random_state=0)
+    shuffled_pred = predict_last(
+        df=shuffled_df, forecast_config=provide_forecast_config
+    )
+    is_last = shuffled_df["is_last"].to_numpy() == 1
+    order = np.argsort(shuffled_df.index.to_numpy()[is_last])
+    assert shuffled_pred[order] == pytest.approx(pred, abs=1e-4)
+    ridge_config = provide_fast_forecast_config.model_copy(
+        update={"use_estimator_class": "numpy", "use_estimator": "ridge"}
+    )
+    ridge = forecast_sklearn(df=window_df.copy(), forecast_config=ridge_config)
+    assert predict_last(df=window_df, forecast_config=ridge_config) == pytest.approx(
+        ridge.loc[ridge.is_last == 1, "pred"].to_numpy(), abs=1e-4
+    )
+
+    # A warm estimator is reused and other horizon modes run on a copy
+    model_cache = ModelCache(Model_Cache_Config())
+    for _ in range(2):
+        predict_last(
+            df=window_df,
+            forecast_config=provide_forecast_config,
+            model_cache=model_cache,
+            series_id="diesel_2",
+        )
+    assert len(model_cache.models) == 1
+    pooled_pred = predict_last(
+        df=window_df,
+        forecast_config=provide_forecast_config.model_copy(
+            update={"horizon_mode": "pooled"}
+        ),
+    )
+    assert len(pooled_pred) == len(pred) and np.isfinite(pooled_pred).all()
+    pd.testing.assert_frame_equal(df, original_df)
+
+
+def test_export(provide_forecast_config, provide_local_window_df, tmp_path):
+    forecast_config = provide_forecast_config.model_copy(
+        update={"export": Export_Config(directory=str(tmp_path))}
+    )
+    forecast_df = forecast_sklearn(
+        df=provide_local_window_df.copy(),
+        forecast_config=forecast_config,
+        series_id="e5_1",
+    )
+    expected = forecast_df.loc[forecast_df.is_last == 1, "pred"].to_numpy()
+    assert (tmp_path / "e5_1.npz").exists()
+
+    # Series without id and the fits of a backtest are not exported
+    forecast_sklearn(df=provide_local_window_df.copy(), forecast_config=forecast_config)
+    backtest(
+        frames=[
+            (
+                ("1", "e5"),
+                provide_local_window_df[provide_local_window_df.is_last == 0],
+            )
+        ],
+        forecast_config=forecast_config.model_copy(update={"horizon_mode": "pooled"}),
+        n_cutoffs=2,
+    )
+    assert [file.name for file in tmp_path.iterdir()] == ["e5_1.npz"]
+    with pytest.raises(ValueError):
+        load_exported(directory=str(tmp_path), series_id="")
+
+    # The exported model predicts exactly like the estimator, also from float32 arrays and missing values
+    pred = predict_exported(
+        df=provide_local_window_df, directory=str(tmp_path), series_id="e5_1"
+    )
+    np.testing.assert_array_equal(pred, expected)
+    ensemble = load_exported(directory=str(tmp_path), series_id="e5_1")
+    assert isinstance(ensemble.threshold, np.ndarray)
+    exogenous_vars = ensemble.feature_names
+    X = provide_local_window_df[exogenous_vars].to_numpy(dtype=np.float32)
+    X[::5, 0] = np.nan
+    estimator = HistGradientBoostingRegressor(random_state=1, min_samples_leaf=7).fit(
+        provide_local_window_df[exogenous_vars].to_numpy(), forecast_df["price"]
+    )
+    export_estimator(estimator=estimator, path=str(tmp_path / "array.npz"))
+    np.testing.assert_array_equal(
+        CompiledEnsemble.load(str(tmp_path / "array.npz"), mmap=False).predict(X),
+        estimator.predict(X),
+    )
+    with pytest.raises(TypeError):
+        export_estimator(estimator=Ridge(), path=str(tmp_path / "ridge.npz"))
+
+    # Serving from the export neither imports sklearn nor fits
+    code = (
+        "import sys; import numpy as np; "
+        "from tpa_analytics_engine.models.export import load_exported; "
+        f"ensemble = load_exported({str(tmp_path)!r}, 'e5_1'); "
+        "ensemble.predict(np.zeros((2, len(ensemble.feature_names)))); "
+        "print('sklearn' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout
+    assert output.strip() == "False"